@@ -8,9 +8,35 @@ from django.core.paginator import Paginator
 from django.db.models import Q
 from .models import LoaiMoHinh
 import json
-from django.core.files.storage import FileSystemStorage
-from django.conf import settings
-import os
+from django.db import transaction
+from i3dm_app.blob_store import (
+    acquire_blob,
+    release_blob,
+    store_chunked_upload,
+    store_upload,
+    use_hashing_upload,
+)
+from i3dm_app.chunked_upload import UploadError, upload_store
+
+
+def store_model_file(request, field, upload_field):
+    """
+    Lưu file của field multipart hoặc session upload theo chunk vào blob store
+    (1 file cho mỗi nội dung), trả về path cho url_glb / url_b3dm
+    """
+    if field in request.FILES:
+        return store_upload(request.FILES[field])
+    return store_chunked_upload(request.POST.get(upload_field))
+
+
+def uploaded_name(request, field, upload_field):
+    """Tên file của field multipart hoặc của session upload theo chunk (None nếu không có)"""
+    if field in request.FILES:
+        return request.FILES[field].name
+    upload_id = request.POST.get(upload_field)
+    if upload_id:
+        return upload_store.completed(upload_id)['filename']
+    return None
 
 
 # ✅ API LẤY DANH SÁCH LOẠI MÔ HÌNH (CÓ PHÂN TRANG VÀ LỌC)
@@ -153,6 +179,7 @@ def update_model_type(request, model_type_id):
         data = json.loads(request.body)
         
         # Cập nhật các field
+        old_urls = (model_type.url_glb, model_type.url_b3dm)
         if 'url_glb' in data:
             url_glb = data['url_glb'].strip()
             model_type.url_glb = url_glb if url_glb else None
@@ -206,8 +233,13 @@ def update_model_type(request, model_type_id):
                 'error': 'Phải có ít nhất một URL (GLB hoặc B3DM)'
             }, status=400)
         
-        # Lưu
-        model_type.save()
+        # Lưu (url trỏ tới blob dùng chung -> cập nhật số tham chiếu)
+        with transaction.atomic():
+            for old, new in zip(old_urls, (model_type.url_glb, model_type.url_b3dm)):
+                if old != new:
+                    acquire_blob(new)
+                    release_blob(old)
+            model_type.save()
         
         return JsonResponse({
             'success': True,
@@ -269,7 +301,10 @@ def delete_model_type(request, model_type_id):
             }, status=400)
         
         loai_cap_nhat = model_type.loai_cap_nhat
-        model_type.delete()
+        with transaction.atomic():
+            release_blob(model_type.url_glb)
+            release_blob(model_type.url_b3dm)
+            model_type.delete()
         
         return JsonResponse({
             'success': True,
@@ -332,9 +367,14 @@ def upload_model_type_file(request):
     """
     API upload file GLB/B3DM và tạo loại mô hình mới
     Endpoint: POST /api/model-types/upload/
+
+    File: glb_file / b3dm_file (multipart), hoặc glb_upload_id / b3dm_upload_id
+    (session upload theo chunk đã complete - /api/i3dm/uploads/)
     """
     try:
         print("📡 POST /api/model-types/upload/")
+        # Hash file trong lúc nhận -> lưu 1 lần theo nội dung (blobs/<sha256>.glb)
+        use_hashing_upload(request)
 
         # =========================
         # 1️⃣ LẤY & VALIDATE DATA
@@ -373,59 +413,48 @@ def upload_model_type_file(request):
         # =========================
         # 3️⃣ LẤY FILE
         # =========================
-        glb_file = request.FILES.get('glb_file')
-        b3dm_file = request.FILES.get('b3dm_file')
+        try:
+            glb_name = uploaded_name(request, 'glb_file', 'glb_upload_id')
+            b3dm_name = uploaded_name(request, 'b3dm_file', 'b3dm_upload_id')
+        except UploadError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=e.status)
 
-        if not glb_file and not b3dm_file:
+        if not glb_name and not b3dm_name:
             return JsonResponse({
                 'success': False,
                 'error': 'Phải upload ít nhất một file (GLB hoặc B3DM)'
             }, status=400)
 
-        if glb_file and not glb_file.name.lower().endswith('.glb'):
+        if glb_name and not glb_name.lower().endswith('.glb'):
             return JsonResponse({
                 'success': False,
                 'error': 'File GLB phải có đuôi .glb'
             }, status=400)
 
-        if b3dm_file and not b3dm_file.name.lower().endswith('.b3dm'):
+        if b3dm_name and not b3dm_name.lower().endswith('.b3dm'):
             return JsonResponse({
                 'success': False,
                 'error': 'File B3DM phải có đuôi .b3dm'
             }, status=400)
 
         # =========================
-        # 4️⃣ LƯU FILE
+        # 4️⃣ LƯU FILE + 5️⃣ TẠO RECORD DB
+        # File trùng nội dung với file đã có chỉ tăng số tham chiếu, không lưu lại
         # =========================
-        model_types_dir = os.path.join(settings.MEDIA_ROOT, 'model_types')
-        os.makedirs(model_types_dir, exist_ok=True)
-
-        fs = FileSystemStorage(location=model_types_dir)
-
-        url_glb = None
-        url_b3dm = None
-        safe_name = loai_cap_nhat.replace(' ', '_').replace('/', '_')
-
-        if glb_file:
-            filename = f"{safe_name}_{glb_file.name}"
-            saved = fs.save(filename, glb_file)
-            url_glb = f"model_types/{saved}"
-
-        if b3dm_file:
-            filename = f"{safe_name}_{b3dm_file.name}"
-            saved = fs.save(filename, b3dm_file)
-            url_b3dm = f"model_types/{saved}"
-
-        # =========================
-        # 5️⃣ TẠO RECORD DB
-        # =========================
-        model_type = LoaiMoHinh.objects.create(
-            ten_loai_mo_hinh=ten_loai_mo_hinh,
-            loai_cap_nhat=loai_cap_nhat,
-            parent=parent,          # ✅ None hoặc int
-            url_glb=url_glb,
-            url_b3dm=url_b3dm
-        )
+        with transaction.atomic():
+            url_glb = store_model_file(request, 'glb_file', 'glb_upload_id') if glb_name else None
+            url_b3dm = store_model_file(request, 'b3dm_file', 'b3dm_upload_id') if b3dm_name else None
+
+            model_type = LoaiMoHinh.objects.create(
+                ten_loai_mo_hinh=ten_loai_mo_hinh,
+                loai_cap_nhat=loai_cap_nhat,
+                parent=parent,          # ✅ None hoặc int
+                url_glb=url_glb,
+                url_b3dm=url_b3dm
+            )
 
         print(f"✅ Created model type ID={model_type.id}")
 
@@ -445,6 +474,10 @@ def upload_model_type_file(request):
             }
         }, status=201)
 
+    except UploadError as e:
+        # Session upload theo chunk đã bị claim / xóa trong lúc lưu
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
+
     except Exception as e:
         print("❌ Upload error:", str(e))
         import traceback
@@ -460,6 +493,7 @@ def upload_model_type_file(request):
 @require_http_methods(["POST"])
 def update_model_type_file(request, model_type_id):
     try:
+        use_hashing_upload(request)
         model_type = LoaiMoHinh.objects.get(id=model_type_id)
 
         ten_loai_mo_hinh = request.POST.get('ten_loai_mo_hinh', '').strip()
@@ -477,22 +511,27 @@ def update_model_type_file(request, model_type_id):
             model_type.parent = None
         else:
             model_type.parent = int(parent)
-        storage = FileSystemStorage(location=settings.MEDIA_ROOT)
 
-        if 'glb_file' in request.FILES:
-            glb_file = request.FILES['glb_file']
-            glb_path = storage.save(f"model_types/{glb_file.name}", glb_file)
-            model_type.url_glb = glb_path
+        try:
+            glb_name = uploaded_name(request, 'glb_file', 'glb_upload_id')
+            b3dm_name = uploaded_name(request, 'b3dm_file', 'b3dm_upload_id')
+        except UploadError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
 
-        if 'b3dm_file' in request.FILES:
-            b3dm_file = request.FILES['b3dm_file']
-            b3dm_path = storage.save(f"model_types/{b3dm_file.name}", b3dm_file)
-            model_type.url_b3dm = b3dm_path
-
-        if not model_type.url_glb and not model_type.url_b3dm:
+        if not (glb_name or model_type.url_glb) and not (b3dm_name or model_type.url_b3dm):
             return JsonResponse({'success': False, 'error': 'Phải có GLB hoặc B3DM'}, status=400)
 
-        model_type.save()
+        # File mới thay file cũ: blob cũ bớt 1 tham chiếu
+        with transaction.atomic():
+            if glb_name:
+                old_url, model_type.url_glb = model_type.url_glb, store_model_file(request, 'glb_file', 'glb_upload_id')
+                release_blob(old_url)
+
+            if b3dm_name:
+                old_url, model_type.url_b3dm = model_type.url_b3dm, store_model_file(request, 'b3dm_file', 'b3dm_upload_id')
+                release_blob(old_url)
+
+            model_type.save()
 
         return JsonResponse({
             'success': True,
@@ -501,3 +540,6 @@ def update_model_type_file(request, model_type_id):
 
     except LoaiMoHinh.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Không tồn tại'}, status=404)
+
+    except UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
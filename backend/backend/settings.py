@@ -56,6 +56,44 @@ REST_FRAMEWORK = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Dung lượng tối đa của GLB cache dùng chung cho I3DMGenerator (bytes)
+I3DM_GLB_CACHE_MAX_BYTES = int(os.environ.get('I3DM_GLB_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Ghi bản nén sẵn .br (cần package brotli) / .gz cạnh tile I3DM và tileset.json lúc generate
+I3DM_PRECOMPRESS = os.environ.get('I3DM_PRECOMPRESS', '1').lower() in ('1', 'true')
+
+# Job generate chạy nền: job running không heartbeat quá số giây này (worker chết) được đưa lại
+# hàng đợi, tối đa I3DM_JOB_MAX_ATTEMPTS lần rồi chuyển failed
+I3DM_JOB_STALE_TIMEOUT = int(os.environ.get('I3DM_JOB_STALE_TIMEOUT', 600))
+I3DM_JOB_MAX_ATTEMPTS = int(os.environ.get('I3DM_JOB_MAX_ATTEMPTS', 3))
+
+# Session upload theo chunk (GLB / B3DM lớn, resume được) - cùng filesystem với MEDIA_ROOT
+# để file đã upload xong được rename vào chỗ, không copy
+I3DM_UPLOAD_DIR = os.environ.get('I3DM_UPLOAD_DIR', os.path.join(BASE_DIR, 'upload_sessions'))
+I3DM_UPLOAD_MAX_BYTES = int(os.environ.get('I3DM_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Session không có chunk mới sau số giây này bị xóa
+I3DM_UPLOAD_SESSION_TTL = int(os.environ.get('I3DM_UPLOAD_SESSION_TTL', 24 * 3600))
+
+# DEM local (tile .npy memory-mapped) cho terrain height - ingest bằng: manage.py ingest_dem
+TERRAIN_DEM_DIR = os.environ.get('TERRAIN_DEM_DIR', os.path.join(BASE_DIR, 'dem'))
+
+# Circuit breaker terrain server: số lỗi liên tiếp thì ngắt, số giây ngắt trước khi thử lại
+TERRAIN_FAILURE_THRESHOLD = int(os.environ.get('TERRAIN_FAILURE_THRESHOLD', 5))
+TERRAIN_COOLDOWN = float(os.environ.get('TERRAIN_COOLDOWN', 30))
+
+# Cache độ cao terrain (LRU memory + SQLite), key theo ô lưới TERRAIN_CACHE_RESOLUTION độ
+# TERRAIN_CACHE_DB rỗng -> chỉ cache trong memory
+TERRAIN_CACHE_DB = os.environ.get('TERRAIN_CACHE_DB', os.path.join(BASE_DIR, 'terrain_cache.sqlite3'))
+TERRAIN_CACHE_RESOLUTION = float(os.environ.get('TERRAIN_CACHE_RESOLUTION', 1e-5))
+TERRAIN_CACHE_TTL = int(os.environ.get('TERRAIN_CACHE_TTL', 30 * 24 * 3600))
+TERRAIN_CACHE_MEMORY_ENTRIES = 100000
+TERRAIN_CACHE_DISK_ENTRIES = 5000000
+
+# Terrain tile quantized-mesh (/api/i3dm/terrain/tiles/) - cache tile gzip trên đĩa
+TERRAIN_TILE_MAX_ZOOM = int(os.environ.get('TERRAIN_TILE_MAX_ZOOM', 14))
+TERRAIN_TILE_CACHE_DIR = os.environ.get('TERRAIN_TILE_CACHE_DIR', os.path.join(BASE_DIR, 'terrain_tiles'))
+TERRAIN_TILE_CACHE_MAX_BYTES = int(os.environ.get('TERRAIN_TILE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -1,11 +1,13 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from i3dm_app.views import serve_media_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('glb_app.urls')),
     path('api/i3dm/', include('i3dm_app.urls')),
     path('QLModel/', include('QLModel.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # File media (tile, GLB, B3DM): Range, ETag / 304, cache immutable, bản nén sẵn .br / .gz
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media_file, name='media'),
+]
@@ -1,15 +1,10 @@
 import os
 from django.db import models
-from django.core.files.storage import default_storage
 
 def glb_upload_path(instance, filename):
-    upload_path = os.path.join("models", filename)
-    
-    # Nếu file đã tồn tại thì xóa
-    if default_storage.exists(upload_path):
-        default_storage.delete(upload_path)
-    
-    return upload_path
+    # Trùng tên thì storage tự đổi tên - không xóa file model khác đang dùng.
+    # Upload qua API lưu theo nội dung (i3dm_app.blob_store), không qua đây
+    return os.path.join("models", filename)
 
 class GlbModel(models.Model):
     name = models.CharField(max_length=255)
@@ -7,7 +7,7 @@ from django.http import HttpResponse
 
 # views.py - Fix CSRF 403 với csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.csrf import csrf_exempt, csrf_protect, ensure_csrf_cookie
 
 # def upload_glb(request):
 #     if request.method == 'POST':
@@ -36,7 +36,10 @@ from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 
 #Phần lấy model
 from django.http import JsonResponse
+from django.db import transaction
 from .models import GlbModel
+from i3dm_app.blob_store import release_blob, store_chunked_upload, store_upload, use_hashing_upload
+from i3dm_app.chunked_upload import UploadError, upload_store
 
 def glb_models_api(request):
     models = GlbModel.objects.all()
@@ -78,8 +81,17 @@ def upload_tileset_success(request):
     return HttpResponse("Upload Tileset thành công!")
 
 # ✅ FORM UPLOAD (Traditional HTML Form)
+@csrf_exempt  # CSRF vẫn được kiểm tra trong _upload_glb, sau khi đổi upload handler
 def upload_glb(request):
     """Traditional form upload - deprecated, dùng API thay"""
+    if request.method == 'POST':
+        # Hash file trong lúc nhận - phải đặt trước khi CsrfViewMiddleware đọc request.POST
+        use_hashing_upload(request)
+    return _upload_glb(request)
+
+
+@csrf_protect
+def _upload_glb(request):
     if request.method == 'POST':
         try:
             name = request.POST.get('name', 'Model')
@@ -97,7 +109,6 @@ def upload_glb(request):
 
             glb_instance = GlbModel(
                 name=name,
-                glb_file=glb_file,
                 lon=lon,
                 lat=lat,
                 height=height,
@@ -106,7 +117,9 @@ def upload_glb(request):
                 rotation_y=rotation_y,
                 rotation_z=rotation_z
             )
-            glb_instance.save()
+            with transaction.atomic():
+                glb_instance.glb_file.name = store_upload(glb_file)
+                glb_instance.save()
 
             try:
                 parse_glb_file(glb_instance)
@@ -182,7 +195,8 @@ def upload_glb_api(request):
     POST: /api/upload-glb/
     
     Form data:
-    - glb_file: file upload
+    - glb_file: file upload, hoặc upload_id: session upload theo chunk đã complete
+      (/api/i3dm/uploads/ - dùng cho file lớn)
     - model_name: tên model
     - lon, lat, height: tọa độ
     - scale: tỷ lệ
@@ -192,16 +206,30 @@ def upload_glb_api(request):
         print(f"📡 POST /api/upload-glb/")
         print(f"🔐 CSRF in headers: {'HTTP_X_CSRFTOKEN' in request.META}")
         
-        if 'glb_file' not in request.FILES:
+        # Hash file trong lúc nhận -> lưu 1 lần theo nội dung (blobs/<sha256>.glb)
+        use_hashing_upload(request)
+        glb_file = request.FILES.get('glb_file')
+        upload_id = request.POST.get('upload_id')
+        if glb_file:
+            glb_name, glb_size = glb_file.name, glb_file.size
+        elif upload_id:
+            try:
+                upload = upload_store.completed(upload_id)
+            except UploadError as e:
+                return JsonResponse({
+                    'error': 'Upload error',
+                    'message': str(e)
+                }, status=e.status)
+            glb_name, glb_size = upload['filename'], upload['size']
+        else:
             return JsonResponse({
                 'error': 'No file',
                 'message': 'Không tìm thấy file'
             }, status=400)
 
-        glb_file = request.FILES['glb_file']
-        print(f"📦 File: {glb_file.name} ({glb_file.size} bytes)")
+        print(f"📦 File: {glb_name} ({glb_size} bytes)")
         
-        if not glb_file.name.endswith('.glb'):
+        if not glb_name.endswith('.glb'):
             return JsonResponse({
                 'error': 'Invalid file type',
                 'message': 'Chỉ chấp nhận file .glb'
@@ -230,10 +258,9 @@ def upload_glb_api(request):
                 'message': 'Vui lòng nhập tên model'
             }, status=400)
 
-        # Tạo model
+        # Tạo model - glb_file trỏ tới blob dùng chung (file trùng nội dung không lưu lại)
         glb_instance = GlbModel(
             name=name,
-            glb_file=glb_file,
             lon=lon,
             lat=lat,
             height=height,
@@ -242,7 +269,12 @@ def upload_glb_api(request):
             rotation_y=rotation_y,
             rotation_z=rotation_z
         )
-        glb_instance.save()
+        with transaction.atomic():
+            if glb_file:
+                glb_instance.glb_file.name = store_upload(glb_file)
+            else:
+                glb_instance.glb_file.name = store_chunked_upload(upload_id)
+            glb_instance.save()
         print(f"✅ Model saved: {name} (ID: {glb_instance.id})")
 
         # Parse mesh
@@ -266,6 +298,13 @@ def upload_glb_api(request):
             }
         }, status=200)
 
+    except UploadError as e:
+        # Session upload theo chunk đã bị claim / xóa trong lúc lưu
+        return JsonResponse({
+            'error': 'Upload error',
+            'message': str(e)
+        }, status=e.status)
+
     except Exception as e:
         print(f"❌ Upload error: {str(e)}")
         return JsonResponse({
@@ -361,12 +400,13 @@ def delete_glb_model(request, model_id):
         model = GlbModel.objects.get(id=model_id)
         model_name = model.name
         
-        # Xoá file
-        if model.glb_file:
-            if os.path.exists(model.glb_file.path):
-                os.remove(model.glb_file.path)
-        
-        model.delete()
+        with transaction.atomic():
+            # Xoá file (blob dùng chung: chỉ xóa khi không còn tham chiếu)
+            if model.glb_file and not release_blob(model.glb_file.name):
+                if os.path.exists(model.glb_file.path):
+                    os.remove(model.glb_file.path)
+            
+            model.delete()
         
         print(f"✅ Model deleted: {model_name}")
         return JsonResponse({
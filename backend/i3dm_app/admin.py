@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import I3DMTileset
+from .models import I3DMTileset, I3DMJob
 
 @admin.register(I3DMTileset)
 class I3DMTilesetAdmin(admin.ModelAdmin):
@@ -27,4 +27,11 @@ class I3DMTilesetAdmin(admin.ModelAdmin):
         ('Metadata', {
             'fields': ('created_at',)
         })
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(I3DMJob)
+class I3DMJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'job_type', 'status', 'stage', 'progress', 'tileset', 'created_at']
+    list_filter = ['status', 'job_type', 'created_at']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'stage_timings']
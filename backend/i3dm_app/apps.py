@@ -3,3 +3,34 @@ from django.apps import AppConfig
 
 class I3DmAppConfig(AppConfig):
     name = 'i3dm_app'
+
+    def ready(self):
+        import os
+        from django.conf import settings
+        from . import chunked_upload
+        from .i3dm_generator import glb_cache, GLB_CACHE_MAX_BYTES
+        from . import quantized_mesh, terrain_cache, terrain_helper
+
+        glb_cache.max_bytes = getattr(settings, 'I3DM_GLB_CACHE_MAX_BYTES', GLB_CACHE_MAX_BYTES)
+        terrain_cache.height_cache.configure(
+            db_path=getattr(settings, 'TERRAIN_CACHE_DB', None),
+            resolution=getattr(settings, 'TERRAIN_CACHE_RESOLUTION', terrain_cache.TERRAIN_CACHE_RESOLUTION),
+            ttl=getattr(settings, 'TERRAIN_CACHE_TTL', terrain_cache.TERRAIN_CACHE_TTL),
+            memory_entries=getattr(settings, 'TERRAIN_CACHE_MEMORY_ENTRIES',
+                                   terrain_cache.TERRAIN_CACHE_MEMORY_ENTRIES),
+            disk_entries=getattr(settings, 'TERRAIN_CACHE_DISK_ENTRIES', terrain_cache.TERRAIN_CACHE_DISK_ENTRIES),
+        )
+        terrain_helper.terrain_client.breaker.configure(
+            failure_threshold=getattr(settings, 'TERRAIN_FAILURE_THRESHOLD', terrain_helper.TERRAIN_FAILURE_THRESHOLD),
+            cooldown=getattr(settings, 'TERRAIN_COOLDOWN', terrain_helper.TERRAIN_COOLDOWN),
+        )
+        quantized_mesh.terrain_tile_cache.configure(
+            root=getattr(settings, 'TERRAIN_TILE_CACHE_DIR', None),
+            max_bytes=getattr(settings, 'TERRAIN_TILE_CACHE_MAX_BYTES', quantized_mesh.TERRAIN_TILE_CACHE_MAX_BYTES),
+        )
+        chunked_upload.upload_store.configure(
+            root=getattr(settings, 'I3DM_UPLOAD_DIR',
+                         os.path.join(os.path.dirname(settings.MEDIA_ROOT), 'upload_sessions')),
+            max_bytes=getattr(settings, 'I3DM_UPLOAD_MAX_BYTES', chunked_upload.UPLOAD_MAX_BYTES),
+            ttl=getattr(settings, 'I3DM_UPLOAD_SESSION_TTL', chunked_upload.UPLOAD_SESSION_TTL),
+        )
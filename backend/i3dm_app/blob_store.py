@@ -0,0 +1,259 @@
+"""
+i3dm_app/blob_store.py
+Lưu file model upload (GLB / B3DM) theo SHA-256 nội dung: cùng nội dung chỉ có 1 file
+media/blobs/<sha256[:2]>/<sha256>.<đuôi>, đếm tham chiếu trong ModelBlob.
+- upload multipart được hash ngay trong lúc nhận (HashingUploadHandler), file tạm nằm sẵn
+  trong blobs/tmp nên chỉ cần rename vào chỗ
+- upload theo chunk (chunked_upload) đã có SHA-256 kiểm tra lúc complete
+Path content-addressed nên serve được với cache immutable, GlbCache dùng chung giữa các model.
+Thao tác file chỉ chạy sau khi transaction commit (transaction.on_commit): rollback thì blobs/
+không có file thiếu row và không mất file của row còn tham chiếu.
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+
+from .chunked_upload import upload_store
+from .models import ModelBlob
+
+
+BLOB_DIR = 'blobs'
+# Quyền file giống FileSystemStorage mặc định (file tạm tạo ra là 0600)
+BLOB_FILE_MODE = 0o644
+
+_BLOB_PATH_RE = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+
+def blob_relative_path(sha256, filename):
+    """'blobs/ab/ab12...ef.glb' - giữ đuôi file gốc để Content-Type đúng khi serve"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    return f'{BLOB_DIR}/{sha256[:2]}/{sha256}{ext}'
+
+
+def is_blob_path(path):
+    return bool(path) and bool(_BLOB_PATH_RE.match(str(path).replace('\\', '/')))
+
+
+def _tmp_dir():
+    path = Path(settings.MEDIA_ROOT) / BLOB_DIR / 'tmp'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class HashedUploadedFile(UploadedFile):
+    """File upload ghi vào blobs/tmp (cùng filesystem với blob), sha256 tính xong khi nhận hết"""
+
+    def __init__(self, name, content_type, charset, content_type_extra=None):
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=_tmp_dir())
+        super().__init__(file, name, content_type, 0, charset, content_type_extra)
+        self.sha256 = None
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # File đã được store_upload rename đi
+            pass
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Upload handler: mỗi chunk vừa ghi ra file tạm vừa cập nhật SHA-256 (không đọc lại file)"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.file = HashedUploadedFile(self.file_name, self.content_type, self.charset, self.content_type_extra)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hasher.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def use_hashing_upload(request):
+    """Gọi trước khi đọc request.POST / request.FILES"""
+    request.upload_handlers = [HashingUploadHandler(request)]
+
+
+def place_blob(source_path, sha256, filename, root=None):
+    """
+    Đưa file đã hash vào blobs/: đã có file cùng nội dung thì bỏ source (dedup),
+    chưa có thì rename (cùng filesystem thì không copy).
+
+    Returns:
+        (relative_path, deduplicated)
+    """
+    relative_path = blob_relative_path(sha256, filename)
+    dest = Path(root or settings.MEDIA_ROOT) / relative_path
+    if dest.exists():
+        os.unlink(source_path)
+        return relative_path, True
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.chmod(source_path, BLOB_FILE_MODE)
+    shutil.move(str(source_path), str(dest))
+    return relative_path, False
+
+
+def cleanup_tmp_files(now=None, ttl=None):
+    """
+    Xóa file trong blobs/tmp cũ hơn ttl giây (mặc định TTL của upload session):
+    upload bị ngắt, hoặc transaction rollback nên file chưa bao giờ được đưa vào blobs/
+
+    Returns:
+        Số file đã xóa
+    """
+    now = time.time() if now is None else now
+    ttl = upload_store.ttl if ttl is None else ttl
+    removed = 0
+    for path in _tmp_dir().iterdir():
+        try:
+            if now - path.stat().st_mtime > ttl:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"🗑️ Removed {removed} stale blob temp file(s)")
+    return removed
+
+
+def _install_blob(source_path, sha256, filename):
+    """Sau commit: đưa file tạm vào blobs/ (hoặc bỏ nếu đã có file cùng nội dung)"""
+    relative_path, deduplicated = place_blob(source_path, sha256, filename)
+    if deduplicated:
+        print(f"♻️ Dedup: {filename} -> {relative_path}")
+    else:
+        print(f"💾 Stored blob: {filename} -> {relative_path}")
+
+
+def store_blob(source_path, sha256, filename):
+    """
+    Lưu file (đã biết SHA-256) vào blob store và tăng ref_count.
+
+    Row ModelBlob được ghi trong transaction, file tạm chỉ được đưa vào blobs/ khi
+    transaction ngoài cùng commit - rollback thì file tạm nằm lại blobs/tmp
+    (cleanup_tmp_files xóa sau TTL), không có file blob nào thiếu row.
+
+    Returns:
+        Path tương đối trong MEDIA_ROOT (gán cho FileField.name / url_glb / url_b3dm)
+    """
+    cleanup_tmp_files()
+    relative_path = blob_relative_path(sha256, filename)
+    with transaction.atomic():
+        blob, _ = ModelBlob.objects.select_for_update().get_or_create(
+            path=relative_path,
+            defaults={'sha256': sha256, 'size': os.path.getsize(source_path)}
+        )
+        blob.ref_count += 1
+        blob.save(update_fields=['ref_count'])
+        # ref_count > 0 đã commit trước khi file vào chỗ nên _delete_blob không xóa mất file này
+        transaction.on_commit(lambda: _install_blob(source_path, sha256, filename))
+    return relative_path
+
+
+def store_upload(uploaded):
+    """
+    Lưu file upload (request.FILES) vào blob store.
+
+    File từ HashingUploadHandler đã có sha256 + file tạm trong blobs/tmp (chỉ cần rename);
+    upload khác (trong memory) được ghi ra file tạm và hash trong cùng 1 lượt.
+    """
+    sha256 = getattr(uploaded, 'sha256', None)
+    if sha256 and hasattr(uploaded, 'temporary_file_path'):
+        # Tách khỏi NamedTemporaryFile (bị xóa khi request đóng file) vì file chỉ vào blobs/ lúc commit
+        fd, tmp_path = tempfile.mkstemp(dir=_tmp_dir(), suffix='.upload')
+        os.close(fd)
+        os.replace(uploaded.temporary_file_path(), tmp_path)
+        return store_blob(tmp_path, sha256, uploaded.name)
+
+    hasher = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=_tmp_dir(), suffix='.upload')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in uploaded.chunks():
+            hasher.update(chunk)
+            f.write(chunk)
+    return store_blob(tmp_path, hasher.hexdigest(), uploaded.name)
+
+
+def store_chunked_upload(upload_id):
+    """Lưu session upload theo chunk đã complete (SHA-256 đã kiểm tra) vào blob store"""
+    upload = upload_store.completed(upload_id)
+    tmp_path = upload_store.claim(upload_id, _tmp_dir() / f'{upload_id}.upload')
+    return store_blob(tmp_path, upload['sha256'], upload['filename'])
+
+
+def acquire_blob(relative_path):
+    """
+    Thêm 1 tham chiếu tới blob có sẵn (vd. url_glb được gán thẳng path của blob)
+
+    Returns:
+        True nếu path là blob đã lưu
+    """
+    if not is_blob_path(relative_path):
+        return False
+    with transaction.atomic():
+        blob = ModelBlob.objects.select_for_update().filter(path=relative_path).first()
+        if blob is None:
+            return False
+        blob.ref_count += 1
+        blob.save(update_fields=['ref_count'])
+    return True
+
+
+def _delete_blob(relative_path):
+    """
+    Sau commit: xóa row + file nếu blob vẫn không còn tham chiếu
+    (store_blob có thể đã tham chiếu lại blob trước khi callback này chạy)
+    """
+    with transaction.atomic():
+        blob = ModelBlob.objects.select_for_update().filter(path=relative_path, ref_count__lte=0).first()
+        if blob is None:
+            return
+        blob.delete()
+        # GlbCache đang mmap file vẫn đọc được sau unlink (inode còn tới khi đóng)
+        (Path(settings.MEDIA_ROOT) / relative_path).unlink(missing_ok=True)
+    print(f"🗑️ Deleted blob: {relative_path}")
+
+
+def release_blob(relative_path):
+    """
+    Bỏ 1 tham chiếu; hết tham chiếu thì xóa file blob (+ row) sau khi transaction commit
+    (rollback thì model vẫn trỏ tới file nên file phải còn).
+
+    Returns:
+        True nếu path thuộc blob store (caller không được tự xóa file),
+        False = file thường, caller xử lý như trước
+    """
+    if not is_blob_path(relative_path):
+        return False
+    with transaction.atomic():
+        blob = ModelBlob.objects.select_for_update().filter(path=relative_path).first()
+        if blob is None:
+            return True
+        blob.ref_count -= 1
+        blob.save(update_fields=['ref_count'])
+        if blob.ref_count <= 0:
+            transaction.on_commit(lambda: _delete_blob(relative_path))
+    return True
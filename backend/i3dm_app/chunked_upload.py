@@ -0,0 +1,398 @@
+"""
+i3dm_app/chunked_upload.py
+Upload file lớn (GLB / B3DM) theo chunk, resume được:
+- tạo session (tên file, size, sha256) -> file đích được cấp sẵn đủ size
+- mỗi chunk ghi thẳng vào đúng offset của file đó (nhiều chunk song song được)
+- complete: kiểm tra đủ byte + SHA-256, view dùng file bằng claim() (rename, không copy)
+Trạng thái lưu trên disk (meta.json + file đánh dấu từng chunk) nên dùng chung được giữa các worker.
+complete / claim giữ marker 'assembling' (tạo O_EXCL) trong lúc chạy, chunk đang ghi có marker
+trong writing/ - chunk không ghi xen vào file đang được hash hoặc đã complete.
+"""
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+# Kích thước chunk gợi ý cho client / tối đa 1 request
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_BYTES = 64 * 1024 * 1024
+# Dung lượng tối đa 1 file upload
+UPLOAD_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Session không có chunk mới sau khoảng này (giây) bị xóa
+UPLOAD_SESSION_TTL = 24 * 3600
+# complete chờ các chunk đang ghi dở tối đa chừng này (giây) rồi trả 409 để client thử lại
+UPLOAD_COMPLETE_WAIT = 5.0
+# Marker assembling / writing cũ hơn khoảng này (giây) là của process đã chết
+UPLOAD_MARKER_STALE = 600
+UPLOAD_EXTENSIONS = ('.glb', '.b3dm')
+
+# Đọc body request theo block khi ghi chunk
+_WRITE_BLOCK_BYTES = 1024 * 1024
+_SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    """Request upload không hợp lệ - views trả về JSON error với status tương ứng"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def merge_ranges(ranges):
+    """[(start, end), ...] (end không bao gồm) -> các đoạn đã sắp xếp, gộp đoạn chồng / liền nhau"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def missing_ranges(received, size):
+    """Các đoạn chưa nhận trong [0, size)"""
+    missing = []
+    position = 0
+    for start, end in received:
+        if start > position:
+            missing.append((position, start))
+        position = max(position, end)
+    if position < size:
+        missing.append((position, size))
+    return missing
+
+
+class UploadSessionStore:
+    """
+    Session upload theo chunk, mỗi session 1 thư mục trong root:
+      meta.json - filename, size, sha256, trạng thái
+      data      - file đích (cấp sẵn size bytes), chunk ghi thẳng vào offset
+      chunks/   - file rỗng <start>-<end> cho mỗi chunk đã ghi xong (tạo file là atomic,
+                  không cần lock khi nhiều request ghi song song)
+      writing/  - file rỗng cho mỗi chunk đang ghi
+      assembling - có khi complete / claim đang chạy
+    """
+
+    def __init__(self, root=None, max_bytes=UPLOAD_MAX_BYTES, ttl=UPLOAD_SESSION_TTL):
+        self.root = Path(root) if root else None
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._cleanup_lock = threading.Lock()
+
+    def configure(self, root=None, max_bytes=None, ttl=None):
+        if root:
+            self.root = Path(root)
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if ttl is not None:
+            self.ttl = ttl
+
+    def _dir(self, upload_id):
+        if not isinstance(upload_id, str) or not _SESSION_ID_RE.match(upload_id):
+            raise UploadError('Invalid upload_id')
+        path = self.root / upload_id
+        if not (path / 'meta.json').exists():
+            raise UploadError('Upload session not found', status=404)
+        return path
+
+    @staticmethod
+    def _write_meta(path, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path / 'meta.json')
+
+    def _meta(self, path):
+        with open(path / 'meta.json') as f:
+            return json.load(f)
+
+    def create(self, filename, size, sha256, extensions=UPLOAD_EXTENSIONS):
+        """
+        Tạo session mới.
+
+        Returns:
+            Trạng thái session (như status())
+
+        Raises:
+            UploadError
+        """
+        filename = os.path.basename(str(filename or '')).strip()
+        if not filename:
+            raise UploadError('filename is required')
+        if extensions and not filename.lower().endswith(tuple(extensions)):
+            raise UploadError(f'Only {", ".join(extensions)} files are allowed')
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError('size must be an integer')
+        if size <= 0:
+            raise UploadError('size must be positive')
+        if size > self.max_bytes:
+            raise UploadError(f'File too large (max {self.max_bytes:,} bytes)', status=413)
+        sha256 = str(sha256 or '').lower()
+        if not _SHA256_RE.match(sha256):
+            raise UploadError('sha256 must be a 64-character hex digest')
+
+        self.cleanup_stale()
+
+        upload_id = secrets.token_hex(16)
+        path = self.root / upload_id
+        (path / 'chunks').mkdir(parents=True)
+        (path / 'writing').mkdir()
+        # File đích đủ size ngay từ đầu (sparse nếu filesystem hỗ trợ)
+        with open(path / 'data', 'wb') as f:
+            f.truncate(size)
+        self._write_meta(path, {
+            'filename': filename,
+            'size': size,
+            'sha256': sha256,
+            'created': time.time(),
+            'complete': False,
+        })
+        print(f"📥 Upload session {upload_id}: {filename} ({size:,} bytes)")
+        return self.status(upload_id)
+
+    def _received(self, path):
+        ranges = []
+        for marker in os.listdir(path / 'chunks'):
+            start, _, end = marker.partition('-')
+            ranges.append((int(start), int(end)))
+        return merge_ranges(ranges)
+
+    def status(self, upload_id):
+        """
+        Returns:
+            dict: upload_id, filename, size, offset (số byte liên tục từ đầu đã nhận - resume từ đây),
+            received / missing (các đoạn [start, end)), complete
+        """
+        path = self._dir(upload_id)
+        meta = self._meta(path)
+        received = self._received(path)
+        offset = received[0][1] if received and received[0][0] == 0 else 0
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'chunk_size': UPLOAD_CHUNK_BYTES,
+            'offset': offset,
+            'received': received,
+            'missing': missing_ranges(received, meta['size']),
+            'complete': meta['complete'],
+        }
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """
+        Ghi length bytes đọc từ stream vào file đích tại offset.
+
+        Chunk chỉ được đánh dấu đã nhận khi ghi đủ length bytes - kết nối đứt giữa chừng
+        thì client gửi lại chunk đó.
+
+        Raises:
+            UploadError
+        """
+        path = self._dir(upload_id)
+        meta = self._meta(path)
+        if meta['complete']:
+            raise UploadError('Upload already completed', status=409)
+        try:
+            offset, length = int(offset), int(length)
+        except (TypeError, ValueError):
+            raise UploadError('Upload-Offset and Content-Length are required')
+        if length <= 0:
+            raise UploadError('Empty chunk')
+        if length > UPLOAD_MAX_CHUNK_BYTES:
+            raise UploadError(f'Chunk too large (max {UPLOAD_MAX_CHUNK_BYTES:,} bytes)', status=413)
+        if offset < 0 or offset + length > meta['size']:
+            raise UploadError(f'Chunk [{offset}, {offset + length}) outside file size {meta["size"]}', status=416)
+
+        # Đánh dấu đang ghi rồi mới kiểm tra assembling / complete: complete hoặc thấy marker này
+        # (chờ chunk ghi xong), hoặc chunk thấy complete đã bắt đầu (từ chối)
+        writing = path / 'writing' / secrets.token_hex(8)
+        writing.parent.mkdir(exist_ok=True)
+        writing.touch()
+        try:
+            if (path / 'assembling').exists() or self._meta(path)['complete']:
+                raise UploadError('Upload is being completed', status=409)
+
+            written = 0
+            with open(path / 'data', 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    block = stream.read(min(_WRITE_BLOCK_BYTES, length - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    written += len(block)
+
+            if written < length:
+                raise UploadError(f'Incomplete chunk: received {written} of {length} bytes')
+            (path / 'chunks' / f'{offset}-{offset + length}').touch()
+        finally:
+            writing.unlink(missing_ok=True)
+        return self.status(upload_id)
+
+    @staticmethod
+    def _is_stale(marker, now=None):
+        try:
+            return (now or time.time()) - marker.stat().st_mtime > UPLOAD_MARKER_STALE
+        except FileNotFoundError:
+            return True
+
+    def _acquire(self, path):
+        """
+        Tạo marker assembling (O_EXCL: chỉ 1 complete / claim chạy cho mỗi session)
+
+        Raises:
+            UploadError
+        """
+        marker = path / 'assembling'
+        for _ in range(2):
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return marker
+            except FileExistsError:
+                if not self._is_stale(marker):
+                    break
+                marker.unlink(missing_ok=True)
+            except FileNotFoundError:
+                # Session vừa bị claim / xóa
+                raise UploadError('Upload session not found', status=404)
+        raise UploadError('Upload is already being completed', status=409)
+
+    def _wait_for_writes(self, path, timeout=UPLOAD_COMPLETE_WAIT):
+        """Chờ các chunk đang ghi dở (writing/) xong"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                active = [m for m in (path / 'writing').iterdir() if not self._is_stale(m)]
+            except FileNotFoundError:
+                return
+            if not active:
+                return
+            if time.monotonic() > deadline:
+                raise UploadError(f'{len(active)} chunk(s) still being written, retry later', status=409)
+            time.sleep(0.05)
+
+    def complete(self, upload_id):
+        """
+        Kiểm tra đủ byte và SHA-256 của file đích.
+
+        SHA-256 sai thì xóa đánh dấu các chunk (không biết chunk nào hỏng) để client gửi lại.
+
+        Raises:
+            UploadError
+        """
+        path = self._dir(upload_id)
+        if self._meta(path)['complete']:
+            return self.status(upload_id)
+
+        marker = self._acquire(path)
+        try:
+            self._wait_for_writes(path)
+            # Đọc lại sau khi giữ marker: complete khác có thể vừa xong
+            meta = self._meta(path)
+            if meta['complete']:
+                return self.status(upload_id)
+
+            missing = missing_ranges(self._received(path), meta['size'])
+            if missing:
+                raise UploadError(f'Upload incomplete: {len(missing)} missing range(s)', status=409)
+
+            with open(path / 'data', 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+            if digest != meta['sha256']:
+                shutil.rmtree(path / 'chunks')
+                (path / 'chunks').mkdir()
+                raise UploadError('SHA-256 mismatch, upload the file again', status=422)
+
+            # Ghi complete trước khi bỏ marker: chunk đến sau luôn thấy 1 trong 2
+            meta['complete'] = True
+            self._write_meta(path, meta)
+        finally:
+            marker.unlink(missing_ok=True)
+        print(f"✅ Upload {upload_id} complete: {meta['filename']} (sha256 {digest[:12]}...)")
+        return self.status(upload_id)
+
+    def completed(self, upload_id):
+        """
+        Meta của session đã complete (filename, size, sha256)
+
+        Raises:
+            UploadError
+        """
+        meta = self._meta(self._dir(upload_id))
+        if not meta['complete']:
+            raise UploadError('Upload is not complete', status=409)
+        return meta
+
+    def claim(self, upload_id, dest_path):
+        """
+        Chuyển file đã upload tới dest_path (rename, cùng filesystem thì không copy) và xóa session
+
+        Returns:
+            dest_path (Path)
+
+        Raises:
+            UploadError
+        """
+        path = self._dir(upload_id)
+        self.completed(upload_id)
+        dest_path = Path(dest_path)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        # Claim song song: request thứ 2 bị từ chối ở marker, hoặc không còn file data
+        marker = self._acquire(path)
+        try:
+            shutil.move(str(path / 'data'), str(dest_path))
+        except FileNotFoundError:
+            marker.unlink(missing_ok=True)
+            raise UploadError('Upload already claimed', status=409)
+        except BaseException:
+            marker.unlink(missing_ok=True)
+            raise
+        shutil.rmtree(path, ignore_errors=True)
+        return dest_path
+
+    def abort(self, upload_id):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def cleanup_stale(self, now=None):
+        """
+        Xóa session không có hoạt động (chunk mới / complete) trong ttl giây
+
+        Returns:
+            Số session đã xóa
+        """
+        if self.root is None or not self.root.exists():
+            return 0
+        now = time.time() if now is None else now
+        removed = 0
+        with self._cleanup_lock:
+            for path in self.root.iterdir():
+                if not path.is_dir():
+                    continue
+                # data đổi khi đang ghi chunk, chunks/ khi có marker mới, thư mục session khi ghi meta
+                last_active = 0
+                for item in (path, path / 'chunks', path / 'data'):
+                    try:
+                        last_active = max(last_active, item.stat().st_mtime)
+                    except FileNotFoundError:
+                        pass
+                if now - last_active > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        if removed:
+            print(f"🗑️ Removed {removed} stale upload session(s)")
+        return removed
+
+
+upload_store = UploadSessionStore()
@@ -0,0 +1,435 @@
+"""
+i3dm_app/dem.py
+Kho DEM local: ingest file SRTM .hgt / raw grid thành tile .npy, đọc bằng memory-map
+và lấy độ cao bằng nội suy bilinear vectorized trên cả mảng tọa độ
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+# Giá trị void của SRTM
+HGT_NODATA = -32768
+
+HGT_NAME_RE = re.compile(r'^([NS])(\d{2})([EW])(\d{3})$', re.IGNORECASE)
+
+# Số ô lưới (mỗi chiều) của 1 node ở tầng thấp nhất của pyramid min/max
+PYRAMID_BLOCK = 16
+
+
+class MinMaxPyramid:
+    """
+    Pyramid min/max độ cao của 1 tile DEM.
+
+    Tầng 0: mỗi node = block x block ô lưới (ô = 4 điểm lưới kề nhau);
+    tầng k+1 gộp 2x2 node tầng k, tới khi còn 1 node. Void (NaN) được bỏ qua.
+
+    Query min/max trong 1 dải ô: duyệt từ gốc, node nằm trọn trong dải dùng giá trị
+    đã tính sẵn, node cắt biên mới đi xuống (và bỏ qua nếu không thể làm rộng kết quả);
+    ở tầng 0 đọc trực tiếp tối đa (block+1)^2 điểm từ grid.
+    """
+
+    def __init__(self, mins, maxs, cell_shape, block=PYRAMID_BLOCK):
+        self.mins = mins
+        self.cell_shape = tuple(cell_shape)
+        self.maxs = maxs
+        self.block = block
+        # Số node đã duyệt ở lần query gần nhất
+        self.last_visited = 0
+
+    @classmethod
+    def build(cls, grid, nodata=None, block=PYRAMID_BLOCK):
+        g = np.asarray(grid, dtype=np.float32)
+        if nodata is not None:
+            g = np.where(g == nodata, np.float32(np.nan), g)
+
+        # Min/max từng ô (4 góc) - fmin/fmax bỏ qua NaN
+        cell_min = np.fmin(np.fmin(g[:-1, :-1], g[:-1, 1:]), np.fmin(g[1:, :-1], g[1:, 1:]))
+        cell_max = np.fmax(np.fmax(g[:-1, :-1], g[:-1, 1:]), np.fmax(g[1:, :-1], g[1:, 1:]))
+
+        mins = [cls._reduce(cell_min, block, np.fmin)]
+        maxs = [cls._reduce(cell_max, block, np.fmax)]
+        while mins[-1].shape != (1, 1):
+            mins.append(cls._reduce(mins[-1], 2, np.fmin))
+            maxs.append(cls._reduce(maxs[-1], 2, np.fmax))
+        return cls(mins, maxs, cell_min.shape, block)
+
+    @staticmethod
+    def _reduce(values, factor, ufunc):
+        rows, cols = values.shape
+        pad_rows = -rows % factor
+        pad_cols = -cols % factor
+        if pad_rows or pad_cols:
+            values = np.pad(values, ((0, pad_rows), (0, pad_cols)), constant_values=np.nan)
+        r, c = values.shape
+        blocks = values.reshape(r // factor, factor, c // factor, factor)
+        return ufunc.reduce(ufunc.reduce(blocks, axis=3), axis=1)
+
+    def save(self, path):
+        arrays = {}
+        for level, (lo, hi) in enumerate(zip(self.mins, self.maxs)):
+            arrays[f'min_{level}'] = lo
+            arrays[f'max_{level}'] = hi
+        with open(path, 'wb') as f:
+            np.savez(f, block=np.int64(self.block), cell_shape=np.array(self.cell_shape), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            levels = sum(1 for key in data.files if key.startswith('min_'))
+            mins = [data[f'min_{level}'] for level in range(levels)]
+            maxs = [data[f'max_{level}'] for level in range(levels)]
+            return cls(mins, maxs, data['cell_shape'].tolist(), int(data['block']))
+
+    def query(self, grid_values, r0, r1, c0, c1):
+        """
+        Min/max trên các ô hàng r0..r1, cột c0..c1 (bao gồm 2 đầu)
+
+        Args:
+            grid_values: Hàm (row_slice, col_slice) -> mảng float điểm lưới (void = NaN)
+
+        Returns:
+            (min, max) hoặc None nếu toàn void
+        """
+        lo, hi = np.inf, -np.inf
+        last_row, last_col = self.cell_shape[0] - 1, self.cell_shape[1] - 1
+        top = len(self.mins) - 1
+        stack = [(top, 0, 0)]
+        visited = 0
+
+        while stack:
+            level, i, j = stack.pop()
+            visited += 1
+            size = self.block << level
+            nr0, nc0 = i * size, j * size
+            nr1, nc1 = min(nr0 + size - 1, last_row), min(nc0 + size - 1, last_col)
+            if nr0 > r1 or nr1 < r0 or nc0 > c1 or nc1 < c0:
+                continue
+
+            node_lo = self.mins[level][i, j]
+            node_hi = self.maxs[level][i, j]
+            if np.isnan(node_lo) or (node_lo >= lo and node_hi <= hi):
+                continue
+
+            if r0 <= nr0 and nr1 <= r1 and c0 <= nc0 and nc1 <= c1:
+                lo, hi = min(lo, float(node_lo)), max(hi, float(node_hi))
+                continue
+
+            if level == 0:
+                # Ô [a, b] cần điểm lưới [a, b + 1]
+                values = grid_values(
+                    slice(max(r0, nr0), min(r1, nr1) + 2),
+                    slice(max(c0, nc0), min(c1, nc1) + 2)
+                )
+                if values.size and not np.isnan(values).all():
+                    lo, hi = min(lo, float(np.nanmin(values))), max(hi, float(np.nanmax(values)))
+                continue
+
+            child_rows, child_cols = self.mins[level - 1].shape
+            for ci in (2 * i, 2 * i + 1):
+                for cj in (2 * j, 2 * j + 1):
+                    if ci < child_rows and cj < child_cols:
+                        stack.append((level - 1, ci, cj))
+
+        self.last_visited = visited
+        if lo > hi:
+            return None
+        return lo, hi
+
+
+class DemTile:
+    """
+    1 tile DEM: lưới rows x cols, hàng đầu tiên ở phía Bắc.
+
+    Các điểm lưới nằm đúng trên biên (pixel-is-point như SRTM):
+    cột 0 = west, cột cols-1 = east, hàng 0 = north, hàng rows-1 = south.
+    """
+
+    def __init__(self, path, west, south, east, north, nodata=None):
+        self.path = Path(path)
+        self.west = west
+        self.south = south
+        self.east = east
+        self.north = north
+        self.nodata = nodata
+        self._data = None
+        self._pyramid = None
+
+    @property
+    def data(self):
+        """Mảng 2D memory-mapped (chỉ đọc phần được truy cập)"""
+        if self._data is None:
+            self._data = np.load(self.path, mmap_mode='r')
+        return self._data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def pyramid_path(self):
+        return self.path.with_suffix('.minmax.npz')
+
+    @property
+    def pyramid(self):
+        """MinMaxPyramid của tile (tạo + lưu nếu chưa có, vd: tile ingest từ bản cũ)"""
+        if self._pyramid is None:
+            if self.pyramid_path.exists():
+                self._pyramid = MinMaxPyramid.load(self.pyramid_path)
+            else:
+                self._pyramid = MinMaxPyramid.build(self.data, self.nodata)
+                self._pyramid.save(self.pyramid_path)
+        return self._pyramid
+
+    def contains(self, lon, lat):
+        return (lon >= self.west) & (lon <= self.east) & (lat >= self.south) & (lat <= self.north)
+
+    def to_grid(self, lon, lat):
+        """Tọa độ (°) -> vị trí thực (col, row) trên lưới"""
+        rows, cols = self.shape
+        x = (np.asarray(lon, dtype=np.float64) - self.west) / (self.east - self.west) * (cols - 1)
+        y = (self.north - np.asarray(lat, dtype=np.float64)) / (self.north - self.south) * (rows - 1)
+        return x, y
+
+    def elevation_range(self, min_lon, max_lon, min_lat, max_lat):
+        """
+        Min/max độ cao của mọi ô lưới giao với bbox (phần nằm trong tile).
+
+        Bề mặt bilinear trong 1 ô nằm giữa min/max 4 góc nên kết quả luôn bao trọn
+        độ cao thật trong bbox (chỉ rộng hơn tối đa 1 ô ở biên).
+
+        Returns:
+            (min, max) hoặc None nếu không giao / toàn void
+        """
+        min_lon, max_lon = max(min_lon, self.west), min(max_lon, self.east)
+        min_lat, max_lat = max(min_lat, self.south), min(max_lat, self.north)
+        if min_lon > max_lon or min_lat > max_lat:
+            return None
+
+        rows, cols = self.shape
+        (x0, x1), (y0, y1) = self.to_grid([min_lon, max_lon], [max_lat, min_lat])
+        c0 = int(np.clip(np.floor(x0), 0, cols - 2))
+        c1 = int(np.clip(np.ceil(x1) - 1, c0, cols - 2))
+        r0 = int(np.clip(np.floor(y0), 0, rows - 2))
+        r1 = int(np.clip(np.ceil(y1) - 1, r0, rows - 2))
+
+        def grid_values(row_slice, col_slice):
+            v = self.data[row_slice, col_slice].astype(np.float64)
+            if self.nodata is not None:
+                v[v == self.nodata] = np.nan
+            return v
+
+        return self.pyramid.query(grid_values, r0, r1, c0, c1)
+
+    def values(self, rows_idx, cols_idx):
+        """Đọc giá trị lưới (float64), void -> NaN"""
+        v = self.data[rows_idx, cols_idx].astype(np.float64)
+        if self.nodata is not None:
+            v[v == self.nodata] = np.nan
+        return v
+
+    def sample(self, lon, lat):
+        """Nội suy bilinear cho mảng điểm nằm trong tile (void -> NaN)"""
+        rows, cols = self.shape
+        x, y = self.to_grid(lon, lat)
+
+        x0 = np.clip(np.floor(x).astype(np.intp), 0, cols - 2)
+        y0 = np.clip(np.floor(y).astype(np.intp), 0, rows - 2)
+        fx = x - x0
+        fy = y - y0
+
+        v00 = self.values(y0, x0)
+        v01 = self.values(y0, x0 + 1)
+        v10 = self.values(y0 + 1, x0)
+        v11 = self.values(y0 + 1, x0 + 1)
+
+        return (v00 * (1 - fx) * (1 - fy) + v01 * fx * (1 - fy)
+                + v10 * (1 - fx) * fy + v11 * fx * fy)
+
+    def to_dict(self):
+        return {
+            'file': self.path.name,
+            'west': self.west,
+            'south': self.south,
+            'east': self.east,
+            'north': self.north,
+            'nodata': self.nodata,
+        }
+
+
+class DemTileStore:
+    """
+    Thư mục chứa các tile DEM (.npy) + index.json.
+
+    Index được đọc lại khi file thay đổi, nên tile ingest từ process khác
+    (manage.py ingest_dem) có hiệu lực ngay mà không cần restart server.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._tiles = []
+        self._index_mtime = None
+
+    @property
+    def index_path(self):
+        return self.root / self.INDEX_FILE
+
+    def tiles(self):
+        """Danh sách DemTile hiện có"""
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        with self._lock:
+            if mtime != self._index_mtime:
+                with open(self.index_path, encoding='utf-8') as f:
+                    index = json.load(f)
+                self._tiles = [
+                    DemTile(
+                        self.root / t['file'], t['west'], t['south'], t['east'], t['north'],
+                        nodata=t.get('nodata')
+                    )
+                    for t in index.get('tiles', [])
+                ]
+                self._index_mtime = mtime
+            return list(self._tiles)
+
+    def sample(self, lon, lat):
+        """
+        Độ cao tại các điểm (vectorized).
+
+        Returns:
+            ndarray float64, NaN ở điểm không có tile phủ hoặc rơi vào void
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        heights = np.full(lon.shape, np.nan)
+        if lon.size == 0:
+            return heights
+
+        min_lon, max_lon = lon.min(), lon.max()
+        min_lat, max_lat = lat.min(), lat.max()
+
+        for tile in self.tiles():
+            if tile.east < min_lon or tile.west > max_lon or tile.north < min_lat or tile.south > max_lat:
+                continue
+            mask = np.isnan(heights) & tile.contains(lon, lat)
+            if mask.any():
+                heights[mask] = tile.sample(lon[mask], lat[mask])
+
+        return heights
+
+    def elevation_range(self, min_lon, max_lon, min_lat, max_lat):
+        """
+        Min/max độ cao trong bbox từ pyramid của các tile giao với bbox
+
+        Returns:
+            (min, max, covered): covered = True nếu các tile phủ kín bbox;
+            (None, None, False) nếu không có dữ liệu
+        """
+        lo, hi = np.inf, -np.inf
+        covered_area = 0.0
+        for tile in self.tiles():
+            overlap_lon = min(max_lon, tile.east) - max(min_lon, tile.west)
+            overlap_lat = min(max_lat, tile.north) - max(min_lat, tile.south)
+            if overlap_lon < 0 or overlap_lat < 0:
+                continue
+            covered_area += overlap_lon * overlap_lat
+            bounds = tile.elevation_range(min_lon, max_lon, min_lat, max_lat)
+            if bounds is not None:
+                lo, hi = min(lo, bounds[0]), max(hi, bounds[1])
+
+        if lo > hi:
+            return None, None, False
+        bbox_area = (max_lon - min_lon) * (max_lat - min_lat)
+        return lo, hi, covered_area >= bbox_area * (1 - 1e-9)
+
+    # ========== Ingest ==========
+
+    def ingest_hgt(self, path):
+        """
+        Ingest 1 file SRTM .hgt (int16 big-endian, vuông 1201/3601, tên dạng N21E105.hgt)
+        """
+        path = Path(path)
+        match = HGT_NAME_RE.match(path.stem)
+        if not match:
+            raise ValueError(f"Tên file HGT không hợp lệ: {path.name} (cần dạng N21E105.hgt)")
+
+        ns, lat_deg, ew, lon_deg = match.groups()
+        south = int(lat_deg) * (1 if ns.upper() == 'N' else -1)
+        west = int(lon_deg) * (1 if ew.upper() == 'E' else -1)
+
+        raw = np.fromfile(path, dtype='>i2')
+        size = int(round(np.sqrt(raw.size)))
+        if size * size != raw.size:
+            raise ValueError(f"File HGT không vuông: {path.name} ({raw.size} samples)")
+
+        return self.add_tile(
+            path.stem.upper(), raw.reshape(size, size).astype('<i2'),
+            west, south, west + 1, south + 1, nodata=HGT_NODATA
+        )
+
+    def ingest_raw(self, path, west, south, east, north, rows, cols, dtype='<f4', nodata=None):
+        """
+        Ingest raw grid (không header): rows x cols giá trị dtype, hàng đầu ở phía Bắc
+        """
+        path = Path(path)
+        raw = np.fromfile(path, dtype=dtype)
+        if raw.size != rows * cols:
+            raise ValueError(f"{path.name}: có {raw.size} giá trị, cần {rows} x {cols}")
+
+        grid = raw.reshape(rows, cols)
+        grid = grid.astype(grid.dtype.newbyteorder('<'))
+        return self.add_tile(path.stem, grid, west, south, east, north, nodata=nodata)
+
+    def add_tile(self, name, grid, west, south, east, north, nodata=None):
+        """Ghi grid thành <name>.npy và cập nhật index (thay tile cùng tên nếu có)"""
+        if grid.ndim != 2 or grid.shape[0] < 2 or grid.shape[1] < 2:
+            raise ValueError("DEM grid phải là mảng 2D tối thiểu 2x2")
+        if west >= east or south >= north:
+            raise ValueError("Bounds DEM không hợp lệ")
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        filename = f"{name}.npy"
+        tile = DemTile(self.root / filename, float(west), float(south), float(east), float(north),
+                       nodata=nodata)
+
+        # Ghi file tạm rồi rename: reader đang mmap bản cũ không bị ảnh hưởng
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.npy.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.ascontiguousarray(grid))
+        os.replace(tmp_path, tile.path)
+
+        pyramid = MinMaxPyramid.build(grid, nodata)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.npz.tmp')
+        os.close(fd)
+        pyramid.save(tmp_path)
+        os.replace(tmp_path, tile.pyramid_path)
+
+        with self._lock:
+            index = {'tiles': []}
+            if self.index_path.exists():
+                with open(self.index_path, encoding='utf-8') as f:
+                    index = json.load(f)
+            tiles = [t for t in index.get('tiles', []) if t['file'] != filename]
+            tiles.append(tile.to_dict())
+            self._write_index({'tiles': tiles})
+            self._index_mtime = None
+
+        return tile
+
+    def _write_index(self, index):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.json.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,155 @@
+"""
+i3dm_app/file_serving.py
+Hỗ trợ serve file media: ETag mạnh theo hash nội dung, nhận diện file content-addressed
+(cache immutable), parse Range và đọc 1 đoạn file
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+# Số ETag (sha256 theo path + size + mtime) giữ trong memory
+ETAG_CACHE_ENTRIES = 4096
+# File content-addressed: max-age 1 năm + immutable
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Thư mục (trong MEDIA_ROOT) có hash nội dung trong tên: file do generator ghi và
+# file model upload lưu theo SHA-256 (blob_store) - file upload khác không tính
+CONTENT_ADDRESSED_DIRS = ('i3dm', 'glb_shared', 'blobs')
+# Token hash trong tên file: <sha256>.glb (glb_shared, blobs) hoặc ..._<key[:16]>.json / ..._<key[:16]>/ (I3DM)
+_HASH_TOKEN_RE = re.compile(r'(?:^|[/_])([0-9a-f]{64}|[0-9a-f]{16})(?=[./]|$)')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_addressed_token(relative_path):
+    """
+    Hash nội dung nằm trong đường dẫn (None nếu không có).
+
+    File có hash trong tên không bao giờ bị ghi đè bằng nội dung khác, nên cache immutable được.
+    Chỉ xét CONTENT_ADDRESSED_DIRS, bỏ qua chuỗi toàn chữ số (timestamp, id) để không nhận nhầm.
+    """
+    relative_path = Path(relative_path).as_posix()
+    if relative_path.split('/', 1)[0] not in CONTENT_ADDRESSED_DIRS:
+        return None
+    for match in _HASH_TOKEN_RE.finditer(relative_path):
+        token = match.group(1)
+        if not token.isdigit():
+            return token
+    return None
+
+
+class FileEtagCache:
+    """sha256 của file theo (path, size, mtime) - chỉ đọc file 1 lần mỗi phiên bản"""
+
+    def __init__(self, max_entries=ETAG_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def digest(self, path, stat):
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._entries.get(key)
+            if digest is not None:
+                self._entries.move_to_end(key)
+                return digest
+
+        with open(path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+
+        with self._lock:
+            self._entries[key] = digest
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return digest
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+etag_cache = FileEtagCache()
+
+
+def etag_for(path, relative_path, stat, encoding=None):
+    """
+    ETag mạnh của 1 representation.
+
+    Bản nén sẵn sinh tất định từ file gốc nên dùng hash file gốc + tên encoding.
+    """
+    token = content_addressed_token(relative_path) or etag_cache.digest(path, stat)[:32]
+    return f'"{token}-{encoding}"' if encoding else f'"{token}"'
+
+
+def etag_matches(header, etag):
+    """If-None-Match: so sánh weak (bỏ W/), hỗ trợ '*'"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in header.split(','))
+
+
+def parse_range(header, size):
+    """
+    Range: bytes=a-b | a- | -n (chỉ 1 đoạn - nhiều đoạn thì trả cả file, RFC cho phép)
+
+    Returns:
+        None: không có / bỏ qua Range -> trả cả file
+        (start, end): đoạn [start, end] (end bao gồm)
+        False: không thỏa mãn được -> 416
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # -n: n byte cuối
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    if start >= size:
+        return False
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """
+    File-like chỉ đọc đoạn [start, start + length).
+
+    Cố ý không có fileno(): wsgi.file_wrapper của uWSGI sendfile từ vị trí hiện tại tới EOF
+    (bỏ qua length) -> response 206 bị thừa byte. Range luôn gửi qua read(); sendfile
+    zero-copy chỉ dùng cho response cả file.
+    """
+
+    def __init__(self, f, start, length):
+        self._file = f
+        self._remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,658 @@
+"""
+i3dm_app/generation.py
+Các bước generate I3DM tileset dùng chung cho API đồng bộ (views) và worker (jobs)
+"""
+
+import json
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from glb_app.models import GlbModel
+from .i3dm_generator import INSTANCE_ORDERS, I3DMGenerator
+from .models import I3DMTileset
+from .placement import (
+    BBOX_KEYS,
+    PLACEMENT_MODES,
+    REMOTE_ELEVATION_MIN_QUERIES,
+    REMOTE_ELEVATION_QUERY_FACTOR,
+    cull_elevation_filter,
+    parse_constraints,
+    sample_positions,
+)
+from .point_columns import (
+    BINARY_POINT_BYTES,
+    JSON_POINT_MAX_BYTES,
+    POINT_COLUMNS,
+    BodyTooLargeError,
+    columns_from_binary,
+    columns_from_instances,
+    read_json_points,
+)
+from .polygon import PolygonIndex, parse_geojson_polygon
+from .polyline import parse_geojson_lines, place_along_lines
+from .precompress import remove_precompressed
+from .singleflight import SingleFlight
+from .terrain_helper import get_dem_store, query_terrain_height_array
+
+
+# Giới hạn số instances mỗi request (tileset > MAX_INSTANCES_PER_TILE sẽ được chia quadtree)
+MAX_INSTANCES = 500000
+
+
+class GenerationRequestError(Exception):
+    """Request không hợp lệ - views trả về JSON error với status tương ứng"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class GenerationCancelled(Exception):
+    """Job bị hủy giữa chừng"""
+
+
+class StageTracker:
+    """
+    Theo dõi các bước (stage) của 1 lần generate: thời gian từng bước + progress tổng.
+
+    Bản gốc không làm gì thêm (dùng cho API đồng bộ); JobTracker trong jobs.py
+    ghi progress vào DB và kiểm tra yêu cầu hủy.
+    """
+
+    def __init__(self):
+        self.stage_timings = {}
+        self.current_stage = ''
+        # Tên file output (tileset_<name>.json) sau khi get_or_generate_tileset tính hash
+        self.output_name = None
+        self.progress_value = 0.0
+        self._stage_base = 0.0
+        self._stage_weight = 0.0
+
+    @contextmanager
+    def stage(self, name, weight):
+        """
+        Args:
+            name: Tên bước
+            weight: Tỷ trọng của bước trong progress tổng (tổng các bước = 1)
+        """
+        self.check_cancelled()
+        self.current_stage = name
+        self._stage_weight = weight
+        self.on_update()
+        start = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.stage_timings[name] = round(time.monotonic() - start, 3)
+        self._stage_base += weight
+        self.progress_value = min(self._stage_base, 1.0)
+        self.on_update()
+
+    def progress(self, done, total):
+        """Cập nhật progress trong bước hiện tại"""
+        fraction = done / total if total else 1.0
+        self.progress_value = min(self._stage_base + self._stage_weight * fraction, 1.0)
+        self.on_progress()
+
+    def on_update(self):
+        """Gọi khi đổi stage"""
+
+    def on_progress(self):
+        """Gọi khi progress trong stage thay đổi"""
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise GenerationCancelled nếu job đã bị hủy"""
+
+
+def shared_glb_dir(enabled):
+    """Thư mục GLB dùng chung (content-addressed) khi request bật external_glb"""
+    return Path(settings.MEDIA_ROOT) / 'glb_shared' if enabled else None
+
+
+def precompress_enabled():
+    """Ghi bản .br / .gz cạnh tile lúc generate (settings.I3DM_PRECOMPRESS)"""
+    return getattr(settings, 'I3DM_PRECOMPRESS', True)
+
+
+# Request giống hệt nhau đang chạy song song chỉ generate 1 lần
+tileset_generation = SingleFlight()
+
+
+def get_or_generate_tileset(generator, name_prefix, columns, record_fields, tracker=None):
+    """
+    Tạo tileset theo hash nội dung (GLB + instances + tùy chọn encoding).
+
+    - Đã có tileset cùng hash trong DB (và file còn) -> trả về luôn
+    - Đang có request giống hệt chạy -> chờ và dùng chung kết quả
+
+    Args:
+        generator: I3DMGenerator
+        name_prefix: Tiền tố tên file (vd: '<model_id>_<count>')
+        columns: (lon, lat, height, heading, scale)
+        record_fields: Các field còn lại của I3DMTileset
+        tracker: StageTracker (tùy chọn) - nhận progress sau mỗi tile và tên file output
+
+    Returns:
+        (tileset_record, reused)
+    """
+    lon, lat, height, heading, scale = columns
+    key = generator.generation_key(lon, lat, height, heading, scale)
+    name = f'{name_prefix}_{key[:16]}'
+    tileset_filename = f'tileset_{name}.json'
+    i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
+    on_progress = None
+    if tracker is not None:
+        tracker.output_name = name
+        on_progress = tracker.progress
+
+    def build():
+        existing = I3DMTileset.objects.filter(tileset_file=tileset_filename).first()
+        if existing and (i3dm_dir / tileset_filename).exists():
+            print(f"♻️  Reusing tileset ID={existing.id} (hash {key[:16]})")
+            return existing, True
+
+        result = generator.generate_tileset(
+            lon, lat, height, i3dm_dir, name, heading=heading, scale=scale, on_progress=on_progress
+        )
+        # Process khác (worker / request) có thể vừa tạo cùng tileset -> dùng chung record
+        record, created = I3DMTileset.objects.get_or_create(
+            tileset_file=result['tileset_file'],
+            defaults={'i3dm_file': result['i3dm_file'], **record_fields}
+        )
+        print(f"💾 Saved to database: ID={record.id}" if created else f"♻️  Tileset ID={record.id} already saved")
+        return record, not created
+
+    (record, reused), shared = tileset_generation.do(key, build)
+    return record, reused or shared
+
+
+def remove_partial_tileset(name):
+    """
+    Xóa file đã ghi dở của lần generate bị hủy / lỗi (tile đơn, thư mục quadtree, tileset.json
+    và bản nén) - chỉ khi chưa có I3DMTileset nào trỏ tới, để không xóa tileset đang dùng.
+    """
+    tileset_filename = f'tileset_{name}.json'
+    if I3DMTileset.objects.filter(tileset_file=tileset_filename).exists():
+        return
+    i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
+    tiles_dir = i3dm_dir / f'instances_{name}'
+    if tiles_dir.is_dir():
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+        print(f"🗑️ Deleted partial: {tiles_dir.name}/")
+    for path in (i3dm_dir / f'instances_{name}.i3dm', i3dm_dir / tileset_filename):
+        remove_precompressed(path)
+        path.unlink(missing_ok=True)
+
+
+def parse_instance_order(value):
+    """Tùy chọn sắp xếp instance trong tile: None, 'morton' hoặc 'hilbert'"""
+    order = value or None
+    if order is not None and order not in INSTANCE_ORDERS:
+        raise GenerationRequestError(f'order must be one of: {list(INSTANCE_ORDERS)}')
+    return order
+
+
+def get_source_model(model_id):
+    if not model_id:
+        raise GenerationRequestError('model_id is required')
+    try:
+        return GlbModel.objects.get(id=model_id)
+    except GlbModel.DoesNotExist:
+        raise GenerationRequestError(f'Model with id {model_id} not found', status=404)
+
+
+# ========== BBOX (random + terrain clamping) ==========
+
+def parse_bbox_request(data):
+    """
+    Kiểm tra body của request bbox, trả về params đã chuẩn hóa (lưu được vào JSON)
+
+    Raises:
+        GenerationRequestError
+    """
+    model_id = data.get('model_id')
+    bbox = data.get('bbox')
+    count = int(data.get('count', 100))
+
+    get_source_model(model_id)
+
+    polygons = None
+    if data.get('polygon'):
+        try:
+            polygons = parse_geojson_polygon(data['polygon'])
+        except ValueError as e:
+            raise GenerationRequestError(f'Invalid polygon: {e}')
+        # Không truyền bbox -> dùng bbox của polygon
+        bbox = bbox or PolygonIndex(polygons).bounds
+
+    if not bbox:
+        raise GenerationRequestError('bbox or polygon is required')
+
+    required_bbox_keys = ['min_lon', 'max_lon', 'min_lat', 'max_lat']
+    if not all(key in bbox for key in required_bbox_keys):
+        raise GenerationRequestError(f'bbox must contain: {required_bbox_keys}')
+
+    if count < 1 or count > MAX_INSTANCES:
+        raise GenerationRequestError(f'count must be between 1 and {MAX_INSTANCES}')
+
+    bbox = {key: float(bbox[key]) for key in required_bbox_keys}
+    if bbox['min_lon'] >= bbox['max_lon'] or bbox['min_lat'] >= bbox['max_lat']:
+        raise GenerationRequestError('Invalid bbox: min values must be less than max values')
+
+    try:
+        constraints = parse_constraints(data.get('constraints'))
+    except (TypeError, ValueError) as e:
+        raise GenerationRequestError(f'Invalid constraints: {e}')
+    if polygons:
+        constraints = dict(constraints or {}, polygon=polygons)
+
+    placement = data.get('placement', 'uniform')
+    if placement not in PLACEMENT_MODES:
+        raise GenerationRequestError(f'placement must be one of: {list(PLACEMENT_MODES)}')
+
+    min_distance = None
+    if placement == 'poisson':
+        if data.get('min_distance') is None:
+            raise GenerationRequestError('min_distance is required for poisson placement')
+        min_distance = float(data['min_distance'])
+        if min_distance <= 0:
+            raise GenerationRequestError('min_distance must be positive')
+
+    seed = data.get('seed')
+    if seed is not None:
+        seed = int(seed)
+        if seed < 0:
+            raise GenerationRequestError('seed must be a non-negative integer')
+
+    return {
+        'model_id': model_id,
+        'bbox': bbox,
+        'count': count,
+        'height': float(data.get('height', 0)),  # Offset từ terrain
+        'scale': float(data.get('scale', 1.0)),
+        'compact': bool(data.get('compact', False)),
+        'external_glb': bool(data.get('external_glb', False)),
+        'order': parse_instance_order(data.get('order')),
+        'constraints': constraints,
+        'placement': placement,
+        'min_distance': min_distance,
+        'seed': seed,
+    }
+
+
+def run_bbox_generation(params, tracker=None):
+    """
+    Random positions trong bbox (lọc theo constraints) -> query terrain -> generate tileset
+
+    Returns:
+        (tileset_record, reused)
+    """
+    tracker = tracker or StageTracker()
+    model = get_source_model(params['model_id'])
+    bbox = params['bbox']
+    count = params['count']
+    height_offset = params['height']
+    scale = params['scale']
+
+    print(f"📍 BBox: [{bbox['min_lon']}, {bbox['min_lat']}] → [{bbox['max_lon']}, {bbox['max_lat']}]")
+
+    constraints = params.get('constraints')
+    with tracker.stage('sampling', 0.05):
+        print(f"\n⏳ Generating {count} positions with terrain heights...")
+        dem_store = get_dem_store()
+        try:
+            constraints = cull_elevation_filter(bbox, constraints, dem_store.elevation_range)
+        except ValueError as e:
+            raise GenerationRequestError(str(e), status=422)
+        max_height_queries = None
+        if constraints and ('min_elevation' in constraints or 'max_elevation' in constraints):
+            if not dem_store.elevation_range(*(bbox[key] for key in BBOX_KEYS))[2]:
+                # Độ cao lấy từ terrain server -> giới hạn số điểm query cho bộ lọc
+                max_height_queries = count * REMOTE_ELEVATION_QUERY_FACTOR + REMOTE_ELEVATION_MIN_QUERIES
+                print(f"⚠️ No local DEM for bbox, elevation filter limited to {max_height_queries:,} queries")
+        if constraints:
+            summary = {k: v for k, v in constraints.items() if k != 'polygon'}
+            if constraints.get('polygon'):
+                summary['polygon'] = f"{sum(len(r) for p in constraints['polygon'] for r in p)} vertices"
+            print(f"🧭 Placement constraints: {summary}")
+        if params.get('placement') == 'poisson':
+            print(f"🔵 Poisson-disk placement: min_distance={params['min_distance']}m, seed={params.get('seed')}")
+        try:
+            lon, lat, terrain_heights = sample_positions(
+                bbox, count, np.random.default_rng(params.get('seed')),
+                constraints=constraints,
+                height_fn=query_terrain_height_array,
+                dem_sample=dem_store.sample,
+                on_progress=tracker.progress,
+                mode=params.get('placement', 'uniform'),
+                min_distance=params.get('min_distance'),
+                max_height_queries=max_height_queries,
+            )
+        except ValueError as e:
+            raise GenerationRequestError(str(e), status=422)
+
+    with tracker.stage('terrain', 0.6):
+        if terrain_heights is None:
+            print(f"🌍 Querying terrain heights...")
+            terrain_heights = query_terrain_height_array(lon, lat, on_progress=tracker.progress)
+
+    # Build instances với terrain heights - KHÔNG CÓ ROTATION
+    columns = (
+        lon,
+        lat,
+        terrain_heights + height_offset,  # ✅ Absolute height
+        np.zeros(count),
+        np.full(count, scale),
+    )
+    print(f"✅ Generated {count} instances (NO ROTATION)")
+    print(f"   Terrain heights: {terrain_heights.min():.2f}m → {terrain_heights.max():.2f}m")
+
+    with tracker.stage('generate', 0.35):
+        glb_path = model.glb_file.path
+        print(f"📦 Using GLB: {glb_path}")
+        print(f"⚙️  Generating I3DM tileset...")
+        generator = I3DMGenerator(
+            glb_path, compact=params['compact'], external_glb_dir=shared_glb_dir(params['external_glb']),
+            order=params.get('order'),
+            precompress=precompress_enabled()
+        )
+        return get_or_generate_tileset(
+            generator,
+            f"{params['model_id']}_{count}",
+            columns,
+            dict(
+                source_model=model,
+                name=f"{model.name} - {count} instances",
+                count=count,
+                min_lon=bbox['min_lon'],
+                max_lon=bbox['max_lon'],
+                min_lat=bbox['min_lat'],
+                max_lat=bbox['max_lat'],
+                height=height_offset,
+                scale=scale,
+            ),
+            tracker=tracker
+        )
+
+
+# ========== POINTS (độ cao thực từ pickPosition) ==========
+
+def parse_points_request(data):
+    """
+    Kiểm tra body (JSON đã parse) của request point-based, trả về params đã chuẩn hóa.
+
+    instances được đổi ngay sang mảng cột (params['points']), các bước sau không dùng dict nữa.
+
+    Raises:
+        GenerationRequestError
+    """
+    instances = data.get('instances', [])
+
+    get_source_model(data.get('model_id'))
+
+    if not instances or len(instances) == 0:
+        raise GenerationRequestError('instances list is empty')
+
+    if len(instances) > MAX_INSTANCES:
+        raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed')
+
+    # CHỈ CẦN 3 KEY (lon, lat, height), KHÔNG CẦN rotation_z
+    try:
+        columns = columns_from_instances(instances)
+    except ValueError as e:
+        raise GenerationRequestError(str(e))
+    return _points_params(data, columns)
+
+
+def parse_points_stream(stream):
+    """
+    Như parse_points_request nhưng parse JSON dần từ stream (request):
+    instances đi thẳng vào mảng cột, không dựng list dict
+
+    Raises:
+        json.JSONDecodeError, GenerationRequestError
+    """
+    try:
+        fields, columns = read_json_points(
+            stream, max_points=MAX_INSTANCES, max_bytes=MAX_INSTANCES * JSON_POINT_MAX_BYTES
+        )
+    except OverflowError:
+        raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed')
+    except BodyTooLargeError as e:
+        raise GenerationRequestError(str(e), status=413)
+    except json.JSONDecodeError:
+        raise
+    except ValueError as e:
+        raise GenerationRequestError(str(e))
+    get_source_model(fields.get('model_id'))
+    return _points_params(fields, columns)
+
+
+def parse_points_binary(body, options):
+    """
+    Body nhị phân float64 little-endian dạng cột: N lon, N lat, N height, N scale, N heading
+    (40 bytes / điểm); model_id, compact, external_glb, order nằm trong query string (options)
+
+    Raises:
+        GenerationRequestError
+    """
+    if len(body) > MAX_INSTANCES * BINARY_POINT_BYTES:
+        raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed', status=413)
+    try:
+        columns = columns_from_binary(body)
+    except ValueError as e:
+        raise GenerationRequestError(str(e))
+
+    def flag(name):
+        return str(options.get(name, '')).lower() in ('1', 'true')
+
+    get_source_model(options.get('model_id'))
+    return _points_params({
+        'model_id': options.get('model_id'),
+        'compact': flag('compact'),
+        'external_glb': flag('external_glb'),
+        'order': options.get('order'),
+    }, columns)
+
+
+def _points_params(data, columns):
+    count = len(columns['lon']) if columns else 0
+    if count == 0:
+        raise GenerationRequestError('instances list is empty')
+    if count > MAX_INSTANCES:
+        raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed')
+    if not all(np.isfinite(columns[name]).all() for name in POINT_COLUMNS):
+        raise GenerationRequestError('Instance values must be finite numbers')
+
+    return {
+        'model_id': data.get('model_id'),
+        'points': columns,
+        'compact': bool(data.get('compact', False)),
+        'external_glb': bool(data.get('external_glb', False)),
+        'order': parse_instance_order(data.get('order')),
+    }
+
+
+def point_arrays(params):
+    """(lon, lat, height, heading, scale) từ params - mảng numpy, list (job) hoặc instances (job cũ)"""
+    points = params.get('points')
+    if points is None:
+        points = columns_from_instances(params['instances'])
+    lon, lat, height, scale, heading = (np.asarray(points[name], dtype=np.float64) for name in POINT_COLUMNS)
+    return lon, lat, height, heading, scale
+
+
+def serializable_params(params):
+    """Params lưu được vào JSONField của I3DMJob (mảng cột -> list)"""
+    if isinstance(params.get('points'), dict):
+        params = dict(params, points={
+            name: np.asarray(column).tolist() for name, column in params['points'].items()
+        })
+    return params
+
+
+def run_points_generation(params, tracker=None):
+    """
+    Generate tileset từ danh sách điểm đã có độ cao
+
+    Returns:
+        (tileset_record, reused)
+    """
+    tracker = tracker or StageTracker()
+    model = get_source_model(params['model_id'])
+
+    with tracker.stage('prepare', 0.1):
+        generator = I3DMGenerator(
+            model.glb_file.path, debug=True, compact=params['compact'],
+            external_glb_dir=shared_glb_dir(params['external_glb']), order=params.get('order'),
+            precompress=precompress_enabled()
+        )
+        columns = point_arrays(params)
+        lon, lat, height, heading, scale = columns
+        count = len(lon)
+
+        min_lon, max_lon = float(lon.min()), float(lon.max())
+        min_lat, max_lat = float(lat.min()), float(lat.max())
+        avg_height = float(height.mean())
+        avg_scale = float(scale.mean())
+
+        print(f"📍 BBox: [{min_lon:.6f}, {min_lat:.6f}] → [{max_lon:.6f}, {max_lat:.6f}]")
+        print(f"📊 Heights: {height.min():.2f}m → {height.max():.2f}m (avg: {avg_height:.2f}m)")
+        print(f"📏 Scales: {avg_scale:.2f}x average")
+
+    with tracker.stage('generate', 0.9):
+        print(f"📦 Using GLB: {model.glb_file.path}")
+        print(f"⚙️  Generating I3DM tileset (NO ROTATION)...")
+        return get_or_generate_tileset(
+            generator,
+            f"{params['model_id']}_{count}",
+            columns,
+            dict(
+                source_model=model,
+                name=f"{model.name} - {count} instances (point-based, NO ROTATION)",
+                count=count,
+                min_lon=min_lon,
+                max_lon=max_lon,
+                min_lat=min_lat,
+                max_lat=max_lat,
+                height=avg_height,
+                scale=avg_scale,
+            ),
+            tracker=tracker
+        )
+
+
+# ========== LINES (cách đều dọc polyline + terrain clamping) ==========
+
+def parse_lines_request(data):
+    """
+    Kiểm tra body của request đặt instance dọc polyline, trả về params đã chuẩn hóa
+
+    Raises:
+        GenerationRequestError
+    """
+    model_id = data.get('model_id')
+    get_source_model(model_id)
+
+    if not data.get('lines'):
+        raise GenerationRequestError('lines is required')
+    try:
+        lines = parse_geojson_lines(data['lines'])
+    except ValueError as e:
+        raise GenerationRequestError(f'Invalid lines: {e}')
+
+    if data.get('spacing') is None:
+        raise GenerationRequestError('spacing is required')
+    spacing = float(data['spacing'])
+    offset = float(data.get('offset', 0))
+    if spacing <= 0:
+        raise GenerationRequestError('spacing must be positive')
+    if offset < 0:
+        raise GenerationRequestError('offset must be non-negative')
+
+    heading_offset = float(data.get('heading_offset', 0))
+    lon, _, _ = place_along_lines(lines, spacing, offset, heading_offset)
+    if len(lon) == 0:
+        raise GenerationRequestError('lines are shorter than offset - no instances to place', status=422)
+    if len(lon) > MAX_INSTANCES:
+        raise GenerationRequestError(
+            f'{len(lon):,} instances exceed the maximum of {MAX_INSTANCES:,} - increase spacing'
+        )
+
+    return {
+        'model_id': model_id,
+        'lines': lines,
+        'spacing': spacing,
+        'offset': offset,
+        'heading_offset': heading_offset,
+        'height': float(data.get('height', 0)),  # Offset từ terrain
+        'scale': float(data.get('scale', 1.0)),
+        'compact': bool(data.get('compact', False)),
+        'external_glb': bool(data.get('external_glb', False)),
+        'order': parse_instance_order(data.get('order')),
+    }
+
+
+def run_lines_generation(params, tracker=None):
+    """
+    Vị trí cách đều dọc polyline (heading theo tiếp tuyến) -> query terrain -> generate tileset
+
+    Returns:
+        (tileset_record, reused)
+    """
+    tracker = tracker or StageTracker()
+    model = get_source_model(params['model_id'])
+    height_offset = params['height']
+    scale = params['scale']
+
+    with tracker.stage('placement', 0.05):
+        lon, lat, heading = place_along_lines(
+            params['lines'], params['spacing'], params['offset'], params['heading_offset']
+        )
+        count = len(lon)
+        print(f"🛣️  {len(params['lines'])} lines, spacing {params['spacing']}m → {count} positions")
+
+    with tracker.stage('terrain', 0.6):
+        print(f"🌍 Querying terrain heights...")
+        terrain_heights = query_terrain_height_array(lon, lat, on_progress=tracker.progress)
+
+    columns = (
+        lon,
+        lat,
+        terrain_heights + height_offset,
+        heading,
+        np.full(count, scale),
+    )
+    print(f"   Terrain heights: {terrain_heights.min():.2f}m → {terrain_heights.max():.2f}m")
+
+    with tracker.stage('generate', 0.35):
+        print(f"📦 Using GLB: {model.glb_file.path}")
+        print(f"⚙️  Generating I3DM tileset...")
+        generator = I3DMGenerator(
+            model.glb_file.path, compact=params['compact'],
+            external_glb_dir=shared_glb_dir(params['external_glb']), order=params.get('order'),
+            precompress=precompress_enabled()
+        )
+        return get_or_generate_tileset(
+            generator,
+            f"{params['model_id']}_{count}",
+            columns,
+            dict(
+                source_model=model,
+                name=f"{model.name} - {count} instances (along lines, {params['spacing']:g}m)",
+                count=count,
+                min_lon=float(lon.min()),
+                max_lon=float(lon.max()),
+                min_lat=float(lat.min()),
+                max_lat=float(lat.max()),
+                height=height_offset,
+                scale=scale,
+            ),
+            tracker=tracker
+        )
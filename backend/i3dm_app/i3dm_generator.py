@@ -1,8 +1,140 @@
 import struct
 import json
 import math
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
+import numpy as np
+
+from .i3dm_writer import I3DMWriter, write_atomic
+from .precompress import write_precompressed
+
+
+# Số instance tối đa trong 1 tile I3DM. Lớn hơn sẽ chia quadtree.
+MAX_INSTANCES_PER_TILE = 5000
+# Độ sâu tối đa của quadtree (chặn trường hợp nhiều điểm trùng nhau)
+QUADTREE_MAX_DEPTH = 16
+# geometricError của tile = đường chéo tile (m) * hệ số này
+GEOMETRIC_ERROR_FACTOR = 0.1
+# Đệm thêm phía trên bounding region (chiều cao model)
+HEIGHT_BUFFER = 50.0
+# Dung lượng mặc định của GLB cache (bytes)
+GLB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Đường cong lấp đầy dùng để sắp xếp instance trong 1 tile (None = giữ thứ tự request)
+INSTANCE_ORDERS = ('morton', 'hilbert')
+# Số bit mỗi trục của lưới lượng tử hóa khi tính key (2^16 ô mỗi chiều trong bbox của tile)
+SPATIAL_ORDER_BITS = 16
+
+
+class GlbCache:
+    """
+    LRU cache dùng chung toàn process cho nội dung GLB.
+
+    - Key = (path, mtime_ns, size): file bị ghi đè sẽ tự thành key mới
+    - Dữ liệu là mmap read-only nên không copy model vào heap Python
+      (trên Windows dùng bytes vì file đang mmap không xóa được)
+    - Giới hạn theo tổng bytes (max_bytes), entry cũ nhất bị loại trước
+    """
+
+    def __init__(self, max_bytes=GLB_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._digests = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(path):
+        stat = path.stat()
+        return (str(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path):
+        """Trả về nội dung GLB (mmap hoặc bytes) của path"""
+        path = Path(path).resolve()
+        key = self._key(path)
+
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = self._load(path, key[2])
+
+        with self._lock:
+            if key not in self._entries and key[2] <= self.max_bytes:
+                # Bỏ các version cũ của cùng file
+                for old_key in [k for k in self._entries if k[0] == key[0]]:
+                    self._evict(old_key)
+                self._entries[key] = data
+                self.current_bytes += key[2]
+                while self.current_bytes > self.max_bytes:
+                    self._evict(next(iter(self._entries)))
+        return data
+
+    def digest(self, path, data):
+        """SHA-256 của GLB, nhớ theo key để không hash lại model lớn mỗi request"""
+        path = Path(path).resolve()
+        key = self._key(path)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+            with self._lock:
+                if key in self._entries:
+                    self._digests[key] = digest
+        return digest
+
+    @staticmethod
+    def _load(path, size):
+        with open(path, "rb") as f:
+            # Windows không cho xóa / ghi đè file đang mmap -> đọc thẳng vào bytes
+            if size == 0 or os.name == "nt":
+                return f.read()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self, key):
+        # Không close mmap: generator khác có thể vẫn đang giữ tham chiếu,
+        # mmap tự unmap khi không còn ai dùng
+        self._entries.pop(key)
+        self._digests.pop(key, None)
+        self.current_bytes -= key[2]
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+glb_cache = GlbCache()
+
+
 class I3DMGenerator:
     """
     I3DM Generator - FIXED: Model đứng thẳng giống eastNorthUpToFixedFrame
@@ -13,17 +145,152 @@ class I3DMGenerator:
     WGS84_A = 6378137.0
     WGS84_E2 = 0.00669437999014
 
-    def __init__(self, glb_path, debug=True):
+    def __init__(self, glb_path, debug=True, compact=False, external_glb_dir=None, cache=True, order=None,
+                 precompress=False):
+        """
+        Args:
+            glb_path: Đường dẫn file GLB
+            debug: In log
+            compact: True = feature table nén (POSITION_QUANTIZED,
+                NORMAL_*_OCT32P, bỏ SCALE khi mọi instance có scale = 1)
+            external_glb_dir: Nếu có, không nhúng GLB vào I3DM (GLTF_FORMAT = 0)
+                mà trỏ URI tới bản copy <sha256>.glb dùng chung trong thư mục này
+            cache: Đọc GLB qua glb_cache (tắt cho file tạm chỉ dùng 1 lần - khi đó GLB
+                không được đọc vào memory, hash và nhúng đều stream từ file)
+            order: 'morton' / 'hilbert' = sắp xếp instance của mỗi tile theo đường cong
+                lấp đầy trước khi ghi feature table (buffer nén gzip/brotli tốt hơn,
+                dải index liên tiếp = vùng không gian gọn), None = giữ thứ tự request
+            precompress: Ghi thêm bản nén sẵn .br / .gz cạnh mỗi file .i3dm / tileset.json
+        """
+        if order is not None and order not in INSTANCE_ORDERS:
+            raise ValueError(f"order must be one of: {list(INSTANCE_ORDERS)}")
         self.glb_path = Path(glb_path)
         self.debug = debug
+        self.compact = compact
+        self.order = order
+        self.precompress = precompress
+        self.external_glb_dir = Path(external_glb_dir) if external_glb_dir else None
+        self._shared_glb_path = None
+        self._glb_digest = None
+        self.cache = cache
         if not self.glb_path.exists():
             raise FileNotFoundError(f"GLB not found: {glb_path}")
         
-        with open(self.glb_path, "rb") as f:
-            self.glb_data = f.read()
+        self._glb_stat = self._stat_glb()
+        self._glb_data = glb_cache.get(self.glb_path) if cache else None
         
         if self.debug:
-            print(f"📦 Loaded GLB: {self.glb_path.name} ({len(self.glb_data)} bytes)")
+            print(f"📦 Loaded GLB: {self.glb_path.name} ({self._glb_stat[0]} bytes)")
+
+    def _stat_glb(self):
+        stat = self.glb_path.stat()
+        return (stat.st_size, stat.st_mtime_ns)
+
+    @property
+    def glb_data(self):
+        """Nội dung GLB (mmap từ glb_cache, hoặc đọc file khi cache=False)"""
+        if self._glb_data is None:
+            with open(self.glb_path, "rb") as f:
+                self._glb_data = f.read()
+        return self._glb_data
+
+    def _glb_file_unchanged(self):
+        """File GLB trên đĩa vẫn là bản đã hash -> copy thẳng từ file được"""
+        try:
+            return self._stat_glb() == self._glb_stat
+        except FileNotFoundError:
+            return False
+
+    @property
+    def glb_digest(self):
+        """SHA-256 (hex) của nội dung GLB"""
+        if self._glb_digest is None:
+            if self.cache:
+                self._glb_digest = glb_cache.digest(self.glb_path, self.glb_data)
+            elif self._glb_data is None:
+                with open(self.glb_path, "rb") as f:
+                    self._glb_digest = hashlib.file_digest(f, "sha256").hexdigest()
+            else:
+                self._glb_digest = hashlib.sha256(self._glb_data).hexdigest()
+        return self._glb_digest
+
+    def generation_key(self, lon, lat, height, heading=None, scale=None,
+                       max_instances_per_tile=MAX_INSTANCES_PER_TILE):
+        """
+        Hash nội dung của 1 lần generate: GLB + instances + tùy chọn encoding.
+
+        Cùng key => output giống hệt, có thể dùng lại tileset đã tạo.
+        """
+        count = len(lon)
+        options = {
+            "compact": self.compact,
+            "gltf_format": self.gltf_format,
+            "max_instances_per_tile": max_instances_per_tile,
+            "count": count,
+        }
+        # Chỉ thêm khi bật để key của tileset cũ (không sắp xếp) không đổi
+        if self.order:
+            options["order"] = self.order
+        h = hashlib.sha256()
+        h.update(self.glb_digest.encode("ascii"))
+        h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        for column, default in ((lon, None), (lat, None), (height, 0.0), (heading, 0.0), (scale, 1.0)):
+            if column is None:
+                column = default
+            column = np.broadcast_to(np.asarray(column, dtype="<f8"), (count,))
+            h.update(np.ascontiguousarray(column).tobytes())
+        return h.hexdigest()
+
+    @property
+    def gltf_format(self):
+        """0 = GLB ngoài (URI), 1 = GLB nhúng"""
+        return 0 if self.external_glb_dir else 1
+
+    def publish_shared_glb(self):
+        """
+        Copy GLB vào external_glb_dir dưới tên <sha256>.glb (chỉ ghi 1 lần).
+
+        Mọi I3DM / quadtree tile của cùng 1 model dùng chung file này,
+        nên browser chỉ tải và cache model 1 lần.
+        """
+        if self._shared_glb_path is not None:
+            return self._shared_glb_path
+
+        shared_path = self.external_glb_dir / f"{self.glb_digest}.glb"
+
+        if not shared_path.exists():
+            self.external_glb_dir.mkdir(parents=True, exist_ok=True)
+            # Ghi file tạm rồi rename để request song song không đọc file dở dang
+            fd, tmp_path = tempfile.mkstemp(dir=self.external_glb_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                if self._glb_file_unchanged():
+                    with open(self.glb_path, "rb") as src:
+                        shutil.copyfileobj(src, f)
+                else:
+                    f.write(self.glb_data)
+            os.replace(tmp_path, shared_path)
+            if self.debug:
+                print(f"📦 Shared GLB: {shared_path}")
+
+        self._shared_glb_path = shared_path
+        return shared_path
+
+    def _glb_body(self, output_path):
+        """
+        Phần body sau feature table cho I3DMWriter: GLB nhúng (copy thẳng từ file nếu
+        file chưa đổi từ lúc hash) hoặc URI tương đối tới GLB dùng chung
+        """
+        if not self.external_glb_dir:
+            if self._glb_file_unchanged():
+                return {"body_path": self.glb_path}
+            return {"body": self.glb_data}
+
+        if output_path is None:
+            raise ValueError("external_glb cần output_path để tính URI tương đối")
+        shared_path = self.publish_shared_glb()
+        uri = Path(os.path.relpath(shared_path, Path(output_path).parent)).as_posix()
+        body = uri.encode("utf-8")
+        return {"body": body + b" " * ((8 - len(body) % 8) % 8)}
 
     @staticmethod
     def geodetic_to_cartesian(lon, lat, height):
@@ -110,7 +377,176 @@ class I3DMGenerator:
         
         return normal_up, normal_right
 
-    def generate_i3dm(self, instances, output_path):
+    @staticmethod
+    def geodetic_to_cartesian_array(lon, lat, height):
+        """
+        Bản vectorized của geodetic_to_cartesian cho mảng numpy.
+
+        Giữ đúng thứ tự phép tính như bản scalar để kết quả float64
+        trùng từng bit.
+
+        Returns:
+            ndarray (N, 3) tọa độ ECEF
+        """
+        lon_rad = np.radians(lon)
+        lat_rad = np.radians(lat)
+
+        sin_lat = np.sin(lat_rad)
+        cos_lat = np.cos(lat_rad)
+        sin_lon = np.sin(lon_rad)
+        cos_lon = np.cos(lon_rad)
+
+        N = I3DMGenerator.WGS84_A / np.sqrt(1 - I3DMGenerator.WGS84_E2 * sin_lat**2)
+
+        xyz = np.empty((len(lon_rad), 3), dtype=np.float64)
+        xyz[:, 0] = (N + height) * cos_lat * cos_lon
+        xyz[:, 1] = (N + height) * cos_lat * sin_lon
+        xyz[:, 2] = (N * (1 - I3DMGenerator.WGS84_E2) + height) * sin_lat
+
+        return xyz
+
+    @staticmethod
+    def compute_enu_frame_array(lon, lat, heading_deg):
+        """
+        Bản vectorized của compute_enu_frame (cùng HACK cho Y-up models).
+
+        Returns:
+            (normal_up, normal_right) - 2 ndarray (N, 3)
+        """
+        lon_rad = np.radians(lon)
+        lat_rad = np.radians(lat)
+        heading_rad = np.radians(heading_deg)
+
+        cos_lat = np.cos(lat_rad)
+        sin_lat = np.sin(lat_rad)
+        cos_lon = np.cos(lon_rad)
+        sin_lon = np.sin(lon_rad)
+
+        # EAST / NORTH (world_east_z = 0)
+        world_east_x = -sin_lon
+        world_east_y = cos_lon
+
+        world_north_x = -sin_lat * cos_lon
+        world_north_y = -sin_lat * sin_lon
+        world_north_z = cos_lat
+
+        cos_h = np.cos(heading_rad)
+        sin_h = np.sin(heading_rad)
+
+        normal_right = np.empty((len(lon_rad), 3), dtype=np.float64)
+        normal_right[:, 0] = world_east_x * cos_h + world_north_x * sin_h
+        normal_right[:, 1] = world_east_y * cos_h + world_north_y * sin_h
+        normal_right[:, 2] = 0.0 * cos_h + world_north_z * sin_h
+
+        normal_up = np.empty((len(lon_rad), 3), dtype=np.float64)
+        normal_up[:, 0] = -world_east_x * sin_h + world_north_x * cos_h
+        normal_up[:, 1] = -world_east_y * sin_h + world_north_y * cos_h
+        normal_up[:, 2] = -0.0 * sin_h + world_north_z * cos_h
+
+        return normal_up, normal_right
+
+    @staticmethod
+    def oct_encode_array(vectors):
+        """
+        Oct-encode vector đơn vị (N, 3) sang uint16 (N, 2) trong khoảng [0, 65535]
+        (ngược với AttributeCompression.octDecodeInRange của CesiumJS)
+        """
+        v = np.asarray(vectors, dtype=np.float64)
+        p = v[:, :2] / np.abs(v).sum(axis=1, keepdims=True)
+        sign = np.where(p >= 0.0, 1.0, -1.0)
+        folded = (1.0 - np.abs(p[:, ::-1])) * sign
+        p = np.where(v[:, 2:3] < 0.0, folded, p)
+        return np.round((np.clip(p, -1.0, 1.0) * 0.5 + 0.5) * 65535).astype("<u2")
+
+    @staticmethod
+    def quantize_positions(positions):
+        """
+        Lượng tử hóa vị trí (N, 3) sang uint16 theo spec POSITION_QUANTIZED.
+
+        Returns:
+            (quantized, volume_offset, volume_scale)
+        """
+        volume_offset = positions.min(axis=0)
+        volume_scale = positions.max(axis=0) - volume_offset
+        safe_scale = np.where(volume_scale > 0.0, volume_scale, 1.0)
+        quantized = np.round((positions - volume_offset) / safe_scale * 65535).astype("<u2")
+        return quantized, volume_offset, volume_scale
+
+    @staticmethod
+    def morton_key_array(ix, iy):
+        """Key Z-order: xen kẽ bit của ix, iy (uint, tối đa 32 bit mỗi trục)"""
+        def spread(v):
+            v = np.asarray(v, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+            for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                                (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+                                (1, 0x5555555555555555)):
+                v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+            return v
+
+        return spread(ix) | (spread(iy) << np.uint64(1))
+
+    @staticmethod
+    def hilbert_key_array(ix, iy, bits=SPATIAL_ORDER_BITS):
+        """Key Hilbert (xy2d) trên lưới 2^bits x 2^bits - 2 key liên tiếp luôn là 2 ô kề nhau"""
+        n = np.int64(1) << np.int64(bits)
+        x = np.array(ix, dtype=np.int64)
+        y = np.array(iy, dtype=np.int64)
+        d = np.zeros(x.shape, dtype=np.int64)
+        s = n >> 1
+        while s > 0:
+            rx = (x & s) > 0
+            ry = (y & s) > 0
+            d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+            # Xoay / lật góc phần tư
+            flip = ~ry & rx
+            x = np.where(flip, n - 1 - x, x)
+            y = np.where(flip, n - 1 - y, y)
+            x, y = np.where(ry, x, y), np.where(ry, y, x)
+            s >>= 1
+        return d
+
+    @classmethod
+    def spatial_order(cls, lon, lat, curve, bits=SPATIAL_ORDER_BITS):
+        """
+        Hoán vị sắp xếp instance theo đường cong lấp đầy ('morton' / 'hilbert').
+
+        lon/lat được lượng tử hóa về lưới 2^bits trong bbox của chính các instance,
+        argsort stable nên instance trùng ô giữ thứ tự ban đầu.
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        cells = (1 << bits) - 1
+
+        def quantize(v):
+            span = float(v.max() - v.min()) if len(v) else 0.0
+            return np.round((v - v.min()) / (span or 1.0) * cells).astype(np.int64)
+
+        ix, iy = quantize(lon), quantize(lat)
+        if curve == "morton":
+            key = cls.morton_key_array(ix, iy)
+        elif curve == "hilbert":
+            key = cls.hilbert_key_array(ix, iy, bits)
+        else:
+            raise ValueError(f"order must be one of: {list(INSTANCE_ORDERS)}")
+        return np.argsort(key, kind="stable")
+
+    @staticmethod
+    def instances_to_arrays(instances):
+        """
+        Chuyển list dict instances sang các mảng float64 cột.
+
+        Returns:
+            (lon, lat, height, heading, scale)
+        """
+        count = len(instances)
+        lon = np.fromiter((float(i["lon"]) for i in instances), dtype=np.float64, count=count)
+        lat = np.fromiter((float(i["lat"]) for i in instances), dtype=np.float64, count=count)
+        height = np.fromiter((float(i.get("height", 0.0)) for i in instances), dtype=np.float64, count=count)
+        heading = np.fromiter((float(i.get("heading", 0.0)) for i in instances), dtype=np.float64, count=count)
+        scale = np.fromiter((float(i.get("scale", 1.0)) for i in instances), dtype=np.float64, count=count)
+        return lon, lat, height, heading, scale
+
+    def generate_i3dm(self, instances, output_path, vectorized=True):
         """
         Tạo I3DM file từ danh sách instances.
         
@@ -121,10 +557,19 @@ class I3DMGenerator:
                 - height: Độ cao (m, mặc định 0)
                 - scale: Tỷ lệ (mặc định 1.0)
                 - heading: Góc quay quanh trục Z (°, 0=Bắc, mặc định 0)
+            output_path: Đường dẫn file .i3dm
+            vectorized: True = dùng numpy (generate_i3dm_arrays),
+                False = vòng lặp scalar cũ (giữ lại để đối chiếu, không hỗ trợ compact / order)
         """
         if not instances:
             raise ValueError("Cần ít nhất 1 instance")
 
+        if vectorized or self.compact or self.order:
+            lon, lat, height, heading, scale = self.instances_to_arrays(instances)
+            return self.generate_i3dm_arrays(
+                lon, lat, height, output_path, heading=heading, scale=scale
+            )
+
         positions = []
         ups = []
         rights = []
@@ -212,11 +657,9 @@ class I3DMGenerator:
         }
         offset += count * 4
         
-        feature_table["GLTF_FORMAT"] = 1
+        feature_table["GLTF_FORMAT"] = self.gltf_format
 
-        # JSON padding
-        ft_json_bytes = json.dumps(feature_table, separators=(",", ":")).encode("utf-8")
-        ft_json_bytes += b" " * ((8 - len(ft_json_bytes) % 8) % 8)
+        ft_json_bytes = self._encode_feature_table_json(feature_table)
 
         # ========== Feature Table Binary ==========
         ft_bin = bytearray()
@@ -237,33 +680,166 @@ class I3DMGenerator:
         for s in scales:
             ft_bin += struct.pack("<f", s)
         
-        # Binary padding
-        ft_bin += b"\x00" * ((8 - len(ft_bin) % 8) % 8)
-
-        # ========== I3DM Header ==========
-        byte_length = 32 + len(ft_json_bytes) + len(ft_bin) + len(self.glb_data)
-        
-        header = struct.pack(
-            "<4sIIIIIII",
-            b"i3dm",
-            1,
-            byte_length,
-            len(ft_json_bytes),
-            len(ft_bin),
-            0,
-            0,
-            1
+        writer = I3DMWriter(ft_json_bytes, [ft_bin], self.gltf_format, **self._glb_body(output_path))
+        return self._write_i3dm(writer, output_path, count)
+
+    def generate_i3dm_arrays(self, lon, lat, height, output_path, heading=None, scale=None,
+                             rtc_center=None):
+        """
+        Tạo I3DM file từ các mảng cột (engine vectorized).
+
+        Output trùng từng byte với vòng lặp scalar của generate_i3dm (khi không bật order).
+
+        Args:
+            lon, lat: Mảng kinh độ / vĩ độ (°)
+            height: Mảng độ cao (m)
+            output_path: Đường dẫn file .i3dm
+            heading: Mảng góc quay (°), mặc định 0
+            scale: Mảng tỷ lệ, mặc định 1.0
+            rtc_center: (x, y, z) ECEF, mặc định = instance đầu tiên (sau khi sắp xếp)
+        """
+        writer = self.i3dm_writer_arrays(
+            lon, lat, height, heading=heading, scale=scale, rtc_center=rtc_center, output_path=output_path
         )
+        return self._write_i3dm(writer, output_path, len(lon))
+
+    def i3dm_writer_arrays(self, lon, lat, height, heading=None, scale=None, rtc_center=None,
+                           output_path=None):
+        """
+        Tính feature table, trả về I3DMWriter chưa ghi gì (cùng tham số với generate_i3dm_arrays).
+
+        Dùng writer.iter_chunks() cho StreamingHttpResponse (tile tạo tức thì, không lưu file);
+        output_path chỉ cần khi external_glb (URI tương đối).
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        count = len(lon)
+        if count == 0:
+            raise ValueError("Cần ít nhất 1 instance")
+
+        height = np.broadcast_to(np.asarray(height, dtype=np.float64), (count,))
+        heading = np.zeros(count) if heading is None else np.broadcast_to(
+            np.asarray(heading, dtype=np.float64), (count,))
+        scale = np.ones(count) if scale is None else np.broadcast_to(
+            np.asarray(scale, dtype=np.float64), (count,))
+
+        if self.order:
+            perm = self.spatial_order(lon, lat, self.order)
+            lon, lat, height, heading, scale = (c[perm] for c in (lon, lat, height, heading, scale))
+
+        # RTC_CENTER = instance đầu tiên (giống bản scalar)
+        abs_xyz = self.geodetic_to_cartesian_array(lon, lat, height)
+        if rtc_center is None:
+            rtc = abs_xyz[0].copy()
+        else:
+            rtc = np.asarray(rtc_center, dtype=np.float64)
+        rtc_x, rtc_y, rtc_z = (float(v) for v in rtc)
+
+        if self.debug:
+            print(f"\n📍 RTC_CENTER: ({rtc_x:.2f}, {rtc_y:.2f}, {rtc_z:.2f})")
+
+        positions = abs_xyz - rtc
+        ups, rights = self.compute_enu_frame_array(lon, lat, heading)
+
+        if self.debug:
+            for i in range(min(3, count)):
+                print(f"\n📦 Instance {i+1}:")
+                print(f"   Pos: ({lon[i]:.6f}, {lat[i]:.6f}, {height[i]:.2f}m)")
+                print(f"   UP: ({ups[i, 0]:.4f}, {ups[i, 1]:.4f}, {ups[i, 2]:.4f})")
+                print(f"   RIGHT: ({rights[i, 0]:.4f}, {rights[i, 1]:.4f}, {rights[i, 2]:.4f})")
+                print(f"   Scale: {scale[i]:.2f}x")
+
+        # ========== Feature Table ==========
+        if self.compact:
+            feature_table, ft_bin = self._compact_feature_table(positions, ups, rights, scale)
+        else:
+            feature_table = {
+                "INSTANCES_LENGTH": count,
+                "POSITION": {"byteOffset": 0, "componentType": "FLOAT", "type": "VEC3"},
+                "NORMAL_UP": {"byteOffset": count * 12, "componentType": "FLOAT", "type": "VEC3"},
+                "NORMAL_RIGHT": {"byteOffset": count * 24, "componentType": "FLOAT", "type": "VEC3"},
+                "SCALE": {"byteOffset": count * 36, "componentType": "FLOAT", "type": "SCALAR"},
+            }
+
+            # ========== Feature Table Binary (từng buffer, writer ghi nối tiếp) ==========
+            ft_bin = [
+                positions.astype("<f4"),
+                ups.astype("<f4"),
+                rights.astype("<f4"),
+                scale.astype("<f4"),
+            ]
+
+        # Giữ thứ tự key như bản scalar: INSTANCES_LENGTH, RTC_CENTER, ..., GLTF_FORMAT
+        feature_table = {
+            "INSTANCES_LENGTH": count,
+            "RTC_CENTER": [rtc_x, rtc_y, rtc_z],
+            **feature_table,
+            "GLTF_FORMAT": self.gltf_format,
+        }
+        ft_json_bytes = self._encode_feature_table_json(feature_table)
+
+        return I3DMWriter(ft_json_bytes, ft_bin, self.gltf_format, **self._glb_body(output_path))
+
+    def _compact_feature_table(self, positions, ups, rights, scale):
+        """
+        Feature table nén: ~14 bytes/instance thay vì 40.
+
+        Layout binary (đảm bảo alignment theo component):
+            SCALE (float32, chỉ khi scale khác 1) → POSITION_QUANTIZED (uint16 VEC3)
+            → NORMAL_UP_OCT32P → NORMAL_RIGHT_OCT32P (uint16 VEC2)
+
+        I3DM không có SCALE global: scale đồng nhất = 1 thì bỏ hẳn SCALE
+        (mặc định của spec), ngược lại vẫn ghi SCALE từng instance.
+        """
+        count = len(positions)
+        quantized, volume_offset, volume_scale = self.quantize_positions(positions)
+
+        feature_table = {}
+        parts = []
+        offset = 0
+
+        if not np.all(scale == 1.0):
+            feature_table["SCALE"] = {"byteOffset": offset, "componentType": "FLOAT", "type": "SCALAR"}
+            parts.append(scale.astype("<f4"))
+            offset += count * 4
+
+        feature_table["QUANTIZED_VOLUME_OFFSET"] = [float(v) for v in volume_offset]
+        feature_table["QUANTIZED_VOLUME_SCALE"] = [float(v) for v in volume_scale]
+        feature_table["POSITION_QUANTIZED"] = {
+            "byteOffset": offset, "componentType": "UNSIGNED_SHORT", "type": "VEC3"
+        }
+        parts.append(quantized)
+        offset += count * 6
+
+        feature_table["NORMAL_UP_OCT32P"] = {
+            "byteOffset": offset, "componentType": "UNSIGNED_SHORT", "type": "VEC2"
+        }
+        parts.append(self.oct_encode_array(ups))
+        offset += count * 4
 
-        # ========== Write File ==========
+        feature_table["NORMAL_RIGHT_OCT32P"] = {
+            "byteOffset": offset, "componentType": "UNSIGNED_SHORT", "type": "VEC2"
+        }
+        parts.append(self.oct_encode_array(rights))
+
+        return feature_table, parts
+
+    @staticmethod
+    def _encode_feature_table_json(feature_table):
+        """JSON feature table, pad bằng space tới bội số 8"""
+        ft_json_bytes = json.dumps(feature_table, separators=(",", ":")).encode("utf-8")
+        ft_json_bytes += b" " * ((8 - len(ft_json_bytes) % 8) % 8)
+        return ft_json_bytes
+
+    def _write_i3dm(self, writer, output_path, count):
+        """Ghi header + feature table + GLB (hoặc URI) ra file .i3dm qua I3DMWriter"""
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(output_path, "wb") as f:
-            f.write(header)
-            f.write(ft_json_bytes)
-            f.write(ft_bin)
-            f.write(self.glb_data)
+        byte_length = writer.write(output_path)
+        
+        if self.precompress:
+            write_precompressed(output_path)
         
         if self.debug:
             print(f"\n✅ Created: {output_path}")
@@ -273,8 +849,176 @@ class I3DMGenerator:
         return output_path
 
     @staticmethod
-    def create_tileset_json(instances, i3dm_relative_url, output_path):
-        """Tạo tileset.json cho I3DM"""
+    def bounding_region(lon, lat, height):
+        """Region [west, south, east, north, minH, maxH] (radian, m) bao sát các instance"""
+        return [
+            math.radians(float(np.min(lon))),
+            math.radians(float(np.min(lat))),
+            math.radians(float(np.max(lon))),
+            math.radians(float(np.max(lat))),
+            float(np.min(height)),
+            float(np.max(height)) + HEIGHT_BUFFER,
+        ]
+
+    @staticmethod
+    def region_geometric_error(region):
+        """geometricError theo kích thước tile: giảm dần khi xuống sâu quadtree"""
+        west, south, east, north, min_h, max_h = region
+        mid_lat = (south + north) / 2
+        dx = (east - west) * I3DMGenerator.WGS84_A * math.cos(mid_lat)
+        dy = (north - south) * I3DMGenerator.WGS84_A
+        dz = max_h - min_h
+        return math.sqrt(dx * dx + dy * dy + dz * dz) * GEOMETRIC_ERROR_FACTOR
+
+    def generate_tileset(self, lon, lat, height, output_dir, name, heading=None, scale=None,
+                         max_instances_per_tile=MAX_INSTANCES_PER_TILE, on_progress=None):
+        """
+        Tạo tileset.json + I3DM tiles cho tập instances (dạng mảng cột).
+
+        - <= max_instances_per_tile: 1 tile instances_<name>.i3dm (như cũ)
+        - Lớn hơn: quadtree trong thư mục instances_<name>/, mỗi tile có
+          RTC_CENTER riêng, region bao sát và geometricError giảm theo độ sâu.
+          Tile cha giữ 1 mẫu thưa (refine ADD), phần còn lại chia cho 4 tile con.
+
+        on_progress(done, total) được gọi sau mỗi tile (số instance đã ghi) - raise trong
+        callback (vd. job bị hủy) dừng generate ngay giữa các tile.
+
+        Returns:
+            dict: tileset_file, i3dm_file (tile gốc, tương đối với output_dir), tile_count
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        count = len(lon)
+        if count == 0:
+            raise ValueError("Cần ít nhất 1 instance")
+
+        height = np.broadcast_to(np.asarray(height, dtype=np.float64), (count,))
+        heading = np.zeros(count) if heading is None else np.broadcast_to(
+            np.asarray(heading, dtype=np.float64), (count,))
+        scale = np.ones(count) if scale is None else np.broadcast_to(
+            np.asarray(scale, dtype=np.float64), (count,))
+
+        output_dir = Path(output_dir)
+        tileset_filename = f"tileset_{name}.json"
+        written = 0
+
+        def tile_written(tile_count):
+            nonlocal written
+            written += tile_count
+            if on_progress is not None:
+                on_progress(written, count)
+
+        if count <= max_instances_per_tile:
+            i3dm_filename = f"instances_{name}.i3dm"
+            self.generate_i3dm_arrays(
+                lon, lat, height, output_dir / i3dm_filename, heading=heading, scale=scale
+            )
+            tile_written(count)
+            root = {
+                "boundingVolume": {"region": self.bounding_region(lon, lat, height)},
+                "geometricError": 0,
+                "refine": "ADD",
+                "content": {"uri": i3dm_filename},
+            }
+            tile_count = 1
+        else:
+            tiles_dirname = f"instances_{name}"
+            i3dm_filename = f"{tiles_dirname}/0.i3dm"
+            columns = (lon, lat, height, heading, scale)
+            tiles = []
+            root = self._build_quadtree_node(
+                columns, np.arange(count), "0", 0,
+                output_dir / tiles_dirname, tiles_dirname, max_instances_per_tile, tiles, tile_written
+            )
+            tile_count = len(tiles)
+
+        tileset = {
+            "asset": {"version": "1.0"},
+            "geometricError": max(self.region_geometric_error(root["boundingVolume"]["region"]), 1.0) * 2,
+            "root": root,
+        }
+
+        tileset_path = output_dir / tileset_filename
+        tileset_path.parent.mkdir(parents=True, exist_ok=True)
+        # Ghi sau cùng và thay file 1 lần: thấy tileset.json là mọi tile đã ghi xong
+        write_atomic(tileset_path, lambda f: json.dump(tileset, f, indent=2), "w", encoding="utf-8")
+        if self.precompress:
+            write_precompressed(tileset_path)
+
+        if self.debug:
+            print(f"✅ Created tileset: {tileset_path} ({tile_count} tiles)")
+
+        return {
+            "tileset_file": tileset_filename,
+            "i3dm_file": i3dm_filename,
+            "tile_count": tile_count,
+        }
+
+    def _build_quadtree_node(self, columns, index, address, depth, tiles_dir, tiles_url,
+                             max_per_tile, tiles, tile_written):
+        """Đệ quy tạo 1 node quadtree, ghi file I3DM của node và trả về dict tile"""
+        lon, lat, height, heading, scale = (c[index] for c in columns)
+        region = self.bounding_region(lon, lat, height)
+
+        if len(index) <= max_per_tile or depth >= QUADTREE_MAX_DEPTH:
+            content = index
+            rest = index[:0]
+        else:
+            # Mẫu thưa, rải đều cho tile cha; phần còn lại xuống tile con
+            stride = -(-len(index) // max_per_tile)
+            keep = np.zeros(len(index), dtype=bool)
+            keep[::stride] = True
+            content = index[keep]
+            rest = index[~keep]
+
+        # RTC_CENTER = tâm region của tile
+        c_lon, c_lat, c_h = columns[0][content], columns[1][content], columns[2][content]
+        center = self.geodetic_to_cartesian(
+            (float(c_lon.min()) + float(c_lon.max())) / 2,
+            (float(c_lat.min()) + float(c_lat.max())) / 2,
+            (float(c_h.min()) + float(c_h.max())) / 2,
+        )
+        filename = f"{address}.i3dm"
+        self.generate_i3dm_arrays(
+            c_lon, c_lat, c_h, Path(tiles_dir) / filename,
+            heading=columns[3][content], scale=columns[4][content], rtc_center=center,
+        )
+        tiles.append(filename)
+        tile_written(len(content))
+
+        node = {
+            "boundingVolume": {"region": region},
+            "geometricError": 0,
+            "refine": "ADD",
+            "content": {"uri": f"{tiles_url}/{filename}"},
+        }
+
+        if len(rest):
+            mid_lon = (region[0] + region[2]) / 2
+            mid_lat = (region[1] + region[3]) / 2
+            east = np.radians(columns[0][rest]) >= mid_lon
+            north = np.radians(columns[1][rest]) >= mid_lat
+            children = []
+            for quadrant, mask in enumerate((~east & ~north, east & ~north, ~east & north, east & north)):
+                if mask.any():
+                    children.append(self._build_quadtree_node(
+                        columns, rest[mask], f"{address}_{quadrant}", depth + 1,
+                        tiles_dir, tiles_url, max_per_tile, tiles, tile_written
+                    ))
+            node["children"] = children
+            node["geometricError"] = self.region_geometric_error(region)
+
+        return node
+
+    @staticmethod
+    def create_tileset_json(instances, i3dm_relative_url, output_path, height_range=None):
+        """
+        Tạo tileset.json cho I3DM
+        
+        Args:
+            height_range: (min, max) độ cao terrain trong vùng (vd: get_terrain_samples_for_bbox),
+                          gộp vào region để bounding volume không cắt mất terrain
+        """
         if not instances:
             return
         
@@ -288,8 +1032,11 @@ class I3DMGenerator:
         max_lat = max(lats)
         min_h = min(heights)
         max_h = max(heights)
+        if height_range is not None:
+            min_h = min(min_h, height_range[0])
+            max_h = max(max_h, height_range[1])
         
-        height_buffer = 50.0
+        height_buffer = HEIGHT_BUFFER
         
         tileset = {
             "asset": {"version": "1.0"},
@@ -307,8 +1054,7 @@ class I3DMGenerator:
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(tileset, f, indent=2)
+        write_atomic(output_path, lambda f: json.dump(tileset, f, indent=2), "w", encoding="utf-8")
         
         print(f"✅ Created tileset: {output_path}")
 
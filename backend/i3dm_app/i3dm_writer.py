@@ -0,0 +1,182 @@
+"""
+i3dm_app/i3dm_writer.py
+Ghi file I3DM theo luồng: header -> feature table JSON -> từng buffer binary -> GLB,
+không ghép cả tile thành 1 bytes trong memory. GLB nguồn được copy thẳng giữa 2 file
+(copy_file_range / sendfile), cùng writer dùng được cho StreamingHttpResponse.
+File trên disk được ghi ra file tạm rồi os.replace (write_atomic): worker / request song song
+cùng tạo 1 tileset không đọc thấy tile dở dang.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+
+
+I3DM_HEADER_BYTES = 32
+# Kích thước mỗi chunk khi stream (iter_chunks) / copy GLB không có zero-copy
+STREAM_CHUNK_BYTES = 1024 * 1024
+# Quyền file output giống open() thông thường (file tạm của mkstemp là 0600)
+OUTPUT_FILE_MODE = 0o644
+
+
+def padding(length, alignment=8):
+    return (alignment - length % alignment) % alignment
+
+
+def write_atomic(path, write_to, mode="wb", **open_kwargs):
+    """
+    Gọi write_to(f) với file tạm cùng thư mục rồi os.replace vào path.
+    Lỗi giữa chừng thì xóa file tạm, path giữ nguyên nội dung cũ (hoặc chưa tồn tại).
+
+    Returns:
+        Giá trị write_to trả về
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            result = write_to(f)
+        os.chmod(tmp_path, OUTPUT_FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return result
+
+
+class I3DMWriter:
+    """
+    1 tile I3DM đã tính xong feature table, chưa ghi.
+
+    Args:
+        ft_json_bytes: Feature table JSON (đã pad tới bội số 8)
+        ft_bin_parts: List buffer (bytes / ndarray / memoryview) nối tiếp thành feature table binary
+        gltf_format: 1 = GLB nhúng, 0 = URI
+        body: Phần sau feature table dạng bytes-like (URI, hoặc GLB đã có trong memory)
+        body_path: Hoặc đường dẫn file GLB - copy thẳng từ file, không đọc vào memory
+    """
+
+    def __init__(self, ft_json_bytes, ft_bin_parts, gltf_format, body=b"", body_path=None):
+        self.ft_json_bytes = ft_json_bytes
+        self.ft_bin_parts = [memoryview(part).cast("B") for part in ft_bin_parts]
+        self.gltf_format = gltf_format
+        self.body_path = body_path
+        self.body = None if body_path else memoryview(body).cast("B")
+        self.body_length = os.stat(body_path).st_size if body_path else len(self.body)
+
+        bin_length = sum(len(part) for part in self.ft_bin_parts)
+        self.bin_padding = padding(bin_length)
+        self.ft_bin_length = bin_length + self.bin_padding
+        self.byte_length = I3DM_HEADER_BYTES + len(ft_json_bytes) + self.ft_bin_length + self.body_length
+
+    def header(self):
+        return struct.pack(
+            "<4sIIIIIII",
+            b"i3dm",
+            1,
+            self.byte_length,
+            len(self.ft_json_bytes),
+            self.ft_bin_length,
+            0,
+            0,
+            self.gltf_format
+        )
+
+    def _sections(self):
+        """Các đoạn trước GLB, theo đúng thứ tự trong file"""
+        yield self.header()
+        yield self.ft_json_bytes
+        yield from self.ft_bin_parts
+        yield b"\x00" * self.bin_padding
+
+    def write_to(self, f):
+        """
+        Ghi tile vào file-like f (mở ở chế độ binary).
+
+        f có fileno() và GLB là file thì copy bằng copy_file_range / sendfile (zero-copy),
+        ngược lại đọc GLB theo chunk.
+
+        Returns:
+            Số bytes đã ghi
+        """
+        for section in self._sections():
+            if len(section):
+                f.write(section)
+
+        if self.body_path is None:
+            f.write(self.body)
+            return self.byte_length
+
+        try:
+            fileno = f.fileno()
+        except (AttributeError, OSError):
+            fileno = None
+
+        with open(self.body_path, "rb") as src:
+            if fileno is None:
+                shutil.copyfileobj(src, f, STREAM_CHUNK_BYTES)
+            else:
+                f.flush()
+                _copy_fd(src.fileno(), fileno, self.body_length)
+                # Đồng bộ lại vị trí của file object sau khi ghi thẳng vào fd
+                f.seek(os.lseek(fileno, 0, os.SEEK_CUR))
+        return self.byte_length
+
+    def write(self, path):
+        """Ghi tile ra path (file tạm + os.replace), trả về số bytes"""
+        return write_atomic(path, self.write_to)
+
+    def iter_chunks(self, chunk_size=STREAM_CHUNK_BYTES):
+        """Chunk bytes lần lượt (cho StreamingHttpResponse), buffer lớn được cắt theo chunk_size"""
+        for section in self._sections():
+            for start in range(0, len(section), chunk_size):
+                yield bytes(section[start:start + chunk_size])
+
+        if self.body_path is None:
+            for start in range(0, len(self.body), chunk_size):
+                yield bytes(self.body[start:start + chunk_size])
+            return
+
+        with open(self.body_path, "rb") as src:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def _copy_fd(src_fd, dst_fd, length):
+    """Copy length bytes từ đầu src_fd vào vị trí hiện tại của dst_fd trong kernel"""
+    offset = 0
+    for method in ("copy_file_range", "sendfile"):
+        copy = getattr(os, method, None)
+        if copy is None:
+            continue
+        try:
+            while offset < length:
+                if method == "copy_file_range":
+                    sent = copy(src_fd, dst_fd, length - offset, offset)
+                else:
+                    sent = copy(dst_fd, src_fd, offset, length - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            if offset >= length:
+                return
+        except OSError:
+            # Filesystem / kernel không hỗ trợ -> thử cách tiếp theo từ offset hiện tại
+            continue
+
+    # Fallback: đọc / ghi qua userspace
+    while offset < length:
+        chunk = os.pread(src_fd, min(STREAM_CHUNK_BYTES, length - offset), offset)
+        if not chunk:
+            raise IOError("GLB source truncated while copying")
+        view = memoryview(chunk)
+        while len(view):
+            written = os.write(dst_fd, view)
+            view = view[written:]
+        offset += len(chunk)
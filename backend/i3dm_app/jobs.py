@@ -0,0 +1,177 @@
+"""
+i3dm_app/jobs.py
+Chạy I3DMJob ngoài request cycle (hàng đợi trong DB)
+"""
+
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .generation import (
+    GenerationCancelled,
+    StageTracker,
+    remove_partial_tileset,
+    run_bbox_generation,
+    run_lines_generation,
+    run_points_generation,
+)
+from .models import I3DMJob
+
+
+JOB_RUNNERS = {
+    I3DMJob.TYPE_BBOX: run_bbox_generation,
+    I3DMJob.TYPE_POINTS: run_points_generation,
+    I3DMJob.TYPE_LINES: run_lines_generation,
+}
+
+# Khoảng thời gian tối thiểu giữa 2 lần ghi progress / kiểm tra hủy (s)
+PROGRESS_INTERVAL = 0.5
+# Job running không có heartbeat trong khoảng này (s) coi như worker đã chết
+JOB_STALE_TIMEOUT = 600
+# Số lần nhận job tối đa - job làm worker chết liên tục thì chuyển failed thay vì chạy lại mãi
+JOB_MAX_ATTEMPTS = 3
+
+
+class JobTracker(StageTracker):
+    """StageTracker ghi stage / progress / timings vào I3DMJob và kiểm tra yêu cầu hủy"""
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        self._last_write = 0.0
+
+    def _save(self):
+        I3DMJob.objects.filter(pk=self.job.pk).update(
+            stage=self.current_stage,
+            progress=round(self.progress_value, 4),
+            stage_timings=self.stage_timings,
+            heartbeat_at=timezone.now(),
+        )
+        self._last_write = time.monotonic()
+
+    def on_update(self):
+        self._save()
+
+    def on_progress(self):
+        if time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self.check_cancelled()
+            self._save()
+
+    def check_cancelled(self):
+        if I3DMJob.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise GenerationCancelled(f"Job #{self.job.pk} cancelled")
+
+
+def requeue_stale_jobs(now=None):
+    """
+    Job running mà worker đã chết (không heartbeat quá settings.I3DM_JOB_STALE_TIMEOUT giây):
+    đã yêu cầu hủy -> cancelled, hết lượt (I3DM_JOB_MAX_ATTEMPTS) -> failed, còn lại -> pending
+
+    Returns:
+        Số job đã xử lý
+    """
+    now = now or timezone.now()
+    timeout = getattr(settings, 'I3DM_JOB_STALE_TIMEOUT', JOB_STALE_TIMEOUT)
+    max_attempts = getattr(settings, 'I3DM_JOB_MAX_ATTEMPTS', JOB_MAX_ATTEMPTS)
+    cutoff = now - timedelta(seconds=timeout)
+
+    with transaction.atomic():
+        stale = list(
+            I3DMJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=I3DMJob.STATUS_RUNNING)
+            .filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff))
+        )
+        for job in stale:
+            if job.cancel_requested:
+                job.status = I3DMJob.STATUS_CANCELLED
+                job.finished_at = now
+            elif job.attempts >= max_attempts:
+                job.status = I3DMJob.STATUS_FAILED
+                job.error = f'Worker stopped responding ({job.attempts} attempts)'
+                job.finished_at = now
+            else:
+                job.status = I3DMJob.STATUS_PENDING
+            job.save(update_fields=['status', 'error', 'finished_at'])
+            print(f"⚠️ Stale job #{job.id} (stage '{job.stage}') -> {job.status}")
+    return len(stale)
+
+
+def claim_next_job():
+    """
+    Lấy job pending cũ nhất và chuyển sang running.
+    SKIP LOCKED để nhiều worker không lấy trùng job.
+    Job running của worker đã chết được đưa lại hàng đợi trước (requeue_stale_jobs).
+    """
+    requeue_stale_jobs()
+    with transaction.atomic():
+        job = (
+            I3DMJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=I3DMJob.STATUS_PENDING, cancel_requested=False)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = I3DMJob.STATUS_RUNNING
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'started_at', 'heartbeat_at', 'attempts'])
+        return job
+
+
+def run_job(job):
+    """Chạy 1 job đã claim, cập nhật trạng thái cuối cùng"""
+    tracker = JobTracker(job)
+    print(f"\n🚀 Running job #{job.id} ({job.job_type})")
+
+    try:
+        runner = JOB_RUNNERS[job.job_type]
+        tileset_record, reused = runner(job.params, tracker)
+    except GenerationCancelled:
+        job.status = I3DMJob.STATUS_CANCELLED
+        print(f"🛑 Job #{job.id} cancelled at stage '{tracker.current_stage}'")
+    except Exception as e:
+        traceback.print_exc()
+        job.status = I3DMJob.STATUS_FAILED
+        job.error = str(e)
+    else:
+        job.status = I3DMJob.STATUS_SUCCEEDED
+        job.tileset = tileset_record
+        job.reused = reused
+        job.progress = 1.0
+        print(f"✅ Job #{job.id} done: tileset ID={tileset_record.id}")
+
+    job.stage = tracker.current_stage
+    job.stage_timings = tracker.stage_timings
+    if job.status != I3DMJob.STATUS_SUCCEEDED:
+        job.progress = tracker.progress_value
+        # Hủy / lỗi giữa stage generate: dọn tile đã ghi dở (nếu không thuộc tileset nào)
+        if tracker.output_name:
+            remove_partial_tileset(tracker.output_name)
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'error', 'tileset', 'reused', 'progress',
+        'stage', 'stage_timings', 'finished_at',
+    ])
+    return job
+
+
+def run_pending_jobs(max_jobs=None):
+    """Chạy lần lượt các job pending, trả về số job đã chạy"""
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        # Worker chạy lâu: bỏ connection hỏng / quá hạn như sau mỗi request
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from i3dm_app.terrain_helper import get_dem_store
+
+
+class Command(BaseCommand):
+    help = 'Ingest file DEM (SRTM .hgt hoặc raw grid) vào kho DEM local (settings.TERRAIN_DEM_DIR)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='File .hgt (tên dạng N21E105.hgt) hoặc raw grid')
+        parser.add_argument('--bounds', nargs=4, type=float, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'),
+                            help='Bounds của raw grid (bắt buộc với file không phải .hgt)')
+        parser.add_argument('--rows', type=int, help='Số hàng của raw grid')
+        parser.add_argument('--cols', type=int, help='Số cột của raw grid')
+        parser.add_argument('--dtype', default='<f4', help='numpy dtype của raw grid (mặc định <f4)')
+        parser.add_argument('--nodata', type=float, help='Giá trị void của raw grid')
+
+    def handle(self, *args, **options):
+        store = get_dem_store()
+        for name in options['files']:
+            path = Path(name)
+            try:
+                if path.suffix.lower() == '.hgt':
+                    tile = store.ingest_hgt(path)
+                else:
+                    if not options['bounds'] or not options['rows'] or not options['cols']:
+                        raise CommandError(f'{path.name}: raw grid cần --bounds, --rows, --cols')
+                    tile = store.ingest_raw(
+                        path, *options['bounds'], options['rows'], options['cols'],
+                        dtype=options['dtype'], nodata=options['nodata']
+                    )
+            except (OSError, ValueError) as e:
+                raise CommandError(f'{path.name}: {e}')
+
+            rows, cols = tile.shape
+            self.stdout.write(
+                f'✅ {path.name} -> {tile.path.name} ({rows}x{cols}, '
+                f'[{tile.west}, {tile.south}] → [{tile.east}, {tile.north}])'
+            )
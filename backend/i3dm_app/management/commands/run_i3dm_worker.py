@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from i3dm_app.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Worker chạy các I3DMJob đang chờ trong DB'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Chạy hết job đang chờ rồi thoát')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Số giây chờ khi hàng đợi rỗng')
+
+    def handle(self, *args, **options):
+        self.stdout.write('I3DM worker started')
+        while True:
+            done = run_pending_jobs()
+            if options['once']:
+                self.stdout.write(f'Processed {done} job(s)')
+                return
+            if not done:
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('i3dm_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='I3DMJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(choices=[('bbox', 'Random trong bbox + terrain'), ('points', 'Danh sách điểm'), ('lines', 'Cách đều dọc polyline + terrain')], max_length=20, verbose_name='Loại job')),
+                ('params', models.JSONField(verbose_name='Tham số request')),
+                ('status', models.CharField(choices=[('pending', 'Đang chờ'), ('running', 'Đang chạy'), ('succeeded', 'Thành công'), ('failed', 'Lỗi'), ('cancelled', 'Đã hủy')], db_index=True, default='pending', max_length=20, verbose_name='Trạng thái')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='Bước hiện tại')),
+                ('progress', models.FloatField(default=0, verbose_name='Tiến độ (0-1)')),
+                ('stage_timings', models.JSONField(blank=True, default=dict, verbose_name='Thời gian từng bước (s)')),
+                ('error', models.TextField(blank=True, verbose_name='Lỗi')),
+                ('cancel_requested', models.BooleanField(default=False, verbose_name='Yêu cầu hủy')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Số lần worker nhận job')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Lần cập nhật cuối của worker')),
+                ('reused', models.BooleanField(default=False, verbose_name='Dùng lại tileset có sẵn')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('tileset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='i3dm_app.i3dmtileset', verbose_name='Tileset kết quả')),
+            ],
+            options={
+                'verbose_name': 'I3DM Job',
+                'verbose_name_plural': 'I3DM Jobs',
+                'db_table': 'i3dm_job',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+def merge_duplicate_tilesets(apps, schema_editor):
+    """Record trùng tileset_file (generate song song trước khi có unique): giữ record cũ nhất"""
+    I3DMTileset = apps.get_model('i3dm_app', 'I3DMTileset')
+    I3DMJob = apps.get_model('i3dm_app', 'I3DMJob')
+    duplicates = (
+        I3DMTileset.objects.values('tileset_file')
+        .annotate(count=models.Count('id'), keep=models.Min('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        others = I3DMTileset.objects.filter(tileset_file=row['tileset_file']).exclude(id=row['keep'])
+        I3DMJob.objects.filter(tileset__in=others).update(tileset_id=row['keep'])
+        # Queryset delete không gọi I3DMTileset.delete() -> file dùng chung không bị xóa
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('i3dm_app', '0002_i3dmjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tilesets, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='i3dmtileset',
+            name='tileset_file',
+            field=models.CharField(max_length=500, unique=True, verbose_name='Tileset JSON path'),
+        ),
+    ]
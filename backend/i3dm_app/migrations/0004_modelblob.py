@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('i3dm_app', '0003_tileset_file_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True, verbose_name='Đường dẫn (trong MEDIA_ROOT)')),
+                ('sha256', models.CharField(db_index=True, max_length=64, verbose_name='SHA-256')),
+                ('size', models.BigIntegerField(verbose_name='Kích thước (bytes)')),
+                ('ref_count', models.IntegerField(default=0, verbose_name='Số tham chiếu')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Model blob',
+                'verbose_name_plural': 'Model blobs',
+                'db_table': 'i3dm_model_blob',
+            },
+        ),
+    ]
@@ -36,7 +36,8 @@ class I3DMTileset(models.Model):
     scale = models.FloatField(default=1.0, verbose_name="Scale")
     
     # File paths (relative to MEDIA_ROOT)
-    tileset_file = models.CharField(max_length=500, verbose_name="Tileset JSON path")
+    # Tên file theo hash nội dung -> unique: các lần generate song song cùng nội dung dùng chung 1 record
+    tileset_file = models.CharField(max_length=500, unique=True, verbose_name="Tileset JSON path")
     i3dm_file = models.CharField(max_length=500, verbose_name="I3DM binary path")
     
     # Timestamps
@@ -58,12 +59,29 @@ class I3DMTileset(models.Model):
         """URL để load trong Cesium"""
         return f'/media/i3dm/{self.tileset_file}'
     
+    @property
+    def tiles_dir(self):
+        """Thư mục quadtree (instances_<name>/) nếu tileset có nhiều tile, ngược lại None"""
+        from pathlib import Path
+        from django.conf import settings
+        
+        parts = Path(self.i3dm_file).parts
+        if len(parts) > 1:
+            return Path(settings.MEDIA_ROOT) / 'i3dm' / parts[0]
+        return None
+    
     @property
     def file_size(self):
-        """Tính size của i3dm file"""
+        """Tính size của i3dm file (tổng các tile nếu là quadtree)"""
         from pathlib import Path
         from django.conf import settings
         
+        tiles_dir = self.tiles_dir
+        if tiles_dir is not None:
+            if tiles_dir.exists():
+                return sum(f.stat().st_size for f in tiles_dir.glob('*.i3dm'))
+            return 0
+        
         i3dm_path = Path(settings.MEDIA_ROOT) / 'i3dm' / self.i3dm_file
         if i3dm_path.exists():
             return i3dm_path.stat().st_size
@@ -71,19 +89,31 @@ class I3DMTileset(models.Model):
     
     def delete_files(self):
         """Xóa files khi delete record"""
+        import shutil
         from pathlib import Path
         from django.conf import settings
+        from .precompress import remove_precompressed
         
         i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
         
-        # Delete tileset.json
+        # Delete tileset.json (+ bản nén sẵn .br / .gz)
         tileset_path = i3dm_dir / self.tileset_file
+        remove_precompressed(tileset_path)
         if tileset_path.exists():
             tileset_path.unlink()
             print(f"🗑️ Deleted: {self.tileset_file}")
         
+        # Delete thư mục quadtree
+        tiles_dir = self.tiles_dir
+        if tiles_dir is not None:
+            if tiles_dir.exists():
+                shutil.rmtree(tiles_dir)
+                print(f"🗑️ Deleted: {tiles_dir.name}/")
+            return
+        
         # Delete .i3dm
         i3dm_path = i3dm_dir / self.i3dm_file
+        remove_precompressed(i3dm_path)
         if i3dm_path.exists():
             i3dm_path.unlink()
             print(f"🗑️ Deleted: {self.i3dm_file}")
@@ -91,4 +121,101 @@ class I3DMTileset(models.Model):
     def delete(self, *args, **kwargs):
         """Override delete để xóa cả files"""
         self.delete_files()
-        super().delete(*args, **kwargs)
\ No newline at end of file
+        super().delete(*args, **kwargs)
+
+class I3DMJob(models.Model):
+    """
+    Job generate tileset chạy nền (worker: python manage.py run_i3dm_worker)
+    
+    Hàng đợi nằm ngay trong DB (Postgres): worker lấy job bằng
+    SELECT ... FOR UPDATE SKIP LOCKED nên chạy được nhiều worker song song.
+    """
+    TYPE_BBOX = 'bbox'
+    TYPE_POINTS = 'points'
+    TYPE_LINES = 'lines'
+    TYPE_CHOICES = [
+        (TYPE_BBOX, 'Random trong bbox + terrain'),
+        (TYPE_POINTS, 'Danh sách điểm'),
+        (TYPE_LINES, 'Cách đều dọc polyline + terrain'),
+    ]
+    
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Đang chờ'),
+        (STATUS_RUNNING, 'Đang chạy'),
+        (STATUS_SUCCEEDED, 'Thành công'),
+        (STATUS_FAILED, 'Lỗi'),
+        (STATUS_CANCELLED, 'Đã hủy'),
+    ]
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+    
+    job_type = models.CharField(max_length=20, choices=TYPE_CHOICES, verbose_name="Loại job")
+    params = models.JSONField(verbose_name="Tham số request")
+    
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING,
+        db_index=True, verbose_name="Trạng thái"
+    )
+    stage = models.CharField(max_length=50, blank=True, verbose_name="Bước hiện tại")
+    progress = models.FloatField(default=0, verbose_name="Tiến độ (0-1)")
+    stage_timings = models.JSONField(default=dict, blank=True, verbose_name="Thời gian từng bước (s)")
+    error = models.TextField(blank=True, verbose_name="Lỗi")
+    cancel_requested = models.BooleanField(default=False, verbose_name="Yêu cầu hủy")
+    attempts = models.IntegerField(default=0, verbose_name="Số lần worker nhận job")
+    # Worker đang chạy cập nhật định kỳ - quá lâu không đổi = worker đã chết (xem jobs.requeue_stale_jobs)
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="Lần cập nhật cuối của worker")
+    
+    # Kết quả
+    tileset = models.ForeignKey(
+        I3DMTileset,
+        on_delete=models.SET_NULL,
+        related_name='jobs',
+        null=True,
+        blank=True,
+        verbose_name="Tileset kết quả"
+    )
+    reused = models.BooleanField(default=False, verbose_name="Dùng lại tileset có sẵn")
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'i3dm_job'
+        verbose_name = 'I3DM Job'
+        verbose_name_plural = 'I3DM Jobs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Job #{self.id} ({self.job_type}) - {self.status}"
+    
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+
+class ModelBlob(models.Model):
+    """
+    File model (GLB / B3DM) lưu 1 lần theo SHA-256 nội dung: media/blobs/<2 ký tự đầu>/<sha256>.<đuôi>
+    
+    GlbModel.glb_file, LoaiMoHinh.url_glb / url_b3dm trỏ tới path này; ref_count = số tham chiếu,
+    về 0 thì xóa file (xem blob_store.acquire_blob / release_blob).
+    """
+    path = models.CharField(max_length=255, unique=True, verbose_name="Đường dẫn (trong MEDIA_ROOT)")
+    sha256 = models.CharField(max_length=64, db_index=True, verbose_name="SHA-256")
+    size = models.BigIntegerField(verbose_name="Kích thước (bytes)")
+    ref_count = models.IntegerField(default=0, verbose_name="Số tham chiếu")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'i3dm_model_blob'
+        verbose_name = 'Model blob'
+        verbose_name_plural = 'Model blobs'
+    
+    def __str__(self):
+        return f"{self.path} ({self.ref_count} ref)"
@@ -0,0 +1,451 @@
+"""
+i3dm_app/placement.py
+Chọn vị trí đặt instance trong bbox: random đều hoặc Poisson-disk (khoảng cách tối thiểu)
++ bộ lọc (polygon, độ dốc, dải độ cao, vùng loại trừ), rejection sampling theo batch
+trên mảng numpy
+"""
+
+import numpy as np
+
+from .polygon import PolygonIndex
+
+
+# Khoảng cách (m) giữa các điểm dùng để tính độ dốc (sai phân trung tâm)
+SLOPE_STEP = 30.0
+# Số vòng rejection sampling tối đa
+MAX_SAMPLING_ROUNDS = 20
+# Số candidate tối đa mỗi vòng
+MAX_BATCH_SIZE = 2000000
+
+METERS_PER_DEGREE = 111320.0
+
+# Bộ lọc độ cao khi DEM local không phủ kín bbox (độ cao lấy từ terrain server qua HTTP):
+# tối đa count * hệ số này + REMOTE_ELEVATION_MIN_QUERIES điểm được query
+REMOTE_ELEVATION_QUERY_FACTOR = 2
+REMOTE_ELEVATION_MIN_QUERIES = 1000
+
+PLACEMENT_MODES = ('uniform', 'poisson')
+# Poisson-disk: số vòng tối đa, số ô lưới tối đa (mỗi ô = 2 int32 trong lúc chạy)
+# và ngưỡng bão hòa (1 vòng nhận < tỷ lệ này số candidate thì dừng)
+POISSON_MAX_ROUNDS = 40
+POISSON_MAX_CELLS = 16000000
+POISSON_SATURATION_RATE = 0.01
+
+# Ô lân cận cần kiểm tra (ô cạnh r/√2): 5x5 trừ 4 góc
+_NEIGHBOR_OFFSETS = [
+    (dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if abs(dx) != 2 or abs(dy) != 2
+]
+
+BBOX_KEYS = ['min_lon', 'max_lon', 'min_lat', 'max_lat']
+
+
+def parse_constraints(data):
+    """
+    Chuẩn hóa bộ lọc vị trí từ request
+
+    {
+        "max_slope": 30,          // độ
+        "min_elevation": 1,       // m, vd: loại sông / biển
+        "max_elevation": 1500,    // m
+        "exclude": [{"min_lon": .., "max_lon": .., "min_lat": .., "max_lat": ..}, ...]
+    }
+
+    Returns:
+        dict (lưu được vào JSON) hoặc None nếu không có bộ lọc nào
+
+    Raises:
+        ValueError
+    """
+    if not data:
+        return None
+
+    constraints = {}
+    if data.get('max_slope') is not None:
+        max_slope = float(data['max_slope'])
+        if not 0 < max_slope <= 90:
+            raise ValueError('max_slope must be in (0, 90] degrees')
+        constraints['max_slope'] = max_slope
+
+    for key in ('min_elevation', 'max_elevation'):
+        if data.get(key) is not None:
+            constraints[key] = float(data[key])
+    if constraints.get('min_elevation', -np.inf) > constraints.get('max_elevation', np.inf):
+        raise ValueError('min_elevation must be less than max_elevation')
+
+    exclude = []
+    for rect in data.get('exclude') or []:
+        if not all(key in rect for key in BBOX_KEYS):
+            raise ValueError(f'exclude entries must contain: {BBOX_KEYS}')
+        exclude.append({key: float(rect[key]) for key in BBOX_KEYS})
+    if exclude:
+        constraints['exclude'] = exclude
+
+    return constraints or None
+
+
+def slope_degrees(lon, lat, dem_sample, step=SLOPE_STEP):
+    """
+    Độ dốc (độ) tại các điểm bằng sai phân trung tâm trên DEM
+
+    Args:
+        dem_sample: Hàm (lon, lat) -> ndarray độ cao (NaN = không có dữ liệu)
+
+    Returns:
+        ndarray, NaN ở điểm DEM không phủ
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    d_lat = step / METERS_PER_DEGREE
+    d_lon = d_lat / np.maximum(np.cos(np.radians(lat)), 1e-6)
+
+    # 1 lần sample cho điểm giữa + 4 điểm lân cận
+    n = lon.size
+    h = dem_sample(
+        np.concatenate([lon, lon + d_lon, lon - d_lon, lon, lon]),
+        np.concatenate([lat, lat, lat, lat + d_lat, lat - d_lat]),
+    ).reshape(5, n)
+    gx = _gradient(h[0], h[1], h[2], step)
+    gy = _gradient(h[0], h[3], h[4], step)
+    return np.degrees(np.arctan(np.hypot(gx, gy)))
+
+
+def _gradient(center, forward, backward, step):
+    """Sai phân trung tâm; thiếu 1 phía (sát mép DEM) thì dùng sai phân 1 phía"""
+    gradient = (forward - backward) / (2 * step)
+    gradient = np.where(np.isnan(backward), (forward - center) / step, gradient)
+    return np.where(np.isnan(forward), (center - backward) / step, gradient)
+
+
+def exclusion_mask(lon, lat, rects):
+    """True ở điểm nằm trong 1 vùng loại trừ"""
+    excluded = np.zeros(np.shape(lon), dtype=bool)
+    for rect in rects:
+        excluded |= (
+            (lon >= rect['min_lon']) & (lon <= rect['max_lon'])
+            & (lat >= rect['min_lat']) & (lat <= rect['max_lat'])
+        )
+    return excluded
+
+
+def sample_uniform(bbox, n, rng):
+    """n điểm random đều trong bbox"""
+    lon = rng.uniform(bbox['min_lon'], bbox['max_lon'], n)
+    lat = rng.uniform(bbox['min_lat'], bbox['max_lat'], n)
+    return lon, lat
+
+
+def _neighbor_conflicts(grid, stride, px, py, cells, x, y, r2, own_rank=None, skip_self=False):
+    """
+    True ở candidate có điểm trong grid cách < r (và chỉ số nhỏ hơn own_rank, nếu truyền)
+
+    Args:
+        grid: Lưới chỉ số điểm dạng phẳng (-1 = trống), đã đệm 2 ô mỗi phía
+        stride: Số ô mỗi cột của lưới (đã đệm)
+        px, py: Tọa độ các điểm được grid trỏ tới
+        cells: Chỉ số ô (phẳng) của từng candidate
+    """
+    conflict = np.zeros(len(x), dtype=bool)
+    for dx, dy in _NEIGHBOR_OFFSETS:
+        if skip_self and dx == 0 and dy == 0:
+            continue
+        j = grid.take(cells + (dx * stride + dy))
+        hit = np.flatnonzero(j >= 0)
+        if not len(hit):
+            continue
+        jj = j[hit]
+        close = (px.take(jj) - x.take(hit)) ** 2 + (py.take(jj) - y.take(hit)) ** 2 < r2
+        if own_rank is not None:
+            close &= jj < own_rank.take(hit)
+        conflict[hit[close]] = True
+    return conflict
+
+
+def poisson_disk(bbox, min_distance, rng, count=None, max_batch=MAX_BATCH_SIZE):
+    """
+    Điểm blue-noise trong bbox: mọi cặp điểm cách nhau >= min_distance (m)
+
+    Dart throwing song song trên lưới ô cạnh r/√2 (mỗi ô tối đa 1 điểm):
+    - Vùng còn thưa: candidate random đều trong bbox
+    - Dày hơn: mỗi ô còn trống 1 candidate random trong ô
+    Candidate bị loại nếu gần điểm đã nhận hoặc gần candidate có thứ tự ưu tiên
+    (random) nhỏ hơn trong cùng vòng. Dừng khi đủ count hoặc đã gần bão hòa.
+
+    Returns:
+        (lon, lat) tối đa count điểm
+
+    Raises:
+        ValueError nếu lưới quá lớn (bbox quá rộng so với min_distance)
+    """
+    r = float(min_distance)
+    if not r > 0:
+        raise ValueError('min_distance must be positive')
+
+    mid_lat = (bbox['min_lat'] + bbox['max_lat']) / 2
+    kx = METERS_PER_DEGREE * np.cos(np.radians(mid_lat))
+    ky = METERS_PER_DEGREE
+    width = (bbox['max_lon'] - bbox['min_lon']) * kx
+    height = (bbox['max_lat'] - bbox['min_lat']) * ky
+
+    cell = r / np.sqrt(2)
+    cols = int(np.ceil(width / cell))
+    rows = int(np.ceil(height / cell))
+    if cols * rows > POISSON_MAX_CELLS:
+        raise ValueError(
+            f'min_distance {r} m is too small for this bbox '
+            f'({cols * rows:,} grid cells, maximum {POISSON_MAX_CELLS:,})'
+        )
+
+    r2 = r * r
+    stride = rows + 4
+    target = count or cols * rows
+    grid = np.full((cols + 4) * stride, -1, dtype=np.int32)
+    inner = grid.reshape(cols + 4, stride)[2:-2, 2:-2]
+    batch_grid = np.full_like(grid, -1)
+    px = np.empty(min(target, cols * rows))
+    py = np.empty_like(px)
+    accepted = 0
+
+    for _ in range(POISSON_MAX_ROUNDS):
+        need = target - accepted
+        empty = cols * rows - accepted
+        if need <= 0 or empty <= 0:
+            break
+
+        if 2 * need < empty // 4:
+            n = int(min(max(2 * need, 1024), max_batch))
+            x = rng.uniform(0, width, n)
+            y = rng.uniform(0, height, n)
+            cx = np.minimum((x / cell).astype(np.intp), cols - 1)
+            cy = np.minimum((y / cell).astype(np.intp), rows - 1)
+        else:
+            # Thứ tự ô random (= thứ tự ưu tiên), chỉ lấy số ô cần thiết
+            cx, cy = np.nonzero(inner < 0)
+            pick = rng.permutation(len(cx))[:int(min(max(2 * need, 1024), max_batch))]
+            cx, cy = cx[pick], cy[pick]
+            x = (cx + rng.random(len(cx))) * cell
+            y = (cy + rng.random(len(cy))) * cell
+            keep = np.flatnonzero((x < width) & (y < height))
+            cx, cy, x, y = cx[keep], cy[keep], x[keep], y[keep]
+            n = len(x)
+        cells = (cx + 2) * stride + cy + 2
+
+        # Candidate đã theo thứ tự random -> chỉ số chính là thứ tự ưu tiên
+        # 1. Gần điểm đã nhận (kể cả cùng ô)
+        if accepted:
+            idx = np.flatnonzero(~_neighbor_conflicts(grid, stride, px, py, cells, x, y, r2))
+        else:
+            idx = np.arange(n)
+
+        # 2. Mỗi ô giữ candidate ưu tiên nhất, rồi loại candidate gần candidate
+        #    ưu tiên hơn ở ô lân cận
+        _, first = np.unique(cells[idx], return_index=True)
+        idx = np.sort(idx[first])
+        batch_grid[cells[idx]] = idx
+        close = _neighbor_conflicts(batch_grid, stride, x, y, cells[idx], x[idx], y[idx], r2,
+                                    own_rank=idx, skip_self=True)
+        batch_grid[cells[idx]] = -1
+        idx = idx[~close][:need]
+
+        new = np.arange(accepted, accepted + len(idx))
+        px[new] = x[idx]
+        py[new] = y[idx]
+        grid[cells[idx]] = new
+        accepted += len(idx)
+
+        if len(idx) < n * POISSON_SATURATION_RATE:
+            break
+
+    lon = bbox['min_lon'] + px[:accepted] / kx
+    lat = bbox['min_lat'] + py[:accepted] / ky
+    return lon, lat
+
+
+def cull_elevation_filter(bbox, constraints, elevation_range):
+    """
+    Dùng min/max độ cao của cả bbox (pyramid min/max của DEM, không sample) để xử lý trước
+    bộ lọc dải độ cao khi DEM phủ kín bbox:
+    - cả bbox nằm trong dải -> bỏ bộ lọc, candidate không cần query độ cao
+    - cả bbox nằm ngoài dải -> ValueError ngay, không sinh / query candidate nào
+
+    Args:
+        elevation_range: Hàm (min_lon, max_lon, min_lat, max_lat) -> (min, max, covered)
+            (DemTileStore.elevation_range)
+
+    Returns:
+        constraints (bản mới nếu đã bỏ bộ lọc độ cao, None nếu không còn bộ lọc nào)
+
+    Raises:
+        ValueError
+    """
+    if not constraints or not ('min_elevation' in constraints or 'max_elevation' in constraints):
+        return constraints
+    low, high, covered = elevation_range(*(bbox[key] for key in BBOX_KEYS))
+    if not covered:
+        return constraints
+
+    min_elevation = constraints.get('min_elevation', -np.inf)
+    max_elevation = constraints.get('max_elevation', np.inf)
+    if high < min_elevation or low > max_elevation:
+        raise ValueError(
+            f'Terrain in bbox is {low:.1f}m → {high:.1f}m, '
+            f'outside elevation range [{min_elevation}, {max_elevation}]'
+        )
+    if low >= min_elevation and high <= max_elevation:
+        constraints = {k: v for k, v in constraints.items() if k not in ('min_elevation', 'max_elevation')}
+        return constraints or None
+    return constraints
+
+
+def filter_candidates(lon, lat, constraints, height_fn=None, dem_sample=None, polygon=None,
+                      max_height_queries=None):
+    """
+    Lọc candidate theo bộ lọc, bộ lọc rẻ chạy trước
+
+    1. Vùng loại trừ (so sánh tọa độ)
+    2. Nằm trong polygon (PolygonIndex dựng từ constraints['polygon'])
+    3. Độ dốc (DEM local; điểm DEM không phủ coi như đạt)
+    4. Dải độ cao (height_fn - DEM hoặc terrain server), chỉ query tối đa
+       max_height_queries candidate còn lại (phần dư bị loại)
+
+    Returns:
+        (mask, heights): heights là độ cao của các điểm đạt (hoặc None nếu không cần query)
+    """
+    mask = np.ones(lon.shape, dtype=bool)
+
+    if constraints.get('exclude'):
+        mask &= ~exclusion_mask(lon, lat, constraints['exclude'])
+
+    if constraints.get('polygon'):
+        polygon = polygon or PolygonIndex(constraints['polygon'])
+        idx = np.flatnonzero(mask)
+        mask[idx[~polygon.contains(lon[idx], lat[idx])]] = False
+
+    if 'max_slope' in constraints and dem_sample is not None and mask.any():
+        idx = np.flatnonzero(mask)
+        slope = slope_degrees(lon[idx], lat[idx], dem_sample)
+        mask[idx[slope > constraints['max_slope']]] = False
+
+    heights = None
+    if 'min_elevation' in constraints or 'max_elevation' in constraints:
+        idx = np.flatnonzero(mask)
+        if max_height_queries is not None and len(idx) > max_height_queries:
+            # Candidate sinh theo thứ tự ngẫu nhiên -> bỏ phần đuôi vẫn là mẫu ngẫu nhiên
+            mask[idx[max_height_queries:]] = False
+            idx = idx[:max_height_queries]
+        h = np.asarray(height_fn(lon[idx], lat[idx]), dtype=np.float64)
+        ok = (h >= constraints.get('min_elevation', -np.inf)) & (h <= constraints.get('max_elevation', np.inf))
+        mask[idx[~ok]] = False
+        heights = h[ok]
+
+    return mask, heights
+
+
+def sample_positions(bbox, count, rng, constraints=None, height_fn=None, dem_sample=None, on_progress=None,
+                     mode='uniform', min_distance=None, max_height_queries=None):
+    """
+    count vị trí trong bbox thỏa bộ lọc (rejection sampling theo batch)
+
+    - uniform: mỗi vòng sinh đủ candidate theo tỷ lệ đạt ước lượng từ các vòng trước,
+      nên thường chỉ cần 1-2 vòng
+    - poisson: tập điểm Poisson-disk (min_distance m) làm candidate, lọc rồi chọn
+      ngẫu nhiên count điểm (bỏ bớt điểm không làm giảm khoảng cách)
+    - max_height_queries: tổng số điểm tối đa được query độ cao cho bộ lọc độ cao
+      (terrain server chậm), hết lượt mà chưa đủ vị trí thì ValueError
+
+    Returns:
+        (lon, lat, heights): heights = độ cao terrain đã query khi lọc theo độ cao, ngược lại None
+
+    Raises:
+        ValueError nếu không tìm đủ vị trí
+    """
+    if not constraints:
+        if mode == 'poisson':
+            return _sample_poisson(bbox, count, rng, min_distance, on_progress=on_progress)
+        lon, lat = sample_uniform(bbox, count, rng)
+        return lon, lat, None
+
+    # Dựng index polygon 1 lần cho mọi vòng
+    polygon = PolygonIndex(constraints['polygon']) if constraints.get('polygon') else None
+
+    height_queries = 0
+
+    def counted_height_fn(lon, lat):
+        nonlocal height_queries
+        height_queries += len(lon)
+        return height_fn(lon, lat)
+
+    def filter_fn(lon, lat):
+        budget = None if max_height_queries is None else max_height_queries - height_queries
+        if budget is not None and budget <= 0:
+            raise ValueError(
+                f'Elevation filter needs more than {max_height_queries:,} terrain server queries '
+                f'(no local DEM covers this bbox); ingest a DEM (manage.py ingest_dem) '
+                f'or remove min_elevation / max_elevation'
+            )
+        return filter_candidates(lon, lat, constraints, counted_height_fn, dem_sample, polygon=polygon,
+                                 max_height_queries=budget)
+
+    if mode == 'poisson':
+        return _sample_poisson(bbox, count, rng, min_distance, filter_fn, on_progress)
+
+    lon_parts, lat_parts, height_parts = [], [], []
+    found = 0
+    tried = 0
+
+    for _ in range(MAX_SAMPLING_ROUNDS):
+        need = count - found
+        rate = max(found / tried, 0.01) if tried else 1.0
+        batch = int(min(need / rate * 1.2 + 16, MAX_BATCH_SIZE))
+
+        lon, lat = sample_uniform(bbox, batch, rng)
+        mask, heights = filter_fn(lon, lat)
+        tried += batch
+
+        idx = np.flatnonzero(mask)[:need]
+        lon_parts.append(lon[idx])
+        lat_parts.append(lat[idx])
+        if heights is not None:
+            height_parts.append(heights[:need])
+        found += len(idx)
+
+        if on_progress:
+            on_progress(found, count)
+        if found >= count:
+            break
+
+    if found < count:
+        raise ValueError(
+            f'Only {found} of {count} positions satisfy the placement constraints '
+            f'(acceptance rate {found / tried:.2%})'
+        )
+
+    heights = np.concatenate(height_parts) if height_parts else None
+    return np.concatenate(lon_parts), np.concatenate(lat_parts), heights
+
+
+def _sample_poisson(bbox, count, rng, min_distance, filter_fn=None, on_progress=None):
+    # Có bộ lọc: thử gấp đôi count, không đủ thì dùng tập gần bão hòa
+    heights = None
+    for target in ((count * 2, None) if filter_fn else (count,)):
+        lon, lat = poisson_disk(bbox, min_distance, rng, count=target)
+        if filter_fn:
+            mask, heights = filter_fn(lon, lat)
+            lon, lat = lon[mask], lat[mask]
+        if len(lon) >= count:
+            break
+
+    if len(lon) < count:
+        raise ValueError(
+            f'Only {len(lon)} positions fit with min_distance {min_distance} m'
+            + (' and the placement constraints' if filter_fn else '')
+        )
+
+    if len(lon) > count:
+        keep = np.sort(rng.choice(len(lon), count, replace=False))
+        lon, lat = lon[keep], lat[keep]
+        if heights is not None:
+            heights = heights[keep]
+
+    if on_progress:
+        on_progress(count, count)
+    return lon, lat, heights
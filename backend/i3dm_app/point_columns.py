@@ -0,0 +1,223 @@
+"""
+i3dm_app/point_columns.py
+Đọc danh sách điểm (lon, lat, height, scale, heading) thẳng thành mảng cột numpy:
+- body nhị phân float64 little-endian dạng cột
+- JSON {"instances": [{...}, ...]} parse dần từ stream, không giữ list dict
+"""
+
+import codecs
+import json
+
+import numpy as np
+
+
+# Thứ tự cột trong body nhị phân: N lon, rồi N lat, N height, N scale, N heading
+POINT_COLUMNS = ('lon', 'lat', 'height', 'scale', 'heading')
+REQUIRED_POINT_KEYS = ['lon', 'lat', 'height']
+BINARY_POINT_BYTES = 8 * len(POINT_COLUMNS)
+# Số bytes đọc mỗi lần khi parse JSON từ stream
+JSON_CHUNK_BYTES = 256 * 1024
+# Số bytes JSON tối đa tính cho 1 instance (đã rộng cho số nhiều chữ số + khoảng trắng) - giới hạn body
+JSON_POINT_MAX_BYTES = 256
+# Token dài nhất có thể bị cắt giữa 2 chunk mà raw_decode báo lỗi trước vị trí cuối buffer ('-Infinity')
+_MAX_TOKEN_CHARS = 9
+
+_WHITESPACE = ' \t\r\n'
+
+
+class BodyTooLargeError(ValueError):
+    """Body JSON vượt quá max_bytes"""
+
+
+def columns_from_binary(body):
+    """
+    Body float64 little-endian dạng cột -> dict {tên cột: ndarray} (view trên body, không copy)
+
+    Raises:
+        ValueError
+    """
+    if not body or len(body) % BINARY_POINT_BYTES:
+        raise ValueError(
+            f'Binary body must be {len(POINT_COLUMNS)} float64 columns '
+            f'({", ".join(POINT_COLUMNS)}), {BINARY_POINT_BYTES} bytes per point'
+        )
+    count = len(body) // BINARY_POINT_BYTES
+    data = np.frombuffer(body, dtype='<f8').reshape(len(POINT_COLUMNS), count)
+    return dict(zip(POINT_COLUMNS, data))
+
+
+class PointColumnBuilder:
+    """Gom từng instance dict thành hàng tuple, đổi sang mảng numpy theo lô - không giữ lại dict"""
+
+    BATCH_ROWS = 65536
+
+    def __init__(self, max_points=None):
+        self.max_points = max_points
+        self.count = 0
+        self._rows = []
+        self._blocks = []
+
+    def append(self, inst):
+        if self.max_points is not None and self.count >= self.max_points:
+            raise OverflowError(f'Maximum {self.max_points:,} instances allowed')
+        try:
+            self._rows.append((inst['lon'], inst['lat'], inst['height'],
+                               inst.get('scale', 1.0), inst.get('heading', 0.0)))
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError(f'Instance {self.count} missing required keys: {REQUIRED_POINT_KEYS}')
+        self.count += 1
+        if len(self._rows) >= self.BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        try:
+            block = np.array(self._rows, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f'Instance values must be numbers (instances {self.count - len(self._rows)}'
+                             f'-{self.count - 1})')
+        self._blocks.append(block)
+        self._rows = []
+
+    def arrays(self):
+        self._flush()
+        if not self._blocks:
+            return {name: np.empty(0, dtype=np.float64) for name in POINT_COLUMNS}
+        data = np.concatenate(self._blocks) if len(self._blocks) > 1 else self._blocks[0]
+        self._blocks = []
+        # Mỗi cột liền bộ nhớ (C-contiguous) cho các bước vectorized phía sau
+        return {name: np.ascontiguousarray(data[:, i]) for i, name in enumerate(POINT_COLUMNS)}
+
+
+def columns_from_instances(instances, max_points=None):
+    """List instance dict (body JSON đã parse / params của job) -> dict cột"""
+    builder = PointColumnBuilder(max_points)
+    for inst in instances:
+        builder.append(inst)
+    return builder.arrays()
+
+
+class _JsonStream:
+    """Đọc giá trị JSON lần lượt từ file-like (bytes, UTF-8) bằng raw_decode trên buffer trượt"""
+
+    def __init__(self, stream, chunk_size=None, max_bytes=None):
+        self.stream = stream
+        self.chunk_size = chunk_size or JSON_CHUNK_BYTES
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.utf8 = codecs.getincrementaldecoder('utf-8-sig')()
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise BodyTooLargeError(f'Request body exceeds {self.max_bytes:,} bytes')
+        if not chunk:
+            self.eof = True
+            text = self.utf8.decode(b'', final=True)
+        else:
+            text = self.utf8.decode(chunk)
+        # Bỏ phần đã đọc để buffer không lớn dần
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Ký tự khác khoảng trắng tiếp theo ('' = hết stream)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise json.JSONDecodeError(f'Expecting one of {chars!r}', self.buf, self.pos)
+        self.pos += 1
+        return ch
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Chỉ đọc thêm khi lỗi có thể do buffer bị cắt giữa chừng, JSON sai thì báo ngay
+                if not self._truncated(e) or not self._fill():
+                    raise
+                continue
+            # Số ở cuối buffer có thể chưa đọc hết chữ số -> đọc thêm rồi parse lại
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _truncated(self, error):
+        """Lỗi ở cuối buffer, chuỗi chưa đóng, hoặc token ngắn (true, -Infinity, \\uXXXX) bị cắt ngang"""
+        return (
+            len(self.buf) - error.pos <= _MAX_TOKEN_CHARS
+            or error.msg.startswith('Unterminated string')
+        )
+
+    def items(self):
+        """Các phần tử của array hiện tại (đã đọc '[')"""
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def read_json_points(stream, max_points=None, key='instances', max_bytes=None):
+    """
+    Parse dần body JSON {..., "instances": [{lon, lat, height, scale?, heading?}, ...]}.
+
+    Mỗi instance được đổi sang cột ngay khi đọc xong, chỉ các field nhỏ khác
+    (model_id, compact...) được giữ lại dạng dict. Đọc quá max_bytes thì dừng ngay (BodyTooLargeError).
+
+    Returns:
+        (fields, columns) - columns None nếu body không có key instances
+
+    Raises:
+        json.JSONDecodeError, ValueError (BodyTooLargeError), OverflowError
+    """
+    reader = _JsonStream(stream, max_bytes=max_bytes)
+    fields = {}
+    columns = None
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            name = reader.value()
+            if not isinstance(name, str):
+                raise json.JSONDecodeError('Expecting property name', reader.buf, reader.pos)
+            reader.expect(':')
+            if name == key and reader.peek() == '[':
+                reader.pos += 1
+                builder = PointColumnBuilder(max_points)
+                for inst in reader.items():
+                    builder.append(inst)
+                columns = builder.arrays()
+            else:
+                fields[name] = reader.value()
+            if reader.expect(',}') == '}':
+                break
+
+    if reader.peek():
+        raise json.JSONDecodeError('Extra data', reader.buf, reader.pos)
+    return fields, columns
@@ -0,0 +1,151 @@
+"""
+i3dm_app/polygon.py
+Polygon / MultiPolygon GeoJSON (có lỗ) và kiểm tra điểm-trong-polygon vectorized
+"""
+
+import numpy as np
+
+
+# Số điểm x số cạnh tối đa mỗi lần so sánh (giới hạn bộ nhớ tạm)
+PIP_CHUNK = 4000000
+
+
+def parse_geojson_polygon(data):
+    """
+    Chuẩn hóa GeoJSON Polygon / MultiPolygon (hoặc Feature chứa nó)
+
+    Returns:
+        List polygon, mỗi polygon là list ring [[lon, lat], ...] (ring đầu là biên ngoài,
+        các ring sau là lỗ) - lưu được vào JSON
+
+    Raises:
+        ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError('polygon must be a GeoJSON object')
+    if data.get('type') == 'Feature':
+        data = data.get('geometry') or {}
+
+    geometry_type = data.get('type')
+    coordinates = data.get('coordinates')
+    if geometry_type == 'Polygon':
+        polygons = [coordinates]
+    elif geometry_type == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise ValueError('polygon must be a GeoJSON Polygon or MultiPolygon')
+
+    result = []
+    for polygon in polygons or []:
+        rings = []
+        for ring in polygon or []:
+            points = np.asarray(ring, dtype=np.float64)
+            if points.ndim != 2 or points.shape[1] < 2:
+                raise ValueError('polygon rings must be lists of [lon, lat]')
+            points = points[:, :2]
+            if len(points) and np.array_equal(points[0], points[-1]):
+                points = points[:-1]
+            if len(points) < 3:
+                raise ValueError('polygon rings need at least 3 distinct positions')
+            if not (np.all(np.abs(points[:, 0]) <= 180) and np.all(np.abs(points[:, 1]) <= 90)):
+                raise ValueError('polygon coordinates out of range')
+            rings.append(points.tolist())
+        if rings:
+            result.append(rings)
+
+    if not result:
+        raise ValueError('polygon has no rings')
+    return result
+
+
+class PolygonIndex:
+    """
+    Kiểm tra điểm-trong-polygon (quy tắc chẵn-lẻ, nên lỗ và nhiều polygon xử lý chung)
+
+    Cạnh được chia theo dải vĩ độ: mỗi điểm chỉ so với các cạnh cắt dải của nó,
+    nên polygon hàng nghìn đỉnh vẫn nhanh.
+    """
+
+    def __init__(self, polygons, bands=None):
+        starts, ends = [], []
+        for polygon in polygons:
+            for ring in polygon:
+                points = np.asarray(ring, dtype=np.float64)
+                starts.append(points)
+                ends.append(np.roll(points, -1, axis=0))
+        start = np.concatenate(starts)
+        end = np.concatenate(ends)
+
+        # Bỏ cạnh nằm ngang (không bao giờ được đếm)
+        keep = start[:, 1] != end[:, 1]
+        x1, y1 = start[keep, 0], start[keep, 1]
+        x2, y2 = end[keep, 0], end[keep, 1]
+
+        all_points = np.concatenate(starts)
+        self.min_lon, self.min_lat = all_points.min(axis=0)
+        self.max_lon, self.max_lat = all_points.max(axis=0)
+
+        edge_count = len(x1)
+        self.bands = bands or int(np.clip(np.sqrt(edge_count) * 2, 1, 4096))
+        self.band_height = (self.max_lat - self.min_lat) / self.bands or 1.0
+
+        # CSR: cạnh của từng dải
+        b0 = self._band(np.minimum(y1, y2))
+        b1 = self._band(np.maximum(y1, y2))
+        spans = b1 - b0 + 1
+        edge_ids = np.repeat(np.arange(edge_count), spans)
+        band_ids = np.repeat(b0, spans) + (np.arange(len(edge_ids)) - np.repeat(np.cumsum(spans) - spans, spans))
+        order = np.argsort(band_ids, kind='stable')
+        self.edge_ids = edge_ids[order]
+        self.offsets = np.searchsorted(band_ids[order], np.arange(self.bands + 1))
+
+        self.x1, self.y1 = x1, y1
+        self.dx_dy = (x2 - x1) / (y2 - y1)
+        self.y_low = np.minimum(y1, y2)
+        self.y_high = np.maximum(y1, y2)
+
+    @property
+    def bounds(self):
+        return {
+            'min_lon': float(self.min_lon),
+            'max_lon': float(self.max_lon),
+            'min_lat': float(self.min_lat),
+            'max_lat': float(self.max_lat),
+        }
+
+    def _band(self, lat):
+        return np.clip(((lat - self.min_lat) / self.band_height).astype(np.intp), 0, self.bands - 1)
+
+    def contains(self, lon, lat):
+        """Mảng bool: điểm nằm trong polygon (không tính lỗ)"""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        inside = np.zeros(lon.shape, dtype=bool)
+
+        candidates = np.flatnonzero(
+            (lon >= self.min_lon) & (lon <= self.max_lon) & (lat >= self.min_lat) & (lat <= self.max_lat)
+        )
+        if not len(candidates):
+            return inside
+
+        band = self._band(lat[candidates])
+        order = np.argsort(band, kind='stable')
+        candidates, band = candidates[order], band[order]
+        bounds = np.searchsorted(band, np.arange(self.bands + 1))
+
+        for b in np.unique(band):
+            edges = self.edge_ids[self.offsets[b]:self.offsets[b + 1]]
+            if not len(edges):
+                continue
+            points = candidates[bounds[b]:bounds[b + 1]]
+            step = max(1, PIP_CHUNK // len(edges))
+            for i in range(0, len(points), step):
+                chunk = points[i:i + step]
+                x = lon[chunk][:, None]
+                y = lat[chunk][:, None]
+                # Cạnh cắt tia ngang về phía Đông: y nằm trong [y_low, y_high) và giao điểm ở bên phải
+                spans = (self.y_low[edges] <= y) & (y < self.y_high[edges])
+                crossing = spans & (x < self.x1[edges] + (y - self.y1[edges]) * self.dx_dy[edges])
+                inside[chunk] = np.count_nonzero(crossing, axis=1) % 2 == 1
+
+        return inside
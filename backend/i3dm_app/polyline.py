@@ -0,0 +1,140 @@
+"""
+i3dm_app/polyline.py
+LineString / MultiLineString GeoJSON và đặt instance dọc polyline theo khoảng cách cố định (m),
+heading theo hướng tiếp tuyến - vectorized trên toàn bộ segment
+"""
+
+import numpy as np
+
+from .i3dm_generator import I3DMGenerator
+
+
+def parse_geojson_lines(data):
+    """
+    Chuẩn hóa polyline từ request: GeoJSON LineString / MultiLineString, Feature,
+    FeatureCollection hoặc list các line [[lon, lat], ...]
+
+    Returns:
+        List line, mỗi line là list [[lon, lat], ...] (>= 2 vị trí) - lưu được vào JSON
+
+    Raises:
+        ValueError
+    """
+    if isinstance(data, dict):
+        if data.get('type') == 'FeatureCollection':
+            result = []
+            for feature in data.get('features') or []:
+                result.extend(parse_geojson_lines(feature))
+            if not result:
+                raise ValueError('lines has no LineString')
+            return result
+        if data.get('type') == 'Feature':
+            data = data.get('geometry') or {}
+
+        geometry_type = data.get('type')
+        if geometry_type == 'LineString':
+            lines = [data.get('coordinates')]
+        elif geometry_type == 'MultiLineString':
+            lines = data.get('coordinates')
+        else:
+            raise ValueError('lines must be a GeoJSON LineString or MultiLineString')
+    elif isinstance(data, list):
+        lines = data
+    else:
+        raise ValueError('lines must be a GeoJSON object or a list of lines')
+
+    result = []
+    for line in lines or []:
+        points = np.asarray(line, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] < 2:
+            raise ValueError('lines must be lists of [lon, lat]')
+        points = points[:, :2]
+        if len(points) < 2:
+            raise ValueError('each line needs at least 2 positions')
+        if not (np.all(np.abs(points[:, 0]) <= 180) and np.all(np.abs(points[:, 1]) <= 90)):
+            raise ValueError('line coordinates out of range')
+        result.append(points.tolist())
+
+    if not result:
+        raise ValueError('lines has no positions')
+    return result
+
+
+def segment_vectors(lon0, lat0, lon1, lat1):
+    """
+    Vector (east, north) theo mét của từng segment trên ellipsoid WGS84
+    (bán kính kinh tuyến / vĩ tuyến tại vĩ độ giữa segment - sai số cỡ mm với segment vài km)
+    """
+    phi = np.radians((lat0 + lat1) * 0.5)
+    sin_phi = np.sin(phi)
+    w = 1.0 - I3DMGenerator.WGS84_E2 * sin_phi ** 2
+    prime_vertical = I3DMGenerator.WGS84_A / np.sqrt(w)
+    meridional = I3DMGenerator.WGS84_A * (1.0 - I3DMGenerator.WGS84_E2) / (w * np.sqrt(w))
+    east = np.radians(lon1 - lon0) * prime_vertical * np.cos(phi)
+    north = np.radians(lat1 - lat0) * meridional
+    return east, north
+
+
+def place_along_lines(lines, spacing, offset=0.0, heading_offset=0.0):
+    """
+    Vị trí cách đều spacing mét dọc mỗi line (bắt đầu tại offset mét từ điểm đầu).
+
+    Heading theo quy ước của I3DMGenerator (0 = trục Bắc, quay ngược chiều kim đồng hồ
+    nhìn từ trên xuống) sao cho trục Bắc của model trùng hướng đi của line;
+    heading_offset (°) cộng thêm cho model có hướng trước khác.
+
+    Args:
+        lines: List line [[lon, lat], ...] (kết quả parse_geojson_lines)
+        spacing: Khoảng cách giữa 2 instance liên tiếp (m, > 0)
+        offset: Khoảng cách từ đầu line tới instance đầu tiên (m, >= 0)
+        heading_offset: Góc cộng thêm vào heading (°)
+
+    Returns:
+        (lon, lat, heading) - 3 ndarray float64
+    """
+    if spacing <= 0:
+        raise ValueError('spacing must be positive')
+
+    points = np.concatenate([np.asarray(line, dtype=np.float64) for line in lines])
+    line_ids = np.repeat(np.arange(len(lines)), [len(line) for line in lines])
+
+    # Segment = 2 điểm liên tiếp cùng line, bỏ segment độ dài 0 (điểm trùng)
+    start = np.flatnonzero(line_ids[:-1] == line_ids[1:])
+    lon0, lat0 = points[start, 0], points[start, 1]
+    lon1, lat1 = points[start + 1, 0], points[start + 1, 1]
+    east, north = segment_vectors(lon0, lat0, lon1, lat1)
+    length = np.hypot(east, north)
+    keep = length > 0
+    lon0, lat0, lon1, lat1 = lon0[keep], lat0[keep], lon1[keep], lat1[keep]
+    east, north, length = east[keep], north[keep], length[keep]
+    seg_line = line_ids[start[keep]]
+
+    line_length = np.bincount(seg_line, weights=length, minlength=len(lines))
+    seg_count = np.bincount(seg_line, minlength=len(lines))
+    counts = np.where(
+        (seg_count > 0) & (line_length >= offset),
+        np.floor((line_length - offset) / spacing + 1e-9).astype(np.int64) + 1,
+        0
+    )
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty.copy(), empty.copy()
+
+    # Khoảng cách tích lũy toàn cục (các line nối tiếp nhau trong cùng 1 mảng)
+    cum_end = np.cumsum(length)
+    cum_start = cum_end - length
+    first_seg = np.searchsorted(seg_line, np.arange(len(lines)))
+    last_seg = first_seg + seg_count - 1
+
+    which = np.repeat(np.arange(len(lines)), counts)
+    k = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    distance = cum_start[np.minimum(first_seg, len(length) - 1)][which] + offset + k * spacing
+
+    seg = np.clip(np.searchsorted(cum_end, distance, side='left'), first_seg[which], last_seg[which])
+    t = np.clip((distance - cum_start[seg]) / length[seg], 0.0, 1.0)
+
+    lon = lon0[seg] + t * (lon1[seg] - lon0[seg])
+    lat = lat0[seg] + t * (lat1[seg] - lat0[seg])
+    heading = np.mod(np.degrees(np.arctan2(-east[seg], north[seg])) + heading_offset, 360.0)
+    return lon, lat, heading
@@ -0,0 +1,184 @@
+"""
+i3dm_app/precompress.py
+Bản nén sẵn (.br / .gz) của tile I3DM và tileset.json: ghi 1 lần lúc generate,
+khi serve chỉ chọn file theo Accept-Encoding (không tốn CPU nén mỗi request)
+"""
+
+import gzip
+import os
+import tempfile
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn - thiếu thì chỉ ghi .gz
+    brotli = None
+
+
+# Thứ tự ưu tiên khi client chấp nhận cùng q: br trước gzip
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# File nhỏ hơn không đáng nén (header HTTP đã lớn hơn phần tiết kiệm)
+PRECOMPRESS_MIN_BYTES = 512
+GZIP_LEVEL = 9
+# Block đọc file gốc khi nén theo luồng
+PRECOMPRESS_CHUNK_BYTES = 1024 * 1024
+# Quyền file bản nén giống file gốc (file tạm của mkstemp là 0600, web server chạy user khác không đọc được)
+PRECOMPRESS_FILE_MODE = 0o644
+# Quality 11 chậm ~10 lần so với 9 mà chỉ nhỏ hơn vài %, tile nhúng GLB có thể nhiều MB
+BROTLI_QUALITY = 9
+
+
+def available_encodings():
+    """Các encoding ghi được trong môi trường hiện tại"""
+    return [e for e in ENCODING_SUFFIXES if e != 'br' or brotli is not None]
+
+
+def variant_path(path, encoding):
+    path = Path(path)
+    return path.with_name(path.name + ENCODING_SUFFIXES[encoding])
+
+
+class _BrotliWriter:
+    """Nén brotli theo luồng vào file f (giao diện write / close như GzipFile)"""
+
+    def __init__(self, f):
+        self.f = f
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def write(self, data):
+        self.f.write(self.compressor.process(data))
+
+    def close(self):
+        self.f.write(self.compressor.finish())
+
+
+def _compressor(encoding, f):
+    if encoding == 'br':
+        return _BrotliWriter(f)
+    # filename='' + mtime=0: header gzip giống gzip.compress, nội dung không phụ thuộc tên file tạm
+    return gzip.GzipFile(filename='', mode='wb', compresslevel=GZIP_LEVEL, fileobj=f, mtime=0)
+
+
+def _chunks(path, data):
+    if data is not None:
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), PRECOMPRESS_CHUNK_BYTES):
+            yield view[start:start + PRECOMPRESS_CHUNK_BYTES]
+        return
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(PRECOMPRESS_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+
+
+def write_precompressed(path, data=None):
+    """
+    Ghi <path>.br / <path>.gz cạnh file gốc (ghi file tạm rồi rename).
+
+    Đọc file gốc theo block PRECOMPRESS_CHUNK_BYTES và nén theo luồng cho mọi encoding
+    trong 1 lượt: tile nhúng GLB nhiều MB không bị đọc / nén toàn bộ trong memory.
+    Bản nén không nhỏ hơn file gốc thì bỏ (và xóa bản cũ nếu có).
+
+    Returns:
+        List encoding đã ghi
+    """
+    path = Path(path)
+    size = path.stat().st_size if data is None else len(data)
+    if size < PRECOMPRESS_MIN_BYTES:
+        remove_precompressed(path)
+        return []
+
+    outputs = []
+    try:
+        for encoding in available_encodings():
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            f = os.fdopen(fd, 'wb')
+            outputs.append((encoding, tmp_path, f, _compressor(encoding, f)))
+
+        for chunk in _chunks(path, data):
+            for _, _, _, compressor in outputs:
+                compressor.write(chunk)
+
+        written = []
+        for encoding, tmp_path, f, compressor in outputs:
+            compressor.close()
+            f.close()
+            target = variant_path(path, encoding)
+            if os.path.getsize(tmp_path) >= size:
+                os.unlink(tmp_path)
+                target.unlink(missing_ok=True)
+                continue
+            os.chmod(tmp_path, PRECOMPRESS_FILE_MODE)
+            os.replace(tmp_path, target)
+            written.append(encoding)
+    except BaseException:
+        # Không để lại *.tmp cạnh tile
+        for _, tmp_path, f, _ in outputs:
+            f.close()
+            Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return written
+
+
+def remove_precompressed(path):
+    for encoding in ENCODING_SUFFIXES:
+        variant_path(path, encoding).unlink(missing_ok=True)
+
+
+def strip_variant_suffix(name):
+    """'tileset_x.json.gz' -> 'tileset_x.json'"""
+    for suffix in ENCODING_SUFFIXES.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding -> {encoding: q}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_variant(path, accept_encoding):
+    """
+    Chọn file để trả về theo Accept-Encoding.
+
+    Chỉ dùng bản nén còn mới hơn file gốc (file gốc bị ghi lại sau thì bỏ qua bản nén).
+
+    Returns:
+        (file_path, encoding) - encoding None = file gốc
+    """
+    path = Path(path)
+    accepted = parse_accept_encoding(accept_encoding)
+    candidates = []
+    for rank, encoding in enumerate(ENCODING_SUFFIXES):
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0:
+            candidates.append((-q, rank, encoding))
+
+    if candidates:
+        source_mtime = path.stat().st_mtime_ns
+        for _, _, encoding in sorted(candidates):
+            variant = variant_path(path, encoding)
+            try:
+                if variant.stat().st_mtime_ns >= source_mtime:
+                    return variant, encoding
+            except FileNotFoundError:
+                continue
+    return path, None
@@ -0,0 +1,342 @@
+"""
+i3dm_app/quantized_mesh.py
+Terrain tile Cesium quantized-mesh-1.0 tạo từ kho DEM local
+
+- Tiling geographic TMS: level 0 có 2x1 tile, y tính từ phía Nam
+- Mỗi tile là lưới đều grid_size x grid_size điểm, độ cao lấy bằng bilinear từ DEM
+  (điểm DEM không phủ = 0m)
+- Tile được gzip và cache trên đĩa, vượt dung lượng thì xóa tile ít dùng nhất
+"""
+
+import gzip
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .i3dm_generator import I3DMGenerator
+
+
+# Số điểm lưới mỗi cạnh của 1 tile
+TERRAIN_TILE_GRID = 65
+TERRAIN_TILE_MAX_ZOOM = 14
+TERRAIN_TILE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+QUANTIZED_MAX = 32767
+
+WGS84_RADII = np.array([
+    I3DMGenerator.WGS84_A,
+    I3DMGenerator.WGS84_A,
+    I3DMGenerator.WGS84_A * np.sqrt(1 - I3DMGenerator.WGS84_E2),
+])
+
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) theo độ của tile TMS geographic"""
+    size = 180.0 / (1 << z)
+    west = -180.0 + x * size
+    south = -90.0 + y * size
+    return west, south, west + size, south + size
+
+
+def tile_exists(z, x, y, max_zoom=TERRAIN_TILE_MAX_ZOOM):
+    return 0 <= z <= max_zoom and 0 <= x < (2 << z) and 0 <= y < (1 << z)
+
+
+def layer_json(max_zoom=TERRAIN_TILE_MAX_ZOOM, version='1.0.0', name='webgis3d-terrain'):
+    """layer.json cho CesiumTerrainProvider (toàn cầu, mọi level đều có tile)"""
+    return {
+        'tilejson': '2.1.0',
+        'name': name,
+        'version': '1.0.0',
+        'format': 'quantized-mesh-1.0',
+        'scheme': 'tms',
+        'tiles': [f'{{z}}/{{x}}/{{y}}.terrain?v={version}'],
+        'projection': 'EPSG:4326',
+        'bounds': [-180.0, -90.0, 180.0, 90.0],
+        'minzoom': 0,
+        'maxzoom': max_zoom,
+        'extensions': [],
+        'available': [
+            [{'startX': 0, 'startY': 0, 'endX': (2 << z) - 1, 'endY': (1 << z) - 1}]
+            for z in range(max_zoom + 1)
+        ],
+    }
+
+
+# ========== Encoding ==========
+
+def grid_triangles(n):
+    """Chỉ số tam giác (ngược chiều kim đồng hồ) của lưới n x n, hàng 0 ở phía Nam"""
+    r, c = np.meshgrid(np.arange(n - 1), np.arange(n - 1), indexing='ij')
+    sw = (r * n + c).ravel()
+    se = sw + 1
+    nw = sw + n
+    ne = nw + 1
+    return np.column_stack([sw, se, nw, se, ne, nw]).ravel()
+
+
+def zigzag_delta(values):
+    """Delta + zigzag encode (uint16) cho u / v / height"""
+    delta = np.diff(values.astype(np.int32), prepend=0)
+    return ((delta << 1) ^ (delta >> 31)).astype('<u2')
+
+
+def high_water_mark(indices):
+    """
+    High-water mark encode chỉ số tam giác.
+
+    Yêu cầu: đỉnh xuất hiện lần đầu theo thứ tự 0, 1, 2, ... (xem reorder_vertices)
+    """
+    highest = np.empty_like(indices)
+    highest[0] = 0
+    highest[1:] = np.maximum.accumulate(indices[:-1]) + 1
+    return highest - indices
+
+
+def reorder_vertices(indices, vertex_count):
+    """
+    Đánh số lại đỉnh theo thứ tự xuất hiện đầu tiên trong danh sách tam giác
+
+    Returns:
+        (order, new_indices): order[i] = đỉnh cũ ở vị trí mới i
+    """
+    first = np.full(vertex_count, len(indices), dtype=np.int64)
+    np.minimum.at(first, indices, np.arange(len(indices)))
+    order = np.argsort(first, kind='stable')
+    remap = np.empty(vertex_count, dtype=np.int64)
+    remap[order] = np.arange(vertex_count)
+    return order, remap[indices]
+
+
+def horizon_occlusion_point(positions, center):
+    """
+    Điểm che khuất chân trời (tọa độ ECEF đã chia cho bán trục ellipsoid),
+    theo EllipsoidalOccluder.computeHorizonCullingPoint của Cesium
+    """
+    direction = center / WGS84_RADII
+    direction /= np.linalg.norm(direction)
+
+    scaled = positions / WGS84_RADII
+    magnitude_sq = np.einsum('ij,ij->i', scaled, scaled)
+    magnitude = np.sqrt(magnitude_sq)
+    unit = scaled / magnitude[:, None]
+
+    magnitude_sq = np.maximum(magnitude_sq, 1.0)
+    magnitude = np.maximum(magnitude, 1.0)
+    cos_alpha = unit @ direction
+    sin_alpha = np.linalg.norm(np.cross(unit, direction), axis=1)
+    cos_beta = 1.0 / magnitude
+    sin_beta = np.sqrt(magnitude_sq - 1.0) * cos_beta
+
+    return direction * np.max(1.0 / (cos_alpha * cos_beta - sin_alpha * sin_beta))
+
+
+def encode_quantized_mesh(heights, west, south, east, north):
+    """
+    Args:
+        heights: Mảng (n, n) độ cao lưới đều, hàng 0 ở phía Nam, cột 0 ở phía Tây
+
+    Returns:
+        bytes quantized-mesh (chưa nén)
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    n = heights.shape[0]
+    vertex_count = n * n
+
+    lon = np.tile(np.linspace(west, east, n), n)
+    lat = np.repeat(np.linspace(south, north, n), n)
+    h = heights.ravel()
+
+    min_h, max_h = float(h.min()), float(h.max())
+    positions = I3DMGenerator.geodetic_to_cartesian_array(lon, lat, h)
+    center = I3DMGenerator.geodetic_to_cartesian_array(
+        np.array([(west + east) / 2]), np.array([(south + north) / 2]), (min_h + max_h) / 2
+    )[0]
+    sphere_center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+    sphere_radius = float(np.linalg.norm(positions - sphere_center, axis=1).max())
+    horizon = horizon_occlusion_point(positions, center)
+
+    # Tọa độ lượng tử hóa 0..32767
+    grid = np.round(np.linspace(0, QUANTIZED_MAX, n)).astype(np.int32)
+    u = np.tile(grid, n)
+    v = np.repeat(grid, n)
+    if max_h > min_h:
+        q = np.round((h - min_h) / (max_h - min_h) * QUANTIZED_MAX).astype(np.int32)
+    else:
+        q = np.zeros(vertex_count, dtype=np.int32)
+
+    order, indices = reorder_vertices(grid_triangles(n), vertex_count)
+    u, v, q = u[order], v[order], q[order]
+
+    wide = vertex_count > 65536
+    index_dtype = '<u4' if wide else '<u2'
+
+    parts = [
+        struct.pack('<3d', *center),
+        struct.pack('<2f', min_h, max_h),
+        struct.pack('<4d', *sphere_center, sphere_radius),
+        struct.pack('<3d', *horizon),
+        struct.pack('<I', vertex_count),
+        zigzag_delta(u).tobytes(),
+        zigzag_delta(v).tobytes(),
+        zigzag_delta(q).tobytes(),
+    ]
+    offset = sum(len(p) for p in parts)
+    alignment = 4 if wide else 2
+    if offset % alignment:
+        parts.append(b'\x00' * (alignment - offset % alignment))
+
+    parts.append(struct.pack('<I', len(indices) // 3))
+    parts.append(high_water_mark(indices).astype(index_dtype).tobytes())
+
+    # Đỉnh trên 4 cạnh (west, south, east, north) - Cesium dựng skirt từ đây
+    for edge in (u == 0, v == 0, u == QUANTIZED_MAX, v == QUANTIZED_MAX):
+        edge_indices = np.flatnonzero(edge)
+        parts.append(struct.pack('<I', len(edge_indices)))
+        parts.append(edge_indices.astype(index_dtype).tobytes())
+
+    return b''.join(parts)
+
+
+def build_terrain_tile(dem_store, z, x, y, grid_size=TERRAIN_TILE_GRID):
+    """Tile quantized-mesh (chưa nén) cho (z, x, y) từ DemTileStore"""
+    west, south, east, north = tile_bounds(z, x, y)
+    lon = np.tile(np.linspace(west, east, grid_size), grid_size)
+    lat = np.repeat(np.linspace(south, north, grid_size), grid_size)
+    heights = dem_store.sample(lon, lat)
+    heights[np.isnan(heights)] = 0.0
+    return encode_quantized_mesh(heights.reshape(grid_size, grid_size), west, south, east, north)
+
+
+# ========== Cache trên đĩa ==========
+
+class TerrainTileCache:
+    """
+    Cache tile đã gzip trên đĩa: <root>/<version>/<z>/<x>/<y>.terrain
+
+    - version = hash của index DEM -> ingest DEM mới thì tile cũ tự không còn dùng
+    - Tổng dung lượng vượt max_bytes: xóa tile có mtime cũ nhất (mtime được cập nhật
+      mỗi lần đọc) cho tới khi còn 90%
+    """
+
+    def __init__(self, root=None, max_bytes=TERRAIN_TILE_CACHE_MAX_BYTES):
+        self._lock = threading.Lock()
+        self.configure(root, max_bytes)
+
+    def configure(self, root=None, max_bytes=TERRAIN_TILE_CACHE_MAX_BYTES):
+        with self._lock:
+            self.root = Path(root) if root else None
+            self.max_bytes = max_bytes
+            self._total_bytes = None
+            self.hits = 0
+            self.misses = 0
+            self.evicted = 0
+
+    def _path(self, version, z, x, y):
+        return self.root / version / str(z) / str(x) / f'{y}.terrain'
+
+    def _files(self):
+        return [p for p in self.root.rglob('*.terrain') if p.is_file()]
+
+    def _scan(self):
+        if self._total_bytes is None:
+            self._total_bytes = sum(p.stat().st_size for p in self._files()) if self.root.exists() else 0
+        return self._total_bytes
+
+    def get(self, version, z, x, y):
+        if self.root is None:
+            return None
+        path = self._path(version, z, x, y)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, version, z, x, y, data):
+        if self.root is None:
+            return
+        path = self._path(version, z, x, y)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes = self._scan() + len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        entries = []
+        for p in self._files():
+            try:
+                stat = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, p))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evicted += 1
+        self._total_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'root': str(self.root) if self.root else None,
+                'bytes': self._scan() if self.root else 0,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+            }
+
+
+terrain_tile_cache = TerrainTileCache()
+
+
+def dem_version(dem_store):
+    """Hash ngắn của index DEM (đổi khi ingest thêm / thay tile)"""
+    try:
+        return hashlib.sha256(dem_store.index_path.read_bytes()).hexdigest()[:12]
+    except FileNotFoundError:
+        return 'empty'
+
+
+def get_terrain_tile(dem_store, z, x, y, grid_size=TERRAIN_TILE_GRID, cache=terrain_tile_cache):
+    """
+    Tile quantized-mesh đã gzip (từ cache hoặc tạo mới)
+
+    Returns:
+        (gzip_bytes, version)
+    """
+    version = dem_version(dem_store)
+    data = cache.get(version, z, x, y)
+    if data is None:
+        data = gzip.compress(build_terrain_tile(dem_store, z, x, y, grid_size), compresslevel=6)
+        cache.put(version, z, x, y, data)
+    return data, version
@@ -0,0 +1,58 @@
+"""
+i3dm_app/singleflight.py
+Gộp các request giống hệt nhau đang chạy song song thành 1 lần thực thi
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Mỗi key chỉ có 1 thread thực thi fn(); các thread khác gọi cùng key
+    trong lúc đó sẽ chờ và nhận chung kết quả (hoặc exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Returns:
+            (result, shared) - shared=True nếu kết quả lấy từ lần chạy của thread khác
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,222 @@
+"""
+i3dm_app/terrain_cache.py
+Cache độ cao terrain 2 tầng: LRU trong process + SQLite trên đĩa,
+key là ô lưới lon/lat đã lượng tử hóa (resolution độ)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# Kích thước ô lưới (°) - 1e-5° ≈ 1.1m
+TERRAIN_CACHE_RESOLUTION = 1e-5
+# Thời gian sống của 1 giá trị (s) - 30 ngày
+TERRAIN_CACHE_TTL = 30 * 24 * 3600
+TERRAIN_CACHE_MEMORY_ENTRIES = 100000
+TERRAIN_CACHE_DISK_ENTRIES = 5000000
+
+# Số cặp (cx, cy) mỗi câu SELECT (giới hạn biến của SQLite)
+_SQL_CHUNK = 400
+
+
+class TerrainHeightCache:
+    """
+    Cache độ cao theo ô lưới.
+
+    - Tầng 1: OrderedDict LRU, tối đa memory_entries ô
+    - Tầng 2: SQLite (db_path), tối đa disk_entries ô, xóa ô cũ nhất khi vượt
+    - Giá trị quá ttl giây bị bỏ qua (coi như miss)
+
+    Chỉ nên put độ cao thật (DEM / terrain server), không put giá trị estimate.
+    """
+
+    def __init__(self, db_path=None, resolution=TERRAIN_CACHE_RESOLUTION, ttl=TERRAIN_CACHE_TTL,
+                 memory_entries=TERRAIN_CACHE_MEMORY_ENTRIES, disk_entries=TERRAIN_CACHE_DISK_ENTRIES):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._conn = None
+        self.configure(db_path, resolution, ttl, memory_entries, disk_entries)
+
+    def configure(self, db_path=None, resolution=TERRAIN_CACHE_RESOLUTION, ttl=TERRAIN_CACHE_TTL,
+                  memory_entries=TERRAIN_CACHE_MEMORY_ENTRIES, disk_entries=TERRAIN_CACHE_DISK_ENTRIES):
+        """Đổi cấu hình (apps.ready đọc từ settings) - xóa tầng memory"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.db_path = db_path or None
+            self.resolution = resolution
+            self.ttl = ttl
+            self.memory_entries = memory_entries
+            self.disk_entries = disk_entries
+            self._memory.clear()
+            self._puts_since_trim = 0
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+    def cell(self, lon, lat):
+        """Key ô lưới (cx, cy)"""
+        return (int(round(lon / self.resolution)), int(round(lat / self.resolution)))
+
+    # ========== SQLite ==========
+
+    def _db(self):
+        if self._conn is None and self.db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS heights ('
+                ' resolution REAL NOT NULL, cx INTEGER NOT NULL, cy INTEGER NOT NULL,'
+                ' height REAL NOT NULL, updated REAL NOT NULL,'
+                ' PRIMARY KEY (resolution, cx, cy)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS heights_updated ON heights (updated)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, cells, now):
+        conn = self._db()
+        found = {}
+        if conn is None or not cells:
+            return found
+        min_updated = now - self.ttl
+        for start in range(0, len(cells), _SQL_CHUNK):
+            chunk = cells[start:start + _SQL_CHUNK]
+            values = ','.join(['(?, ?)'] * len(chunk))
+            params = [self.resolution, min_updated] + [v for c in chunk for v in c]
+            rows = conn.execute(
+                f'SELECT cx, cy, height, updated FROM heights'
+                f' WHERE resolution = ? AND updated >= ? AND (cx, cy) IN (VALUES {values})',
+                params
+            )
+            for cx, cy, height, updated in rows:
+                found[(cx, cy)] = (height, updated)
+        return found
+
+    def _disk_put(self, items, now):
+        conn = self._db()
+        if conn is None or not items:
+            return
+        conn.executemany(
+            'INSERT OR REPLACE INTO heights (resolution, cx, cy, height, updated) VALUES (?, ?, ?, ?, ?)',
+            [(self.resolution, cx, cy, height, now) for (cx, cy), height in items]
+        )
+        self._puts_since_trim += len(items)
+        # Kiểm tra dung lượng định kỳ thay vì COUNT(*) mỗi lần ghi
+        if self._puts_since_trim >= max(1, self.disk_entries // 100):
+            self._puts_since_trim = 0
+            conn.execute('DELETE FROM heights WHERE updated < ?', (now - self.ttl,))
+            (total,) = conn.execute('SELECT COUNT(*) FROM heights').fetchone()
+            if total > self.disk_entries:
+                conn.execute(
+                    'DELETE FROM heights WHERE (resolution, cx, cy) IN ('
+                    ' SELECT resolution, cx, cy FROM heights ORDER BY updated LIMIT ?)',
+                    (total - self.disk_entries,)
+                )
+        conn.commit()
+
+    # ========== Memory LRU ==========
+
+    def _memory_put(self, key, height, updated):
+        self._memory[key] = (height, updated)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # ========== API ==========
+
+    def get_many(self, coordinates):
+        """
+        Args:
+            coordinates: List of (lon, lat)
+
+        Returns:
+            Dict {index: height} cho các điểm có trong cache
+        """
+        now = time.time()
+        result = {}
+        with self._lock:
+            pending = {}
+            for i, (lon, lat) in enumerate(coordinates):
+                key = self.cell(lon, lat)
+                entry = self._memory.get(key)
+                if entry is not None and now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    result[i] = entry[0]
+                    self.memory_hits += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            found = self._disk_get(list(pending), now)
+            for key, indices in pending.items():
+                entry = found.get(key)
+                if entry is None:
+                    self.misses += len(indices)
+                    continue
+                self._memory_put(key, *entry)
+                self.disk_hits += len(indices)
+                for i in indices:
+                    result[i] = entry[0]
+        return result
+
+    def get(self, lon, lat):
+        """Độ cao trong cache hoặc None"""
+        return self.get_many([(lon, lat)]).get(0)
+
+    def put_many(self, items):
+        """
+        Args:
+            items: List of ((lon, lat), height)
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            cells = {}
+            for (lon, lat), height in items:
+                cells[self.cell(lon, lat)] = float(height)
+            for key, height in cells.items():
+                self._memory_put(key, height, now)
+            self._disk_put(list(cells.items()), now)
+
+    def put(self, lon, lat, height):
+        self.put_many([((lon, lat), height)])
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute('DELETE FROM heights')
+                conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries = 0
+            conn = self._db()
+            if conn is not None:
+                (disk_entries,) = conn.execute('SELECT COUNT(*) FROM heights').fetchone()
+            return {
+                'resolution': self.resolution,
+                'ttl': self.ttl,
+                'db_path': self.db_path,
+                'memory_entries': len(self._memory),
+                'memory_max_entries': self.memory_entries,
+                'disk_entries': disk_entries,
+                'disk_max_entries': self.disk_entries,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+height_cache = TerrainHeightCache()
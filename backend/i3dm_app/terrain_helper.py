@@ -1,25 +1,329 @@
 
 import requests
 import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
 
-def query_terrain_height_batch(coordinates):
+from .dem import DemTileStore
+from .terrain_cache import height_cache
+
+
+# Terrain server local (1 điểm / GET)
+TERRAIN_API_URL = 'http://localhost:8006/api/height'
+TERRAIN_TIMEOUT = 1
+# Số request song song tối đa tới terrain server
+TERRAIN_MAX_WORKERS = 16
+# Circuit breaker: số lỗi liên tiếp thì ngắt, và thời gian ngắt trước khi thử lại (s)
+TERRAIN_FAILURE_THRESHOLD = 5
+TERRAIN_COOLDOWN = 30.0
+# Thư mục DEM local mặc định (settings.TERRAIN_DEM_DIR ghi đè)
+TERRAIN_DEM_DIR = 'dem'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho terrain server.
+    
+    - closed: gọi server bình thường
+    - open: sau failure_threshold lỗi liên tiếp, bỏ qua server (dùng fallback ngay)
+      trong cooldown giây
+    - half_open: hết cooldown, cho 1 request thử; thành công -> closed, lỗi -> open lại
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold=TERRAIN_FAILURE_THRESHOLD, cooldown=TERRAIN_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+    
+    def configure(self, failure_threshold=None, cooldown=None):
+        """Đổi ngưỡng / thời gian ngắt (apps.ready đọc từ settings)"""
+        with self._lock:
+            if failure_threshold is not None:
+                self.failure_threshold = failure_threshold
+            if cooldown is not None:
+                self.cooldown = cooldown
+    
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+    
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = self.HALF_OPEN
+        return self._state
+    
+    def allow_request(self):
+        """True nếu được phép gọi server, False = dùng fallback ngay"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.total_successes += 1
+            self.consecutive_failures = 0
+            self._probing = False
+            self._state = self.CLOSED
+    
+    def record_failure(self):
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            was_probing = self._probing
+            self._probing = False
+            if was_probing or (
+                self._state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.times_opened += 1
+    
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._probing = False
+            self.consecutive_failures = 0
+    
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            retry_in = 0.0
+            if state == self.OPEN:
+                retry_in = max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+            return {
+                'state': state,
+                'consecutive_failures': self.consecutive_failures,
+                'total_failures': self.total_failures,
+                'total_successes': self.total_successes,
+                'short_circuited': self.short_circuited,
+                'times_opened': self.times_opened,
+                'failure_threshold': self.failure_threshold,
+                'cooldown': self.cooldown,
+                'retry_in': round(retry_in, 3),
+            }
+
+
+class TerrainClient:
+    """
+    Client query độ cao từ terrain server.
+    
+    - Mỗi thread giữ 1 requests.Session (keep-alive) -> không mở connection mới mỗi điểm
+    - Batch chạy song song tối đa max_workers request
+    - Tọa độ trùng nhau chỉ query 1 lần
+    - Server lỗi liên tục -> circuit breaker mở, dùng fallback ngay không chờ timeout
+    """
+    
+    def __init__(self, url=TERRAIN_API_URL, timeout=TERRAIN_TIMEOUT, max_workers=TERRAIN_MAX_WORKERS,
+                 breaker=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.breaker = breaker or CircuitBreaker()
+        self._local = threading.local()
+    
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+    
+    def fetch(self, lon, lat):
+        """
+        Query 1 điểm từ terrain server.
+        
+        Returns:
+            Độ cao (m), hoặc None nếu server lỗi / không trả lời / đang bị ngắt
+        """
+        if not self.breaker.allow_request():
+            return None
+        try:
+            response = self._session().get(
+                self.url,
+                params={'lon': lon, 'lat': lat},
+                timeout=self.timeout
+            )
+            if response.ok:
+                data = response.json()
+                # Body sai dạng (list, số, null, height không phải số) tính là lỗi server
+                height = data.get('height', 0.0) if isinstance(data, dict) else None
+                if isinstance(height, (int, float)) and not isinstance(height, bool):
+                    self.breaker.record_success()
+                    return float(height)
+        except (requests.RequestException, ValueError):
+            pass
+        self.breaker.record_failure()
+        return None
+    
+    def query(self, lon, lat, cache=None):
+        """Độ cao 1 điểm, fallback estimate_height_vietnam khi server lỗi"""
+        if cache is not None:
+            height = cache.get(lon, lat)
+            if height is not None:
+                return height
+        height = self.fetch(lon, lat)
+        if height is None:
+            return estimate_height_vietnam(lon, lat)
+        if cache is not None:
+            cache.put(lon, lat, height)
+        return height
+    
+    def query_batch(self, coordinates, on_progress=None, cache=None):
+        """
+        Query nhiều điểm song song.
+        
+        Args:
+            coordinates: List of (lon, lat) tuples
+            on_progress: Callback (done, total) theo số điểm đã xong
+            cache: TerrainHeightCache (tùy chọn) - điểm đã có trong cache không query lại,
+                   độ cao lấy được từ server được ghi vào cache
+            
+        Returns:
+            List of heights theo đúng thứ tự coordinates
+        """
+        total = len(coordinates)
+        heights = [0.0] * total
+        done = 0
+        
+        cached = cache.get_many(coordinates) if cache is not None else {}
+        for i, height in cached.items():
+            heights[i] = height
+        done += len(cached)
+        if cached and on_progress:
+            on_progress(done, total)
+        
+        # Dedupe: mỗi tọa độ duy nhất query 1 lần
+        positions = {}
+        for i, (lon, lat) in enumerate(coordinates):
+            if i not in cached:
+                positions.setdefault((float(lon), float(lat)), []).append(i)
+        if not positions:
+            return heights
+        
+        fetched = []
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(positions))))
+        try:
+            futures = {executor.submit(self.fetch, *key): key for key in positions}
+            for future in as_completed(futures):
+                key = futures[future]
+                height = future.result()
+                if height is None:
+                    height = estimate_height_vietnam(*key)
+                else:
+                    fetched.append((key, height))
+                for i in positions[key]:
+                    heights[i] = height
+                done += len(positions[key])
+                if on_progress:
+                    on_progress(done, total)
+        finally:
+            # on_progress có thể raise (vd: job bị hủy) -> bỏ các request chưa chạy
+            executor.shutdown(wait=True, cancel_futures=True)
+            if cache is not None:
+                cache.put_many(fetched)
+        
+        return heights
+
+
+terrain_client = TerrainClient()
+
+
+_dem_stores = {}
+_dem_stores_lock = threading.Lock()
+
+
+def get_dem_store():
+    """
+    Kho DEM local (settings.TERRAIN_DEM_DIR), dùng chung trong process
+    """
+    try:
+        from django.conf import settings
+        root = getattr(settings, 'TERRAIN_DEM_DIR', TERRAIN_DEM_DIR)
+    except ImportError:
+        root = TERRAIN_DEM_DIR
+
+    with _dem_stores_lock:
+        store = _dem_stores.get(root)
+        if store is None:
+            store = DemTileStore(root)
+            _dem_stores[root] = store
+        return store
+
+
+def query_terrain_height_array(lon, lat, on_progress=None):
+    """
+    Query terrain height cho mảng tọa độ (vectorized)
+    
+    1. DEM local: nội suy bilinear trên tile memory-mapped, không có HTTP
+    2. Điểm DEM không phủ (hoặc void) -> height_cache -> terrain server / estimate_height_vietnam
+    
+    Args:
+        lon, lat: Mảng kinh độ / vĩ độ (°)
+        on_progress: Callback (done, total)
+        
+    Returns:
+        ndarray float64 cùng shape với lon
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    total = lon.size
+
+    heights = get_dem_store().sample(lon, lat)
+    missing = np.flatnonzero(np.isnan(heights))
+    covered = total - missing.size
+
+    if missing.size:
+        def missing_progress(done, _):
+            if on_progress:
+                on_progress(covered + done, total)
+
+        heights[missing] = terrain_client.query_batch(
+            list(zip(lon[missing].tolist(), lat[missing].tolist())),
+            on_progress=missing_progress, cache=height_cache
+        )
+    elif on_progress:
+        on_progress(total, total)
+
+    return heights
+
+
+def query_terrain_height_batch(coordinates, on_progress=None):
     """
     Query terrain height cho nhiều tọa độ cùng lúc
     
     Args:
         coordinates: List of (lon, lat) tuples
+        on_progress: Callback (done, total), gọi định kỳ trong lúc query
         
     Returns:
         List of heights tương ứng
     """
-    heights = []
-    
-    for lon, lat in coordinates:
-        height = query_single_terrain_height(lon, lat)
-        heights.append(height)
-    
-    return heights
+    if not coordinates:
+        return []
+    coords = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    return query_terrain_height_array(coords[:, 0], coords[:, 1], on_progress=on_progress).tolist()
 
 
 def query_single_terrain_height(lon, lat):
@@ -27,26 +331,15 @@ def query_single_terrain_height(lon, lat):
     Query terrain height cho 1 điểm
     
     Thử nhiều phương pháp theo thứ tự:
-    1. Query từ local terrain server (nếu có)
-    2. Estimate từ region
-    3. Return 0 (fallback)
+    1. DEM local (nếu đã ingest)
+    2. Cache độ cao (memory / SQLite)
+    3. Query từ local terrain server (nếu có)
+    4. Estimate từ region
     """
-    
-    # METHOD 1: Query từ terrain server local (nếu server hỗ trợ)
-    try:
-        response = requests.get(
-            'http://localhost:8006/api/height',
-            params={'lon': lon, 'lat': lat},
-            timeout=1
-        )
-        if response.ok:
-            data = response.json()
-            return data.get('height', 0.0)
-    except:
-        pass
-    
-    # METHOD 2: Estimate từ region (Việt Nam)
-    return estimate_height_vietnam(lon, lat)
+    height = get_dem_store().sample([lon], [lat])[0]
+    if not np.isnan(height):
+        return float(height)
+    return terrain_client.query(lon, lat, cache=height_cache)
 
 
 def estimate_height_vietnam(lon, lat):
@@ -78,7 +371,10 @@ def estimate_height_vietnam(lon, lat):
 
 def get_terrain_samples_for_bbox(min_lon, max_lon, min_lat, max_lat, sample_count=20):
     """
-    Lấy sample terrain heights trong bbox để tính min/max cho tileset
+    Lấy min/max terrain height trong bbox cho tileset
+    
+    - DEM local phủ kín bbox: min/max chính xác từ pyramid min/max, không sample
+    - Không thì sample ngẫu nhiên sample_count điểm (gộp với phần DEM phủ được)
     
     Args:
         min_lon, max_lon, min_lat, max_lat: Bbox coordinates
@@ -89,13 +385,17 @@ def get_terrain_samples_for_bbox(min_lon, max_lon, min_lat, max_lat, sample_coun
     """
     import random
     
-    sample_heights = []
+    dem_min, dem_max, covered = get_dem_store().elevation_range(min_lon, max_lon, min_lat, max_lat)
+    if covered:
+        return dem_min, dem_max
     
-    for _ in range(sample_count):
-        lon = random.uniform(min_lon, max_lon)
-        lat = random.uniform(min_lat, max_lat)
-        height = query_single_terrain_height(lon, lat)
-        sample_heights.append(height)
+    coordinates = [
+        (random.uniform(min_lon, max_lon), random.uniform(min_lat, max_lat))
+        for _ in range(sample_count)
+    ]
+    sample_heights = query_terrain_height_batch(coordinates)
+    if dem_min is not None:
+        sample_heights += [dem_min, dem_max]
     
     if sample_heights:
         return min(sample_heights), max(sample_heights)
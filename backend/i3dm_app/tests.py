@@ -1,3 +1,1945 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.apps import apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+
+import numpy as np
+import requests
+from glb_app.models import GlbModel
+from QLModel.models import LoaiMoHinh
+
+from .blob_store import (
+    HashingUploadHandler,
+    acquire_blob,
+    blob_relative_path,
+    cleanup_tmp_files,
+    is_blob_path,
+    place_blob,
+    release_blob,
+    store_upload,
+)
+from .chunked_upload import UploadError, UploadSessionStore
+from .dem import HGT_NODATA, DemTileStore
+from .generation import GenerationCancelled, get_or_generate_tileset
+from .jobs import JOB_RUNNERS, claim_next_job, requeue_stale_jobs, run_job
+from .models import I3DMJob, I3DMTileset, ModelBlob
+from .file_serving import content_addressed_token, etag_cache
+from .i3dm_generator import GlbCache, I3DMGenerator
+from .i3dm_writer import write_atomic
+from .point_columns import (
+    POINT_COLUMNS,
+    BodyTooLargeError,
+    PointColumnBuilder,
+    columns_from_binary,
+    columns_from_instances,
+    read_json_points,
+)
+from .placement import (
+    METERS_PER_DEGREE,
+    cull_elevation_filter,
+    parse_constraints,
+    poisson_disk,
+    sample_positions,
+)
+from .polygon import PolygonIndex, parse_geojson_polygon
+from .polyline import parse_geojson_lines, place_along_lines, segment_vectors
+from .precompress import choose_variant, parse_accept_encoding, write_precompressed
+from .quantized_mesh import TerrainTileCache, terrain_tile_cache, tile_bounds
+from .singleflight import SingleFlight
+from .terrain_cache import TerrainHeightCache
+from .terrain_helper import (
+    CircuitBreaker, TerrainClient, get_terrain_samples_for_bbox, query_terrain_height_batch, terrain_client
+)
+
+
+def make_glb(directory, payload=b"glTF-test-payload"):
+    """Tạo file GLB giả (generator chỉ copy nguyên bytes)"""
+    glb_path = Path(directory) / "model.glb"
+    glb_path.write_bytes(payload)
+    return glb_path
+
+
+def read_feature_table(i3dm_path):
+    """Đọc header + feature table JSON của file .i3dm"""
+    data = Path(i3dm_path).read_bytes()
+    magic, version, byte_length, ft_json_len, ft_bin_len, _, _, gltf_format = struct.unpack_from("<4sIIIIIII", data)
+    assert magic == b"i3dm" and byte_length == len(data)
+    ft_json = json.loads(data[32:32 + ft_json_len])
+    ft_bin = data[32 + ft_json_len:32 + ft_json_len + ft_bin_len]
+    return ft_json, ft_bin, gltf_format
+
+
+def random_instances(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "lon": rng.uniform(102.0, 109.5),
+            "lat": rng.uniform(8.5, 23.4),
+            "height": rng.uniform(-5.0, 1500.0),
+            "scale": rng.uniform(0.5, 2.0),
+            "heading": rng.uniform(0.0, 360.0),
+        }
+        for _ in range(count)
+    ]
+
+
+class VectorizedGeneratorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        self.generator = I3DMGenerator(make_glb(self.out), debug=False)
+
+    def assert_parity(self, instances):
+        scalar = self.generator.generate_i3dm(instances, self.out / "scalar.i3dm", vectorized=False)
+        vector = self.generator.generate_i3dm(instances, self.out / "vector.i3dm")
+        self.assertEqual(scalar.read_bytes(), vector.read_bytes())
+
+    def test_vectorized_matches_scalar(self):
+        self.assert_parity(random_instances(2000))
+
+    def test_vectorized_matches_scalar_with_defaults(self):
+        # Thiếu height / scale / heading, lon-lat kiểu int
+        self.assert_parity([{"lon": 105, "lat": 21}, {"lon": 105.001, "lat": 21.002}])
+
+
+def oct_decode(encoded):
+    """Giải mã OCT32P như CesiumJS (octDecodeInRange, rangeMax = 65535)"""
+    p = encoded.astype(np.float64) / 65535 * 2.0 - 1.0
+    z = 1.0 - np.abs(p).sum(axis=1)
+    xy = np.where(z[:, None] < 0.0, (1.0 - np.abs(p[:, ::-1])) * np.where(p >= 0.0, 1.0, -1.0), p)
+    v = np.column_stack((xy, z))
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+class CompactEncodingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        glb_path = make_glb(self.out)
+        self.float_gen = I3DMGenerator(glb_path, debug=False)
+        self.compact_gen = I3DMGenerator(glb_path, debug=False, compact=True)
+
+    def decode(self, path):
+        ft_json, ft_bin, _ = read_feature_table(path)
+        count = ft_json["INSTANCES_LENGTH"]
+
+        def view(name, dtype, width):
+            if name not in ft_json:
+                return None
+            start = ft_json[name]["byteOffset"]
+            size = np.dtype(dtype).itemsize * width * count
+            return np.frombuffer(ft_bin[start:start + size], dtype=dtype).reshape(count, width)
+
+        if "POSITION" in ft_json:
+            positions = view("POSITION", "<f4", 3).astype(np.float64)
+            ups = view("NORMAL_UP", "<f4", 3).astype(np.float64)
+            rights = view("NORMAL_RIGHT", "<f4", 3).astype(np.float64)
+        else:
+            q = view("POSITION_QUANTIZED", "<u2", 3).astype(np.float64)
+            positions = (q / 65535 * np.array(ft_json["QUANTIZED_VOLUME_SCALE"])
+                         + np.array(ft_json["QUANTIZED_VOLUME_OFFSET"]))
+            ups = oct_decode(view("NORMAL_UP_OCT32P", "<u2", 2))
+            rights = oct_decode(view("NORMAL_RIGHT_OCT32P", "<u2", 2))
+        scale = view("SCALE", "<f4", 1)
+        positions += np.array(ft_json["RTC_CENTER"])
+        return positions, ups, rights, scale, len(ft_bin)
+
+    def test_compact_decodes_close_to_float(self):
+        instances = [dict(i, lon=105.8 + i["lon"] / 1e3, lat=21.0 + i["lat"] / 1e3)
+                     for i in random_instances(500, seed=2)]
+        self.float_gen.generate_i3dm(instances, self.out / "float.i3dm")
+        self.compact_gen.generate_i3dm(instances, self.out / "compact.i3dm")
+
+        f_pos, f_up, f_right, f_scale, f_size = self.decode(self.out / "float.i3dm")
+        c_pos, c_up, c_right, c_scale, c_size = self.decode(self.out / "compact.i3dm")
+
+        extent = np.ptp(f_pos, axis=0).max()
+        self.assertLess(np.abs(c_pos - f_pos).max(), extent / 65535 * 2)
+        self.assertLess(np.abs(c_up - f_up).max(), 1e-3)
+        self.assertLess(np.abs(c_right - f_right).max(), 1e-3)
+        np.testing.assert_array_equal(c_scale, f_scale)
+        self.assertLess(c_size, f_size / 2)
+
+    def test_uniform_unit_scale_is_omitted(self):
+        instances = [dict(i, scale=1.0) for i in random_instances(10)]
+        self.compact_gen.generate_i3dm(instances, self.out / "compact.i3dm")
+        ft_json, ft_bin, _ = read_feature_table(self.out / "compact.i3dm")
+        self.assertNotIn("SCALE", ft_json)
+        # 10 instances * (6 + 4 + 4) bytes = 140, pad tới 144
+        self.assertEqual(len(ft_bin), 144)
+
+
+class ExternalGlbTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        self.shared_dir = self.out / "glb_shared"
+        self.generator = I3DMGenerator(make_glb(self.out), debug=False, external_glb_dir=self.shared_dir)
+
+    def test_quadtree_tiles_share_one_glb(self):
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(3000))
+        result = self.generator.generate_tileset(
+            lon, lat, height, self.out / "i3dm", "ext", max_instances_per_tile=500
+        )
+        self.assertEqual(len(list(self.shared_dir.glob("*.glb"))), 1)
+
+        tiles = list((self.out / "i3dm" / "instances_ext").glob("*.i3dm"))
+        self.assertEqual(len(tiles), result["tile_count"])
+        for tile in tiles:
+            data = tile.read_bytes()
+            ft_json, ft_bin, gltf_format = read_feature_table(tile)
+            self.assertEqual(gltf_format, 0)
+            self.assertEqual(ft_json["GLTF_FORMAT"], 0)
+            uri = data[32 + struct.unpack_from("<I", data, 12)[0] + len(ft_bin):].decode().rstrip()
+            self.assertEqual((tile.parent / uri).resolve().read_bytes(), b"glTF-test-payload")
+
+
+class GlbCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+
+    def test_hit_miss_and_invalidation(self):
+        cache = GlbCache(max_bytes=1024)
+        glb_path = make_glb(self.out, b"a" * 100)
+        self.assertEqual(bytes(cache.get(glb_path)), b"a" * 100)
+        self.assertEqual(bytes(cache.get(glb_path)), b"a" * 100)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Ghi đè file (size khác) -> key mới, version cũ bị loại
+        glb_path.write_bytes(b"b" * 200)
+        self.assertEqual(bytes(cache.get(glb_path)), b"b" * 200)
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.current_bytes, 200)
+
+    def test_byte_budget_evicts_lru(self):
+        cache = GlbCache(max_bytes=250)
+        paths = []
+        for name in ("a", "b", "c"):
+            path = self.out / f"{name}.glb"
+            path.write_bytes(name.encode() * 100)
+            paths.append(path)
+            cache.get(path)
+        self.assertLessEqual(cache.current_bytes, 250)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(paths[0])
+        self.assertEqual(cache.misses, 4)
+
+
+class GenerationKeyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.glb_path = make_glb(self.tmp.name)
+
+    def test_key_depends_on_instances_and_options(self):
+        columns = I3DMGenerator.instances_to_arrays(random_instances(100))
+        plain = I3DMGenerator(self.glb_path, debug=False)
+        compact = I3DMGenerator(self.glb_path, debug=False, compact=True)
+
+        key = plain.generation_key(*columns)
+        self.assertEqual(key, I3DMGenerator(self.glb_path, debug=False).generation_key(*columns))
+        self.assertNotEqual(key, compact.generation_key(*columns))
+
+        moved = list(columns)
+        moved[2] = moved[2] + 0.5
+        self.assertNotEqual(key, plain.generation_key(*moved))
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.2)
+            return "result"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.do("key", work)))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+        self.assertTrue(all(result == "result" for result, _ in results))
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class QuadtreeTilesetTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        self.generator = I3DMGenerator(make_glb(self.out), debug=False)
+
+    def walk(self, tile, parent=None):
+        region = tile["boundingVolume"]["region"]
+        if parent is not None:
+            p_region = parent["boundingVolume"]["region"]
+            self.assertLessEqual(p_region[0], region[0])
+            self.assertLessEqual(p_region[1], region[1])
+            self.assertGreaterEqual(p_region[2], region[2])
+            self.assertGreaterEqual(p_region[3], region[3])
+            self.assertLess(tile["geometricError"], parent["geometricError"])
+        ft_json, _, _ = read_feature_table(self.out / tile["content"]["uri"])
+        total = ft_json["INSTANCES_LENGTH"]
+        for child in tile.get("children", []):
+            total += self.walk(child, tile)
+        return total
+
+    def test_small_set_is_single_tile(self):
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(50))
+        result = self.generator.generate_tileset(lon, lat, height, self.out, "small")
+        self.assertEqual(result["tile_count"], 1)
+        self.assertEqual(result["i3dm_file"], "instances_small.i3dm")
+
+    def test_progress_callback_can_stop_between_tiles(self):
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(5000, seed=2))
+        calls = []
+
+        def on_progress(done, total):
+            calls.append((done, total))
+            if len(calls) == 3:
+                raise GenerationCancelled("stop")
+
+        with self.assertRaises(GenerationCancelled):
+            self.generator.generate_tileset(lon, lat, height, self.out, "stop",
+                                            max_instances_per_tile=500, on_progress=on_progress)
+        self.assertEqual(len(list((self.out / "instances_stop").iterdir())), 3)
+        self.assertFalse((self.out / "tileset_stop.json").exists())
+        self.assertTrue(all(total == 5000 for _, total in calls))
+        self.assertEqual([done for done, _ in calls], sorted(done for done, _ in calls))
+
+    def test_large_set_splits_into_quadtree(self):
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(20000, seed=1))
+        result = self.generator.generate_tileset(
+            lon, lat, height, self.out, "big", heading=heading, scale=scale, max_instances_per_tile=1000
+        )
+        self.assertGreater(result["tile_count"], 1)
+
+        tileset = json.loads((self.out / result["tileset_file"]).read_text())
+        root = tileset["root"]
+        self.assertEqual(root["content"]["uri"], result["i3dm_file"])
+        self.assertGreater(root["geometricError"], 0)
+        self.assertEqual(self.walk(root), 20000)
+
+
+class FakeHeightServer:
+    """Terrain server giả: height = lon + lat, trả lời chậm `delay` giây (hoặc luôn trả bytes `body` nếu có)"""
+
+    def __init__(self, delay=0.02, body=None):
+        self.requests = 0
+        self.body = body
+        self.lock = threading.Lock()
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with outer.lock:
+                    outer.requests += 1
+                query = parse_qs(urlparse(self.path).query)
+                body = outer.body
+                if body is None:
+                    body = json.dumps({"height": float(query["lon"][0]) + float(query["lat"][0])}).encode()
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/height"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TerrainClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = FakeHeightServer()
+        self.addCleanup(self.server.close)
+
+    def test_batch_dedupes_and_keeps_order(self):
+        client = TerrainClient(url=self.server.url, max_workers=4)
+        coordinates = [(105.0, 21.0), (105.5, 21.5), (105.0, 21.0), (106.0, 20.0)] * 5
+        progress = []
+
+        heights = client.query_batch(coordinates, on_progress=lambda done, total: progress.append(done))
+
+        self.assertEqual(heights, [lon + lat for lon, lat in coordinates])
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(progress[-1], len(coordinates))
+
+    def test_throughput_scales_with_concurrency(self):
+        coordinates = [(105.0 + i * 1e-4, 21.0) for i in range(40)]
+
+        start = time.monotonic()
+        TerrainClient(url=self.server.url, max_workers=1).query_batch(coordinates)
+        serial = time.monotonic() - start
+
+        start = time.monotonic()
+        TerrainClient(url=self.server.url, max_workers=10).query_batch(coordinates)
+        parallel = time.monotonic() - start
+
+        self.assertLess(parallel, serial / 3)
+
+    def test_server_down_falls_back_to_estimate(self):
+        client = TerrainClient(url="http://127.0.0.1:9/api/height", timeout=0.2)
+        self.assertEqual(client.query_batch([(108.0, 12.0)]), [800.0])
+
+    def test_malformed_body_counts_as_failure_and_falls_back(self):
+        for body in (b"[1, 2]", b"42", b"null", b'{"height": "cao"}', b'{"height": null}'):
+            with self.subTest(body=body):
+                self.server.body = body
+                client = TerrainClient(url=self.server.url)
+
+                self.assertIsNone(client.fetch(108.0, 12.0))
+                self.assertEqual(client.breaker.consecutive_failures, 1)
+                self.assertEqual(client.query_batch([(108.0, 12.0)]), [800.0])
+
+
+class TerrainHeightCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = str(Path(tmp.name) / "heights.sqlite3")
+
+    def make_cache(self, **kwargs):
+        cache = TerrainHeightCache(db_path=self.db_path, resolution=1e-4, **kwargs)
+        self.addCleanup(cache.configure)
+        return cache
+
+    def test_memory_then_disk_tier(self):
+        cache = self.make_cache(memory_entries=2)
+        cache.put_many([((105.0, 21.0), 1.0), ((105.1, 21.0), 2.0), ((105.2, 21.0), 3.0)])
+
+        # Cùng ô lưới (lệch < resolution/2) -> hit
+        self.assertEqual(cache.get(105.00001, 21.0), 1.0)  # bị đẩy khỏi LRU -> đọc từ SQLite
+        self.assertEqual(cache.get(105.2, 21.0), 3.0)
+        self.assertIsNone(cache.get(106.0, 21.0))
+
+        stats = cache.stats()
+        self.assertEqual((stats['memory_hits'], stats['disk_hits'], stats['misses']), (1, 1, 1))
+        self.assertEqual(stats['disk_entries'], 3)
+        self.assertLessEqual(stats['memory_entries'], 2)
+
+        # Process khác dùng chung file SQLite
+        self.assertEqual(self.make_cache().get(105.1, 21.0), 2.0)
+
+    def test_ttl_and_disk_limit(self):
+        cache = self.make_cache(ttl=0.05)
+        cache.put(105.0, 21.0, 1.0)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(105.0, 21.0))
+
+        cache = self.make_cache(disk_entries=100)
+        cache.put_many([((105.0 + i * 1e-3, 21.0), float(i)) for i in range(250)])
+        self.assertLessEqual(cache.stats()['disk_entries'], 100)
+
+    def test_warm_batch_needs_no_requests(self):
+        server = FakeHeightServer()
+        self.addCleanup(server.close)
+        client = TerrainClient(url=server.url, max_workers=4)
+        cache = self.make_cache()
+        coordinates = [(105.0 + i * 1e-3, 21.0) for i in range(20)]
+
+        cold = client.query_batch(coordinates, cache=cache)
+        requests_after_cold = server.requests
+        warm = client.query_batch(coordinates, cache=cache)
+
+        self.assertEqual(cold, warm)
+        self.assertEqual(requests_after_cold, 20)
+        self.assertEqual(server.requests, 20)
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_configured_from_settings(self):
+        app = apps.get_app_config("i3dm_app")
+        self.addCleanup(app.ready)
+        with override_settings(TERRAIN_FAILURE_THRESHOLD=2, TERRAIN_COOLDOWN=7.5):
+            app.ready()
+        breaker = terrain_client.breaker
+        self.assertEqual((breaker.failure_threshold, breaker.cooldown), (2, 7.5))
+        breaker.configure(cooldown=1.0)
+        self.assertEqual((breaker.failure_threshold, breaker.cooldown), (2, 1.0))
+
+    def test_opens_after_threshold_and_probes_after_cooldown(self):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=0.1)
+        for _ in range(3):
+            self.assertTrue(breaker.allow_request())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        time.sleep(0.15)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        # Chỉ 1 request thử trong lúc half-open
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.allow_request()
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.stats()["times_opened"], 2)
+
+    def test_outage_skips_server_after_threshold(self):
+        calls = []
+
+        class DownClient(TerrainClient):
+            def _session(self):
+                calls.append(1)
+                raise requests.ConnectionError("down")
+
+        client = DownClient(breaker=CircuitBreaker(failure_threshold=2, cooldown=60), max_workers=1)
+        heights = client.query_batch([(108.0, 12.0 + i * 0.01) for i in range(50)])
+
+        self.assertEqual(heights, [800.0] * 50)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(client.breaker.stats()["short_circuited"], 48)
+
+
+def write_hgt(directory, name, size, func):
+    """File .hgt giả: độ cao = func(lon, lat) tại từng điểm lưới (int16 big-endian)"""
+    ns, lat0, ew, lon0 = name[0], int(name[1:3]), name[3], int(name[4:7])
+    south = lat0 if ns == 'N' else -lat0
+    west = lon0 if ew == 'E' else -lon0
+    lat = south + 1 - np.arange(size) / (size - 1)
+    lon = west + np.arange(size) / (size - 1)
+    grid = func(lon[None, :], lat[:, None]).astype('>i2')
+    path = Path(directory) / f"{name}.hgt"
+    grid.tofile(path)
+    return path
+
+
+def plane(lon, lat):
+    return np.rint((lon - 105) * 1000 + (lat - 21) * 500)
+
+
+class DemTileStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.store = DemTileStore(self.tmp / "dem")
+
+    def test_hgt_bilinear_matches_plane(self):
+        # Mặt phẳng nguyên tại điểm lưới -> bilinear phải tái tạo chính xác
+        self.store.ingest_hgt(write_hgt(self.tmp, "N21E105", 101, plane))
+        rng = np.random.default_rng(1)
+        lon = rng.uniform(105, 106, 10000)
+        lat = rng.uniform(21, 22, 10000)
+
+        heights = self.store.sample(lon, lat)
+
+        np.testing.assert_allclose(heights, (lon - 105) * 1000 + (lat - 21) * 500, atol=1e-6)
+
+    def test_uncovered_and_void_are_nan(self):
+        def with_void(lon, lat):
+            grid = plane(lon, lat)
+            grid[0, 0] = HGT_NODATA  # góc Tây Bắc
+            return grid
+
+        self.store.ingest_hgt(write_hgt(self.tmp, "N21E105", 11, with_void))
+
+        heights = self.store.sample([105.01, 105.5, 107.0], [21.99, 21.5, 21.5])
+
+        self.assertTrue(np.isnan(heights[0]))
+        self.assertAlmostEqual(heights[1], 750.0)
+        self.assertTrue(np.isnan(heights[2]))
+
+    def test_raw_grid_and_reload_from_other_store(self):
+        grid = np.array([[10, 20], [30, 40]], dtype='>f4')
+        raw = self.tmp / "patch.bin"
+        grid.tofile(raw)
+        DemTileStore(self.tmp / "dem").ingest_raw(raw, 105.0, 21.0, 105.1, 21.1, 2, 2, dtype='>f4')
+
+        # Store khác (process khác) đọc lại index.json
+        self.assertAlmostEqual(self.store.sample([105.05], [21.05])[0], 25.0)
+
+    def test_query_batch_uses_dem(self):
+        self.store.ingest_hgt(write_hgt(self.tmp, "N21E105", 101, plane))
+        coordinates = [(105.25, 21.5), (105.75, 21.25)]
+
+        with override_settings(TERRAIN_DEM_DIR=str(self.tmp / "dem")):
+            heights = query_terrain_height_batch(coordinates)
+
+        self.assertEqual(heights, [500.0, 875.0])
+
+
+class ElevationPyramidTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dem_dir = Path(tmp.name) / "dem"
+        rng = np.random.default_rng(3)
+        self.grid = rng.integers(-50, 3000, (401, 401)).astype(np.int16)
+        self.grid[rng.random(self.grid.shape) < 0.01] = HGT_NODATA
+        self.tile = DemTileStore(self.dem_dir).add_tile(
+            "N21E105", self.grid, 105, 21, 106, 22, nodata=HGT_NODATA
+        )
+
+    def brute_force(self, min_lon, max_lon, min_lat, max_lat):
+        x0, x1 = (min_lon - 105) * 400, (max_lon - 105) * 400
+        y0, y1 = (22 - max_lat) * 400, (22 - min_lat) * 400
+        c0, c1 = int(np.floor(x0)), max(int(np.ceil(x1)) - 1, int(np.floor(x0)))
+        r0, r1 = int(np.floor(y0)), max(int(np.ceil(y1)) - 1, int(np.floor(y0)))
+        block = self.grid[r0:r1 + 2, c0:c1 + 2].astype(float)
+        block[block == HGT_NODATA] = np.nan
+        return np.nanmin(block), np.nanmax(block)
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(4)
+        for _ in range(50):
+            lon = np.sort(rng.uniform(105, 106, 2))
+            lat = np.sort(rng.uniform(21, 22, 2))
+            bbox = (lon[0], lon[1], lat[0], lat[1])
+            self.assertEqual(self.tile.elevation_range(*bbox), self.brute_force(*bbox))
+
+        # Cả tile: chỉ cần node gốc
+        self.assertEqual(self.tile.elevation_range(105, 106, 21, 22), self.brute_force(105, 106, 21, 22))
+        self.assertEqual(self.tile.pyramid.last_visited, 1)
+
+    def test_bbox_bounds_without_sampling(self):
+        with override_settings(TERRAIN_DEM_DIR=str(self.dem_dir)):
+            bounds = get_terrain_samples_for_bbox(105.1, 105.4, 21.2, 21.3)
+
+        self.assertEqual(bounds, self.brute_force(105.1, 105.4, 21.2, 21.3))
+
+    def test_elevation_filter_culled_by_pyramid(self):
+        store = DemTileStore(self.dem_dir)
+        bbox = {"min_lon": 105.1, "max_lon": 105.4, "min_lat": 21.2, "max_lat": 21.3}
+        low, high = self.brute_force(105.1, 105.4, 21.2, 21.3)
+
+        # Cả bbox trong dải -> bỏ bộ lọc độ cao (giữ bộ lọc khác)
+        constraints = {"min_elevation": low - 1, "max_elevation": high + 1, "max_slope": 30}
+        self.assertEqual(cull_elevation_filter(bbox, constraints, store.elevation_range), {"max_slope": 30})
+        self.assertIsNone(cull_elevation_filter(bbox, {"min_elevation": low}, store.elevation_range))
+
+        # Cả bbox ngoài dải -> lỗi ngay, không sample
+        with self.assertRaises(ValueError):
+            cull_elevation_filter(bbox, {"min_elevation": high + 1}, store.elevation_range)
+
+        # Giao một phần, hoặc DEM không phủ kín bbox -> giữ nguyên bộ lọc
+        partial = {"min_elevation": (low + high) / 2}
+        self.assertIs(cull_elevation_filter(bbox, partial, store.elevation_range), partial)
+        uncovered = dict(bbox, max_lon=106.5)
+        self.assertEqual(cull_elevation_filter(uncovered, {"min_elevation": 1e6}, store.elevation_range),
+                         {"min_elevation": 1e6})
+
+
+class TerrainHeightsViewTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        DemTileStore(Path(tmp.name) / "dem").ingest_hgt(write_hgt(tmp.name, "N21E105", 101, plane))
+        override = override_settings(TERRAIN_DEM_DIR=str(Path(tmp.name) / "dem"))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = "/api/i3dm/terrain/heights/"
+
+    def test_json_coordinates_and_columns(self):
+        response = self.client.post(
+            self.url, {"coordinates": [[105.25, 21.5], [105.75, 21.25]]}, content_type="application/json"
+        )
+        self.assertEqual(response.json()["heights"], [500.0, 875.0])
+
+        response = self.client.post(
+            self.url, {"lon": [105.25, 105.75], "lat": [21.5, 21.25]}, content_type="application/json"
+        )
+        self.assertEqual(response.json()["heights"], [500.0, 875.0])
+
+    def test_packed_float64(self):
+        rng = np.random.default_rng(5)
+        coords = np.column_stack([rng.uniform(105, 106, 5000), rng.uniform(21, 22, 5000)])
+
+        response = self.client.post(self.url, coords.astype("<f8").tobytes(),
+                                    content_type="application/octet-stream")
+
+        heights = np.frombuffer(response.content, dtype="<f8")
+        np.testing.assert_allclose(heights, (coords[:, 0] - 105) * 1000 + (coords[:, 1] - 21) * 500, atol=1e-6)
+
+    def test_single_point_and_errors(self):
+        self.assertEqual(self.client.get(self.url, {"lon": 105.25, "lat": 21.5}).json(), {"height": 500.0})
+        response = self.client.post(self.url, b"\x00" * 20, content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {"lon": [1, 2], "lat": [1]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        for body in (b"[1, 2]", b"42", b"null"):
+            response = self.client.post(self.url, body, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.json()["success"])
+
+
+def decode_quantized_mesh(data):
+    """Giải mã quantized-mesh (header, u/v/height, tam giác, cạnh) để kiểm tra"""
+    min_h, max_h = struct.unpack_from("<2f", data, 24)
+    (count,) = struct.unpack_from("<I", data, 88)
+    offset = 92
+
+    def zigzag_array():
+        nonlocal offset
+        zz = np.frombuffer(data, dtype="<u2", count=count, offset=offset).astype(np.int64)
+        offset += 2 * count
+        return np.cumsum((zz >> 1) ^ -(zz & 1))
+
+    u, v, q = zigzag_array(), zigzag_array(), zigzag_array()
+    offset += offset % 2
+    (triangles,) = struct.unpack_from("<I", data, offset)
+    encoded = np.frombuffer(data, dtype="<u2", count=triangles * 3, offset=offset + 4)
+    offset += 4 + 6 * triangles
+
+    indices, highest = [], 0
+    for code in encoded.tolist():
+        indices.append(highest - code)
+        if code == 0:
+            highest += 1
+
+    edges = []
+    for _ in range(4):
+        (n,) = struct.unpack_from("<I", data, offset)
+        edges.append(np.frombuffer(data, dtype="<u2", count=n, offset=offset + 4))
+        offset += 4 + 2 * n
+
+    height = min_h + q / 32767 * (max_h - min_h)
+    return u, v, height, np.array(indices).reshape(-1, 3), edges, offset
+
+
+class QuantizedMeshTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        DemTileStore(self.tmp / "dem").ingest_hgt(write_hgt(self.tmp, "N21E105", 101, plane))
+        override = override_settings(TERRAIN_DEM_DIR=str(self.tmp / "dem"))
+        override.enable()
+        self.addCleanup(override.disable)
+        terrain_tile_cache.configure(root=self.tmp / "tiles")
+        self.addCleanup(terrain_tile_cache.configure)
+
+    def test_tile_matches_dem(self):
+        # Level 9: tile 0.3515625° nằm trọn trong N21E105
+        z, x, y = 9, 811, 316
+        west, south, east, north = tile_bounds(z, x, y)
+        self.assertTrue(105 <= west and east <= 106 and 21 <= south and north <= 22)
+
+        response = self.client.get(f"/api/i3dm/terrain/tiles/{z}/{x}/{y}.terrain", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = gzip.decompress(response.content)
+        u, v, height, triangles, edges, end = decode_quantized_mesh(data)
+
+        self.assertEqual(end, len(data))
+        self.assertEqual(len(u), 65 * 65)
+        self.assertEqual(len(triangles), 64 * 64 * 2)
+        self.assertEqual([len(e) for e in edges], [65] * 4)
+        self.assertTrue(np.all(u[edges[0]] == 0) and np.all(v[edges[3]] == 32767))
+
+        lon = west + u / 32767 * (east - west)
+        lat = south + v / 32767 * (north - south)
+        expected = (lon - 105) * 1000 + (lat - 21) * 500
+        np.testing.assert_allclose(height, expected, atol=0.05)
+
+        # Tam giác ngược chiều kim đồng hồ, không suy biến
+        a, b, c = (np.column_stack([u, v])[triangles[:, k]] for k in range(3))
+        cross = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+        self.assertTrue(np.all(cross > 0))
+
+        # Lần 2 lấy từ cache, không gzip -> bản giải nén
+        plain = self.client.get(f"/api/i3dm/terrain/tiles/{z}/{x}/{y}.terrain")
+        self.assertEqual(plain.content, data)
+        self.assertEqual(terrain_tile_cache.stats()["hits"], 1)
+
+        # Accept-Encoding theo q-value: gzip;q=0 là từ chối, '*' bao gồm gzip
+        for header, encoded in (("gzip;q=0", False), ("br, gzip;q=0", False), ("identity", False),
+                                ("x-gzip-not", False), ("*", True), ("br;q=1, gzip;q=0.5", True)):
+            response = self.client.get(f"/api/i3dm/terrain/tiles/{z}/{x}/{y}.terrain", HTTP_ACCEPT_ENCODING=header)
+            self.assertEqual(response.get("Content-Encoding") == "gzip", encoded, header)
+            self.assertEqual(gzip.decompress(response.content) if encoded else response.content, data)
+
+    def test_layer_json_and_missing_tile(self):
+        layer = self.client.get("/api/i3dm/terrain/tiles/layer.json").json()
+        self.assertEqual(layer["format"], "quantized-mesh-1.0")
+        self.assertEqual(layer["available"][1], [{"startX": 0, "startY": 0, "endX": 3, "endY": 1}])
+        self.assertEqual(self.client.get("/api/i3dm/terrain/tiles/0/2/0.terrain").status_code, 404)
+
+    def test_cache_eviction(self):
+        cache = TerrainTileCache(self.tmp / "small", max_bytes=1000)
+        for y in range(10):
+            cache.put("v1", 3, 1, y, b"x" * 300)
+            time.sleep(0.01)
+
+        self.assertLessEqual(cache.stats()["bytes"], 1000)
+        self.assertIsNotNone(cache.get("v1", 3, 1, 9))
+        self.assertIsNone(cache.get("v1", 3, 1, 0))
+
+
+def terraced(lon, lat):
+    """Nửa Đông là vách dốc (~25°), nửa Tây: Nam là nước (0m), Bắc là bãi bằng 100m"""
+    return np.where(lon >= 105.5, (lon - 105.5) * 50000, np.where(lat >= 21.5, 100, 0))
+
+
+class PlacementConstraintTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = DemTileStore(Path(tmp.name) / "dem")
+        self.store.ingest_hgt(write_hgt(tmp.name, "N21E105", 201, terraced))
+        self.bbox = {"min_lon": 105.0, "max_lon": 106.0, "min_lat": 21.0, "max_lat": 22.0}
+
+    def sample(self, count, constraints, seed=0):
+        return sample_positions(
+            self.bbox, count, np.random.default_rng(seed), constraints=parse_constraints(constraints),
+            height_fn=self.store.sample, dem_sample=self.store.sample
+        )
+
+    def test_all_positions_satisfy_constraints(self):
+        lon, lat, heights = self.sample(20000, {
+            "max_slope": 10,
+            "min_elevation": 50,
+            "exclude": [{"min_lon": 105.0, "max_lon": 105.2, "min_lat": 21.5, "max_lat": 22.0}],
+        })
+
+        self.assertEqual(len(lon), 20000)
+        self.assertTrue(np.all(lon < 105.51))  # không lên vách dốc
+        self.assertTrue(np.all(lat > 21.49))  # không xuống nước
+        self.assertFalse(np.any((lon <= 105.2) & (lat >= 21.5)))  # ngoài vùng loại trừ
+        np.testing.assert_allclose(heights, self.store.sample(lon, lat))
+        self.assertTrue(np.all(heights >= 50))
+
+    def test_unconstrained_is_uniform_without_heights(self):
+        lon, lat, heights = self.sample(1000, None)
+        self.assertIsNone(heights)
+        self.assertEqual(len(lon), 1000)
+
+    def test_impossible_constraints(self):
+        with self.assertRaises(ValueError):
+            self.sample(100, {"min_elevation": 30000})
+        with self.assertRaises(ValueError):
+            parse_constraints({"min_elevation": 10, "max_elevation": 5})
+
+    def test_remote_elevation_queries_are_capped(self):
+        queried = []
+
+        def remote_heights(lon, lat):
+            queried.append(len(lon))
+            return self.store.sample(lon, lat)
+
+        def sample(mode, budget):
+            return sample_positions(
+                self.bbox, 1000, np.random.default_rng(1), constraints=parse_constraints({"min_elevation": 50}),
+                height_fn=remote_heights, mode=mode, min_distance=500, max_height_queries=budget,
+            )
+
+        for mode in ("uniform", "poisson"):
+            queried.clear()
+            self.assertEqual(len(sample(mode, 3000)[0]), 1000)
+            self.assertLessEqual(sum(queried), 3000)
+
+            # ~50% candidate đạt -> 1200 lượt query không đủ: dừng thay vì query tiếp
+            queried.clear()
+            with self.assertRaises(ValueError):
+                sample(mode, 1200)
+            self.assertLessEqual(sum(queried), 1200)
+
+
+class PoissonDiskTests(SimpleTestCase):
+
+    bbox = {"min_lon": 105.0, "max_lon": 105.01, "min_lat": 21.0, "max_lat": 21.01}
+
+    def min_spacing(self, lon, lat):
+        x = (lon - 105.0) * METERS_PER_DEGREE * np.cos(np.radians(21.005))
+        y = (lat - 21.0) * METERS_PER_DEGREE
+        d2 = (x[:, None] - x[None, :]) ** 2 + (y[:, None] - y[None, :]) ** 2
+        np.fill_diagonal(d2, np.inf)
+        return np.sqrt(d2.min())
+
+    def test_spacing_and_count(self):
+        lon, lat = poisson_disk(self.bbox, 20.0, np.random.default_rng(1), count=1500)
+
+        self.assertEqual(len(lon), 1500)
+        self.assertGreaterEqual(self.min_spacing(lon, lat), 20.0)
+        self.assertTrue(np.all((lon >= 105.0) & (lon <= 105.01) & (lat >= 21.0) & (lat <= 21.01)))
+
+    def test_saturated_fill_is_dense(self):
+        lon, lat = poisson_disk(self.bbox, 40.0, np.random.default_rng(2))
+
+        # ~1.04km x 1.11km, r = 40m: bão hòa RSA ~ 0.547 * diện tích / (π r²/4) ≈ 500 điểm
+        self.assertGreater(len(lon), 400)
+        self.assertGreaterEqual(self.min_spacing(lon, lat), 40.0)
+
+    def test_seed_is_reproducible(self):
+        run = lambda seed: sample_positions(self.bbox, 500, np.random.default_rng(seed),
+                                            mode="poisson", min_distance=10.0)
+        a, b, c = run(7), run(7), run(8)
+        np.testing.assert_array_equal(a[0], b[0])
+        self.assertFalse(np.array_equal(a[0], c[0]))
+
+    def test_too_many_points(self):
+        with self.assertRaises(ValueError):
+            sample_positions(self.bbox, 1000, np.random.default_rng(0), mode="poisson", min_distance=40.0)
+
+
+def circle_ring(cx, cy, radius, vertices):
+    angle = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    return np.column_stack([cx + radius * np.cos(angle), cy + radius * np.sin(angle)]).tolist()
+
+
+def ray_casting(lon, lat, rings):
+    """Bản scalar tham chiếu (chẵn-lẻ)"""
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+class PolygonIndexTests(SimpleTestCase):
+
+    def test_multipolygon_with_hole_matches_reference(self):
+        geojson = {
+            "type": "MultiPolygon",
+            "coordinates": [
+                [circle_ring(105.3, 21.3, 0.2, 3000), circle_ring(105.3, 21.3, 0.08, 500)],
+                [[[105.6, 21.6], [105.9, 21.6], [105.75, 21.95], [105.6, 21.6]]],
+            ],
+        }
+        polygons = parse_geojson_polygon(geojson)
+        index = PolygonIndex(polygons)
+        rng = np.random.default_rng(9)
+        lon = rng.uniform(105.0, 106.0, 3000)
+        lat = rng.uniform(21.0, 22.0, 3000)
+
+        inside = index.contains(lon, lat)
+
+        rings = [ring for polygon in polygons for ring in polygon]
+        expected = [ray_casting(x, y, rings) for x, y in zip(lon.tolist(), lat.tolist())]
+        np.testing.assert_array_equal(inside, expected)
+        self.assertFalse(index.contains([105.3], [21.3])[0])  # trong lỗ
+        self.assertTrue(index.contains([105.3], [21.45])[0])
+
+    def test_placement_inside_polygon(self):
+        polygons = parse_geojson_polygon({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [circle_ring(105.5, 21.5, 0.1, 200)]},
+        })
+        index = PolygonIndex(polygons)
+
+        lon, lat, _ = sample_positions(index.bounds, 5000, np.random.default_rng(0),
+                                       constraints={"polygon": polygons})
+        self.assertEqual(len(lon), 5000)
+        self.assertTrue(index.contains(lon, lat).all())
+
+        lon, lat, _ = sample_positions(index.bounds, 500, np.random.default_rng(0), constraints={"polygon": polygons},
+                                       mode="poisson", min_distance=100.0)
+        self.assertTrue(index.contains(lon, lat).all())
+
+    def test_invalid_geojson(self):
+        for data in ({"type": "Point", "coordinates": [105, 21]},
+                     {"type": "Polygon", "coordinates": [[[105, 21], [106, 21]]]}):
+            with self.assertRaises(ValueError):
+                parse_geojson_polygon(data)
+
+
+class PolylinePlacementTests(SimpleTestCase):
+    def test_fixed_spacing_along_segments(self):
+        # Line gấp khúc: 1 segment Đông + 1 segment Bắc, có điểm trùng ở góc
+        lines = parse_geojson_lines({
+            "type": "LineString",
+            "coordinates": [[105.80, 21.02], [105.81, 21.02], [105.81, 21.02], [105.81, 21.03]],
+        })
+        lon, lat, heading = place_along_lines(lines, 25.0, offset=5.0)
+
+        east, north = segment_vectors(lon[:-1], lat[:-1], lon[1:], lat[1:])
+        steps = np.hypot(east, north)
+        east_len = np.hypot(*segment_vectors(105.80, 21.02, 105.81, 21.02))
+        north_len = np.hypot(*segment_vectors(105.81, 21.02, 105.81, 21.03))
+        self.assertEqual(len(lon), int((east_len + north_len - 5.0) // 25.0) + 1)
+        self.assertAlmostEqual(np.hypot(*segment_vectors(105.80, 21.02, lon[0], lat[0])), 5.0, places=6)
+
+        # Cùng segment: cách nhau đúng spacing; qua góc: dây cung ngắn hơn spacing
+        on_east = lat == 21.02
+        same_segment = on_east[:-1] == on_east[1:]
+        np.testing.assert_allclose(steps[same_segment], 25.0, atol=1e-4)
+        self.assertTrue((steps[~same_segment] < 25.0).all())
+
+        np.testing.assert_allclose(heading[on_east], 270.0)
+        np.testing.assert_allclose(heading[~on_east], 0.0, atol=1e-9)
+
+    def test_heading_aligns_frame_with_tangent(self):
+        lines = [[[105.80, 21.02], [105.83, 21.05], [105.79, 21.04], [105.80, 21.00]]]
+        lon, lat, heading = place_along_lines(lines, 40.0, heading_offset=0.0)
+        self.assertGreater(len(lon), 100)
+
+        # Trục "Bắc" của model (NORMAL_UP theo HACK Y-up) trùng hướng đi của line
+        normal_up, _ = I3DMGenerator.compute_enu_frame_array(lon, lat, heading)
+        xyz = I3DMGenerator.geodetic_to_cartesian_array(lon, lat, np.zeros(len(lon)))
+        direction = np.diff(xyz, axis=0)
+        direction /= np.linalg.norm(direction, axis=1, keepdims=True)
+        cosines = np.einsum('ij,ij->i', normal_up[:-1], direction)
+        self.assertGreater(np.median(cosines), 0.9999)
+
+        _, _, rotated = place_along_lines(lines, 40.0, heading_offset=90.0)
+        np.testing.assert_allclose(np.mod(rotated - heading, 360.0), 90.0)
+
+    def test_multiple_lines_and_offset(self):
+        lines = parse_geojson_lines({
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "geometry": {"type": "MultiLineString", "coordinates": [
+                    [[105.0, 21.0], [105.001, 21.0]],
+                    [[105.0, 21.1], [105.0, 21.1]],
+                ]}},
+                {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[106.0, 20.0], [106.0, 20.01]]}},
+            ],
+        })
+        self.assertEqual(len(lines), 3)
+        lon, lat, _ = place_along_lines(lines, 10.0)
+        self.assertEqual(int((lon < 105.5).sum()), 11)  # ~103.9m -> 0, 10, ..., 100
+        self.assertEqual(int((lon > 105.5).sum()), 111)  # ~1106m
+        lon, _, _ = place_along_lines(lines, 10.0, offset=500.0)
+        self.assertTrue((lon > 105.5).all())
+        lon, _, _ = place_along_lines(lines, 10.0, offset=5000.0)
+        self.assertEqual(len(lon), 0)
+
+    def test_invalid_lines(self):
+        for data in ({"type": "Point", "coordinates": [105, 21]},
+                     {"type": "LineString", "coordinates": [[105, 21]]},
+                     [[[105, 91], [105, 21]]],
+                     "105,21"):
+            with self.assertRaises(ValueError):
+                parse_geojson_lines(data)
+
+
+class SpatialOrderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        self.glb_path = make_glb(self.out)
+
+    def test_curve_keys(self):
+        iy, ix = np.divmod(np.arange(256), 16)
+        morton = I3DMGenerator.morton_key_array(ix, iy)
+        self.assertEqual(sorted(morton.tolist()), list(range(256)))
+        self.assertEqual(morton[ix + 16 * iy == 1 + 16 * 0][0], 1)
+        self.assertEqual(morton[ix + 16 * iy == 0 + 16 * 1][0], 2)
+        self.assertEqual(morton[ix + 16 * iy == 3 + 16 * 3][0], 15)
+
+        hilbert = I3DMGenerator.hilbert_key_array(ix, iy, bits=4)
+        self.assertEqual(sorted(hilbert.tolist()), list(range(256)))
+        order = np.argsort(hilbert)
+        steps = np.abs(np.diff(ix[order])) + np.abs(np.diff(iy[order]))
+        self.assertTrue((steps == 1).all())
+
+    def test_ordered_tile_is_permutation_of_input(self):
+        instances = random_instances(3000, seed=5)
+        lon, lat, _, _, _ = I3DMGenerator.instances_to_arrays(instances)
+        for curve in ("morton", "hilbert"):
+            ordered = I3DMGenerator(self.glb_path, debug=False, order=curve)
+            ordered.generate_i3dm(instances, self.out / f"{curve}.i3dm")
+
+            perm = I3DMGenerator.spatial_order(lon, lat, curve)
+            plain = I3DMGenerator(self.glb_path, debug=False)
+            plain.generate_i3dm([instances[i] for i in perm], self.out / "presorted.i3dm")
+            self.assertEqual((self.out / f"{curve}.i3dm").read_bytes(),
+                             (self.out / "presorted.i3dm").read_bytes())
+
+    def test_ordering_improves_compression(self):
+        # Như bbox generation: heading 0, scale đồng nhất, terrain phẳng
+        instances = [dict(i, lon=105.8 + i["lon"] / 1e2, lat=21.0 + i["lat"] / 1e2, height=0.0,
+                          scale=1.0, heading=0.0)
+                     for i in random_instances(5000, seed=6)]
+        sizes = {}
+        for curve in (None, "morton", "hilbert"):
+            generator = I3DMGenerator(self.glb_path, debug=False, compact=True, order=curve)
+            path = generator.generate_i3dm(instances, self.out / f"{curve}.i3dm")
+            _, ft_bin, _ = read_feature_table(path)
+            sizes[curve] = len(gzip.compress(ft_bin))
+        self.assertLess(sizes["morton"], sizes[None] * 0.9)
+        self.assertLess(sizes["hilbert"], sizes[None] * 0.9)
+
+    def test_generation_key_includes_order(self):
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(20))
+        plain = I3DMGenerator(self.glb_path, debug=False)
+        hilbert = I3DMGenerator(self.glb_path, debug=False, order="hilbert")
+        self.assertNotEqual(plain.generation_key(lon, lat, height, heading, scale),
+                            hilbert.generation_key(lon, lat, height, heading, scale))
+        with self.assertRaises(ValueError):
+            I3DMGenerator(self.glb_path, debug=False, order="peano")
+
+
+class PrecompressedTileTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = Path(tmp.name)
+        override = override_settings(MEDIA_ROOT=str(self.media))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        generator = I3DMGenerator(make_glb(self.media, b"glTF" * 4096), debug=False, precompress=True)
+        lon, lat, height, heading, scale = I3DMGenerator.instances_to_arrays(random_instances(200))
+        self.result = generator.generate_tileset(lon, lat, height, self.media / "i3dm", "test",
+                                                 heading=heading, scale=scale, max_instances_per_tile=50)
+        self.i3dm_path = self.media / "i3dm" / self.result["i3dm_file"]
+
+    def test_generator_writes_gzip_siblings(self):
+        for name in (self.result["tileset_file"], self.result["i3dm_file"]):
+            path = self.media / "i3dm" / name
+            gz = path.with_name(path.name + ".gz")
+            self.assertEqual(gzip.decompress(gz.read_bytes()), path.read_bytes())
+            self.assertLess(gz.stat().st_size, path.stat().st_size)
+
+    def test_negotiation(self):
+        self.assertEqual(parse_accept_encoding("gzip;q=0.5, br;q=0, *"), {"gzip": 0.5, "br": 0.0, "*": 1.0})
+        self.assertEqual(choose_variant(self.i3dm_path, "")[1], None)
+        self.assertEqual(choose_variant(self.i3dm_path, "gzip, deflate")[1], "gzip")
+        self.assertEqual(choose_variant(self.i3dm_path, "gzip;q=0")[1], None)
+
+        # Có .br thì ưu tiên br, trừ khi client cho gzip q cao hơn
+        br = self.i3dm_path.with_name(self.i3dm_path.name + ".br")
+        br.write_bytes(b"fake-brotli")
+        self.assertEqual(choose_variant(self.i3dm_path, "gzip, br")[1], "br")
+        self.assertEqual(choose_variant(self.i3dm_path, "gzip, br;q=0.5")[1], "gzip")
+
+        # File gốc ghi lại sau bản nén -> bỏ bản nén cũ
+        stale = self.i3dm_path.stat().st_mtime_ns + 10 ** 9
+        os.utime(self.i3dm_path, ns=(stale, stale))
+        self.assertEqual(choose_variant(self.i3dm_path, "gzip, br"), (self.i3dm_path, None))
+
+    def test_variants_are_world_readable_and_failed_writes_leave_no_tmp(self):
+        gz = self.i3dm_path.with_name(self.i3dm_path.name + ".gz")
+        self.assertEqual(gz.stat().st_mode & 0o777, 0o644)
+
+        gz.unlink()
+        with mock.patch("i3dm_app.precompress.os.replace", side_effect=OSError("disk full")), \
+                self.assertRaises(OSError):
+            write_precompressed(self.i3dm_path)
+        self.assertFalse(gz.exists())
+        self.assertEqual(list(self.i3dm_path.parent.glob("*.tmp")), [])
+
+    def test_compresses_in_chunks_without_reading_whole_file(self):
+        path = self.media / "big.i3dm"
+        payload = b"".join(struct.pack("<I", i % 5000) for i in range(500_000))
+        path.write_bytes(payload)
+        with mock.patch("i3dm_app.precompress.PRECOMPRESS_CHUNK_BYTES", 64 * 1024), \
+                mock.patch.object(Path, "read_bytes", side_effect=AssertionError("whole file read")):
+            self.assertIn("gzip", write_precompressed(path))
+        gz = path.with_name("big.i3dm.gz")
+        self.assertEqual(gzip.decompress(gz.read_bytes()), payload)
+        # Header giống gzip.compress (không có tên file tạm, mtime=0)
+        self.assertEqual(gz.read_bytes()[:8], gzip.compress(b"", mtime=0)[:8])
+
+    def test_small_files_are_not_compressed(self):
+        path = self.media / "small.json"
+        path.write_text("{}")
+        self.assertEqual(write_precompressed(path), [])
+        self.assertFalse(path.with_name("small.json.gz").exists())
+
+    def test_view_serves_precompressed_bytes(self):
+        url = f"/media/i3dm/{self.result['i3dm_file']}"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(response["Content-Type"], "application/octet-stream")
+        self.assertEqual(gzip.decompress(body), self.i3dm_path.read_bytes())
+
+        response = self.client.get(f"/media/i3dm/{self.result['tileset_file']}")
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("root", json.loads(b"".join(response.streaming_content)))
+
+        self.assertEqual(self.client.get("/media/i3dm/..%2f..%2fetc%2fpasswd").status_code, 404)
+        self.assertEqual(self.client.get("/media/i3dm/missing.i3dm").status_code, 404)
+
+
+class MediaServingTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = Path(tmp.name)
+        override = override_settings(MEDIA_ROOT=str(self.media))
+        override.enable()
+        self.addCleanup(override.disable)
+        etag_cache.clear()
+
+        self.data = bytes(range(256)) * 40
+        (self.media / "models").mkdir()
+        (self.media / "models" / "tree.glb").write_bytes(self.data)
+        self.shared_name = f"glb_shared/{'ab' * 32}.glb"
+        (self.media / "glb_shared").mkdir()
+        (self.media / self.shared_name).write_bytes(self.data)
+
+    def get(self, path, **headers):
+        response = self.client.get(f"/media/{path}", **headers)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_response_headers(self):
+        response, body = self.get("models/tree.glb")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response["Content-Type"], "model/gltf-binary")
+        self.assertEqual(int(response["Content-Length"]), len(self.data))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["ETag"], f'"{hashlib.sha256(self.data).hexdigest()[:32]}"')
+        self.assertIn("must-revalidate", response["Cache-Control"])
+
+        response, _ = self.get(self.shared_name)
+        self.assertEqual(response["ETag"], f'"{"ab" * 32}"')
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_conditional_requests(self):
+        response, _ = self.get("models/tree.glb")
+        etag = response["ETag"]
+
+        response, body = self.get("models/tree.glb", HTTP_IF_NONE_MATCH=f'W/"x", {etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        response, _ = self.get("models/tree.glb", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+
+        # Ghi đè file (upload lại cùng tên) -> ETag đổi, trả full
+        (self.media / "models" / "tree.glb").write_bytes(self.data[::-1])
+        response, body = self.get("models/tree.glb", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(body, self.data[::-1])
+
+    def test_byte_ranges(self):
+        size = len(self.data)
+        for header, start, end in (("bytes=100-199", 100, 199), ("bytes=10000-", 10000, size - 1),
+                                   ("bytes=-50", size - 50, size - 1), ("bytes=9000-999999", 9000, size - 1)):
+            response, body = self.get("models/tree.glb", HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(body, self.data[start:end + 1])
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}")
+            self.assertEqual(int(response["Content-Length"]), end - start + 1)
+            # Không lộ fileno(): file_wrapper (uWSGI) sẽ sendfile tới EOF, bỏ qua độ dài đoạn
+            self.assertFalse(hasattr(response.file_to_stream, "fileno"))
+
+        response, _ = self.get("models/tree.glb", HTTP_RANGE=f"bytes={size}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{size}")
+
+        # Nhiều đoạn / If-Range không khớp -> trả cả file
+        response, body = self.get("models/tree.glb", HTTP_RANGE="bytes=0-1,5-6")
+        self.assertEqual((response.status_code, body), (200, self.data))
+        response, body = self.get("models/tree.glb", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.data))
+
+    def test_head_and_missing(self):
+        response = self.client.head("/media/models/tree.glb")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), len(self.data))
+        self.assertEqual(self.client.get("/media/models/missing.glb").status_code, 404)
+        self.assertEqual(self.client.get("/media/models/..%2f..%2f..%2fetc%2fpasswd").status_code, 404)
+
+    def test_content_addressed_paths(self):
+        key = "0123456789abcdef"
+        self.assertEqual(content_addressed_token(f"i3dm/tileset_5_100_{key}.json"), key)
+        self.assertEqual(content_addressed_token(f"i3dm/instances_5_100_{key}/0_1.i3dm"), key)
+        self.assertIsNone(content_addressed_token("i3dm/instances_5_100_1700000000123456.i3dm"))
+        self.assertIsNone(content_addressed_token(f"model_types/tree_{key}.glb"))
+
+
+class StreamingWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.out = Path(self.tmp.name)
+        # GLB > chunk để copy_file_range / iter_chunks phải chạy nhiều vòng
+        self.glb_path = make_glb(self.out, bytes(range(256)) * 9000)
+        self.instances = random_instances(700, seed=8)
+
+    def test_writer_outputs_match(self):
+        for compact in (False, True):
+            generator = I3DMGenerator(self.glb_path, debug=False, compact=compact, cache=False)
+            path = generator.generate_i3dm(self.instances, self.out / "tile.i3dm")
+            expected = path.read_bytes()
+            self.assertEqual(expected[-len(generator.glb_data):], generator.glb_data)
+
+            lon, lat, height, heading, scale = generator.instances_to_arrays(self.instances)
+            writer = generator.i3dm_writer_arrays(lon, lat, height, heading=heading, scale=scale)
+            self.assertEqual(writer.byte_length, len(expected))
+            self.assertEqual(b"".join(writer.iter_chunks(chunk_size=4096)), expected)
+
+            stream = io.BytesIO()
+            self.assertEqual(writer.write_to(stream), len(expected))
+            self.assertEqual(stream.getvalue(), expected)
+
+    def test_uncached_generator_does_not_load_glb(self):
+        generator = I3DMGenerator(self.glb_path, debug=False, cache=False)
+        generator.generate_i3dm(self.instances, self.out / "tile.i3dm")
+        self.assertEqual(generator.glb_digest, hashlib.sha256(self.glb_path.read_bytes()).hexdigest())
+        self.assertIsNone(generator._glb_data)
+
+    def test_zero_copy_fallback(self):
+        generator = I3DMGenerator(self.glb_path, debug=False)
+        expected = generator.generate_i3dm(self.instances, self.out / "a.i3dm").read_bytes()
+        with mock.patch("i3dm_app.i3dm_writer.os.copy_file_range", side_effect=OSError, create=True), \
+                mock.patch("i3dm_app.i3dm_writer.os.sendfile", side_effect=OSError, create=True):
+            path = generator.generate_i3dm(self.instances, self.out / "b.i3dm")
+        self.assertEqual(path.read_bytes(), expected)
+
+    def test_glb_replaced_after_hashing_embeds_hashed_bytes(self):
+        generator = I3DMGenerator(self.glb_path, debug=False)
+        original = bytes(generator.glb_data)
+        # Upload lại = xóa rồi ghi file mới (inode mới), mmap cũ vẫn hợp lệ
+        replacement = self.out / "replacement.glb"
+        replacement.write_bytes(b"replaced")
+        os.replace(replacement, self.glb_path)
+        path = generator.generate_i3dm(self.instances, self.out / "tile.i3dm")
+        self.assertTrue(path.read_bytes().endswith(original))
+
+    def test_failed_write_keeps_previous_file(self):
+        generator = I3DMGenerator(self.glb_path, debug=False)
+        path = generator.generate_i3dm(self.instances, self.out / "tile.i3dm")
+        previous = path.read_bytes()
+        self.assertEqual(path.stat().st_mode & 0o777, 0o644)
+
+        def broken(f):
+            f.write(b"partial")
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            write_atomic(path, broken)
+        self.assertEqual(path.read_bytes(), previous)
+        self.assertEqual(sorted(p.name for p in self.out.iterdir()), ["model.glb", "tile.i3dm"])
+
+
+class PointColumnTests(SimpleTestCase):
+
+    def setUp(self):
+        self.instances = random_instances(300, seed=9)
+        self.instances[5].pop("scale")
+        self.instances[7].pop("heading")
+
+    def assertColumnsEqual(self, columns, instances):
+        generator = I3DMGenerator.__new__(I3DMGenerator)
+        lon, lat, height, heading, scale = generator.instances_to_arrays(instances)
+        expected = dict(lon=lon, lat=lat, height=height, scale=scale, heading=heading)
+        for name in POINT_COLUMNS:
+            np.testing.assert_array_equal(columns[name], expected[name])
+
+    def test_binary_columns(self):
+        columns = columns_from_instances(self.instances)
+        body = np.stack([columns[name] for name in POINT_COLUMNS]).astype("<f8").tobytes()
+        self.assertColumnsEqual(columns_from_binary(body), self.instances)
+        with self.assertRaises(ValueError):
+            columns_from_binary(body[:-8])
+        with self.assertRaises(ValueError):
+            columns_from_binary(b"")
+
+    def test_stream_matches_json_loads(self):
+        body = json.dumps({
+            "model_id": 3, "compact": True, "instances": self.instances, "order": "hilbert",
+        }, indent=1).encode()
+        # Chunk nhỏ, lẻ: số / key / chuỗi bị cắt ngang ở ranh giới chunk
+        for chunk_size in (1, 7, 4096):
+            with mock.patch("i3dm_app.point_columns.JSON_CHUNK_BYTES", chunk_size), \
+                    mock.patch.object(PointColumnBuilder, "BATCH_ROWS", 64):
+                fields, columns = read_json_points(io.BytesIO(body))
+            self.assertEqual(fields, {"model_id": 3, "compact": True, "order": "hilbert"})
+            self.assertColumnsEqual(columns, self.instances)
+
+    def test_stream_errors(self):
+        def read(body, **kwargs):
+            return read_json_points(io.BytesIO(body.encode()), **kwargs)
+
+        self.assertEqual(read('{"model_id": 1}'), ({"model_id": 1}, None))
+        self.assertEqual(len(read('{"instances": []}')[1]["lon"]), 0)
+        for bad in ('', '[1]', '{"instances": [{"lon": 1, "lat": 2, "height": 0}', '{"a": 1} x', '{"a" 1}'):
+            with self.assertRaises(json.JSONDecodeError):
+                read(bad)
+        with self.assertRaises(ValueError):
+            read('{"instances": [{"lon": 1, "lat": 2}]}')
+        with self.assertRaises(ValueError):
+            read('{"instances": [{"lon": "x", "lat": 2, "height": 0}]}')
+        with self.assertRaises(OverflowError):
+            read(json.dumps({"instances": self.instances}), max_points=100)
+
+    def test_stream_tokens_cut_at_chunk_boundary(self):
+        body = b'{"flag": true, "none": null, "x": -Infinity, "s": "\\u00e9t\\u00e9", "instances": []}'
+        for chunk_size in range(1, 12):
+            with mock.patch("i3dm_app.point_columns.JSON_CHUNK_BYTES", chunk_size):
+                fields, _ = read_json_points(io.BytesIO(body))
+            self.assertEqual(fields, {"flag": True, "none": None, "x": -float("inf"), "s": "\u00e9t\u00e9"})
+
+    def test_stream_invalid_json_fails_without_reading_rest(self):
+        stream = io.BytesIO(b'{"instances": [{"lon": oops, "lat": 2, "height": 0}' + b" " * 10_000_000 + b"]}")
+        with mock.patch("i3dm_app.point_columns.JSON_CHUNK_BYTES", 4096), \
+                self.assertRaises(json.JSONDecodeError):
+            read_json_points(stream)
+        self.assertEqual(stream.tell(), 4096)
+
+    def test_stream_body_size_cap(self):
+        body = json.dumps({"instances": self.instances}).encode()
+        with mock.patch("i3dm_app.point_columns.JSON_CHUNK_BYTES", 1024), \
+                self.assertRaises(BodyTooLargeError):
+            read_json_points(io.BytesIO(body), max_bytes=len(body) // 2)
+        self.assertIsNotNone(read_json_points(io.BytesIO(body), max_bytes=len(body))[1])
+
+
+class ChunkedUploadTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = UploadSessionStore(Path(self.tmp.name) / "sessions", max_bytes=1 << 20, ttl=60)
+        self.data = os.urandom(100_000)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    def put(self, upload_id, start, end):
+        return self.store.write_chunk(upload_id, start, io.BytesIO(self.data[start:end]), end - start)
+
+    def test_parallel_chunks_resume_and_claim(self):
+        upload_id = self.store.create("city.glb", len(self.data), self.sha256)["upload_id"]
+        chunks = [(start, min(start + 7000, len(self.data))) for start in range(0, len(self.data), 7000)]
+        random.Random(3).shuffle(chunks)
+
+        # Mất 2 chunk -> trạng thái chỉ ra đúng đoạn thiếu để resume
+        lost = sorted(chunks[:2])
+        threads = [threading.Thread(target=self.put, args=(upload_id, *c)) for c in chunks[2:]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        status = self.store.status(upload_id)
+        self.assertEqual([tuple(r) for r in status["missing"]], lost)
+        with self.assertRaises(UploadError) as ctx:
+            self.store.complete(upload_id)
+        self.assertEqual(ctx.exception.status, 409)
+
+        for c in lost:
+            self.put(upload_id, *c)
+        status = self.store.complete(upload_id)
+        self.assertTrue(status["complete"])
+        self.assertEqual(status["offset"], len(self.data))
+
+        source = self.store.root / upload_id / "data"
+        inode = source.stat().st_ino
+        dest = self.store.claim(upload_id, Path(self.tmp.name) / "media" / "models" / "city.glb")
+        self.assertEqual(dest.read_bytes(), self.data)
+        self.assertEqual(dest.stat().st_ino, inode)
+        self.assertFalse((self.store.root / upload_id).exists())
+
+    def test_rejects_bad_chunks_and_digest(self):
+        upload_id = self.store.create("a.b3dm", len(self.data), "0" * 64)["upload_id"]
+        with self.assertRaises(UploadError) as ctx:
+            self.put(upload_id, len(self.data) - 10, len(self.data) + 10)
+        self.assertEqual(ctx.exception.status, 416)
+
+        # Kết nối đứt giữa chừng: chunk không được đánh dấu
+        with self.assertRaises(UploadError):
+            self.store.write_chunk(upload_id, 0, io.BytesIO(self.data[:10]), 20)
+        self.assertEqual(self.store.status(upload_id)["offset"], 0)
+
+        self.put(upload_id, 0, len(self.data))
+        with self.assertRaises(UploadError) as ctx:
+            self.store.complete(upload_id)
+        self.assertEqual(ctx.exception.status, 422)
+        self.assertEqual(self.store.status(upload_id)["received"], [])
+        with self.assertRaises(UploadError):
+            self.store.claim(upload_id, Path(self.tmp.name) / "x.b3dm")
+
+        for bad in (("a.exe", 10, self.sha256), ("a.glb", 2 << 20, self.sha256), ("a.glb", 10, "xyz")):
+            with self.assertRaises(UploadError):
+                self.store.create(*bad)
+        with self.assertRaises(UploadError):
+            self.store.status("../" + upload_id)
+
+    def test_chunk_rejected_while_completing(self):
+        upload_id = self.store.create("city.glb", len(self.data), self.sha256)["upload_id"]
+        self.put(upload_id, 0, len(self.data))
+        file_digest = hashlib.file_digest
+        rejected = []
+
+        def digest_with_late_chunk(f, name):
+            # Chunk gửi lại đúng lúc complete đang hash file
+            try:
+                self.store.write_chunk(upload_id, 0, io.BytesIO(b"x" * 10), 10)
+            except UploadError as e:
+                rejected.append(e.status)
+            return file_digest(f, name)
+
+        with mock.patch("i3dm_app.chunked_upload.hashlib.file_digest", digest_with_late_chunk):
+            self.assertTrue(self.store.complete(upload_id)["complete"])
+        self.assertEqual(rejected, [409])
+        with self.assertRaises(UploadError) as ctx:
+            self.put(upload_id, 0, 10)
+        self.assertEqual(ctx.exception.status, 409)
+        self.assertFalse((self.store.root / upload_id / "assembling").exists())
+
+    def test_complete_waits_for_chunk_being_written(self):
+        upload_id = self.store.create("city.glb", len(self.data), self.sha256)["upload_id"]
+        half = len(self.data) // 2
+        self.put(upload_id, 0, half)
+        release = threading.Event()
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                release.wait(5)
+                return super().read(size)
+
+        writer = threading.Thread(target=self.store.write_chunk,
+                                  args=(upload_id, half, SlowStream(self.data[half:]), len(self.data) - half))
+        writer.start()
+        while not os.listdir(self.store.root / upload_id / "writing"):
+            time.sleep(0.01)
+        threading.Timer(0.2, release.set).start()
+        # complete chờ chunk đang ghi xong rồi mới hash
+        self.assertTrue(self.store.complete(upload_id)["complete"])
+        writer.join()
+
+    def test_concurrent_claims(self):
+        upload_id = self.store.create("city.glb", len(self.data), self.sha256)["upload_id"]
+        self.put(upload_id, 0, len(self.data))
+        self.store.complete(upload_id)
+
+        # Claim khác đang giữ marker
+        (self.store.root / upload_id / "assembling").touch()
+        with self.assertRaises(UploadError) as ctx:
+            self.store.claim(upload_id, Path(self.tmp.name) / "a.glb")
+        self.assertEqual(ctx.exception.status, 409)
+        (self.store.root / upload_id / "assembling").unlink()
+
+        # File data đã bị claim khác lấy đi
+        with mock.patch("i3dm_app.chunked_upload.shutil.move", side_effect=FileNotFoundError), \
+                self.assertRaises(UploadError) as ctx:
+            self.store.claim(upload_id, Path(self.tmp.name) / "a.glb")
+        self.assertEqual(ctx.exception.status, 409)
+
+        self.assertEqual(self.store.claim(upload_id, Path(self.tmp.name) / "a.glb").read_bytes(), self.data)
+        with self.assertRaises(UploadError) as ctx:
+            self.store.claim(upload_id, Path(self.tmp.name) / "b.glb")
+        self.assertEqual(ctx.exception.status, 404)
+
+    def test_cleanup_stale_sessions(self):
+        old = self.store.create("old.glb", 10, self.sha256)["upload_id"]
+        stamp = time.time() - 120
+        for item in (self.store.root / old, self.store.root / old / "chunks", self.store.root / old / "data"):
+            os.utime(item, (stamp, stamp))
+        fresh = self.store.create("new.glb", 10, self.sha256)["upload_id"]
+        self.assertFalse((self.store.root / old).exists())
+        self.assertTrue((self.store.root / fresh).exists())
+        self.assertEqual(self.store.cleanup_stale(now=time.time() + 120), 1)
+
+
+class BlobStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.media = Path(self.tmp.name)
+        self.data = os.urandom(50_000)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+    def receive(self, name):
+        handler = HashingUploadHandler()
+        handler.new_file("glb_file", name, "model/gltf-binary", len(self.data))
+        for start in range(0, len(self.data), 4096):
+            handler.receive_data_chunk(self.data[start:start + 4096], start)
+        return handler.file_complete(len(self.data))
+
+    def test_upload_hashed_while_received_and_deduplicated(self):
+        with override_settings(MEDIA_ROOT=str(self.media)):
+            first, second = self.receive("tree.glb"), self.receive("Copy of tree.GLB")
+            self.assertEqual(first.sha256, self.sha256)
+            self.assertEqual(Path(first.temporary_file_path()).parent, self.media / "blobs" / "tmp")
+
+            path, deduplicated = place_blob(first.temporary_file_path(), first.sha256, first.name)
+            self.assertFalse(deduplicated)
+            self.assertEqual(path, blob_relative_path(self.sha256, "x.glb"))
+            self.assertEqual((self.media / path).read_bytes(), self.data)
+
+            # Cùng nội dung, khác tên -> cùng blob, file tạm thứ 2 bị bỏ
+            self.assertEqual(place_blob(second.temporary_file_path(), second.sha256, second.name), (path, True))
+            self.assertFalse(Path(second.temporary_file_path()).exists())
+            first.close()
+            second.close()
+            self.assertEqual(os.listdir(self.media / "blobs" / "tmp"), [])
+
+    def test_blob_paths_are_content_addressed(self):
+        path = blob_relative_path(self.sha256, "a.b3dm")
+        self.assertEqual(path, f"blobs/{self.sha256[:2]}/{self.sha256}.b3dm")
+        self.assertTrue(is_blob_path(path))
+        self.assertFalse(is_blob_path("model_types/a.glb"))
+        self.assertFalse(is_blob_path(None))
+        self.assertEqual(content_addressed_token(path), self.sha256)
+
+
+class BlobRefCountTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media = Path(tmp.name)
+        media_override = override_settings(MEDIA_ROOT=str(self.media))
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        self.data = os.urandom(20_000)
+
+    def store(self, name="tree.glb", data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return store_upload(SimpleUploadedFile(name, data or self.data))
+
+    def blob_files(self):
+        return sorted(p for p in (self.media / "blobs").rglob("*") if p.is_file() and p.parent.name != "tmp")
+
+    def test_same_content_stored_once(self):
+        path = self.store("tree.glb")
+        self.assertEqual(self.store("Copy of tree.glb"), path)
+        self.assertEqual(self.blob_files(), [self.media / path])
+        self.assertEqual(ModelBlob.objects.get(path=path).ref_count, 2)
+        self.assertEqual(os.listdir(self.media / "blobs" / "tmp"), [])
+
+    def test_last_release_deletes_file_after_commit(self):
+        path = self.store()
+        self.store()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(release_blob(path))
+        self.assertTrue((self.media / path).exists())
+        self.assertEqual(ModelBlob.objects.get(path=path).ref_count, 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            release_blob(path)
+        # Chưa commit -> file vẫn còn
+        self.assertTrue((self.media / path).exists())
+        for callback in callbacks:
+            callback()
+        self.assertFalse((self.media / path).exists())
+        self.assertFalse(ModelBlob.objects.filter(path=path).exists())
+
+    def test_rolled_back_release_keeps_file(self):
+        path = self.store()
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                release_blob(path)
+                raise RuntimeError("save failed")
+        self.assertTrue((self.media / path).exists())
+        self.assertEqual(ModelBlob.objects.get(path=path).ref_count, 1)
+
+    def test_rolled_back_store_leaves_no_blob_file(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                store_upload(SimpleUploadedFile("tree.glb", self.data))
+                raise RuntimeError("save failed")
+        self.assertEqual(self.blob_files(), [])
+        self.assertFalse(ModelBlob.objects.exists())
+        # File tạm còn lại được dọn sau TTL
+        self.assertEqual(cleanup_tmp_files(now=time.time() + 10, ttl=5), 1)
+        self.assertEqual(os.listdir(self.media / "blobs" / "tmp"), [])
+
+    def test_reference_released_blob_again_before_delete(self):
+        path = self.store()
+        with self.captureOnCommitCallbacks() as callbacks:
+            release_blob(path)
+        # Upload lại cùng nội dung trước khi callback xóa chạy
+        self.assertEqual(self.store(), path)
+        for callback in callbacks:
+            callback()
+        self.assertTrue((self.media / path).exists())
+        self.assertEqual(ModelBlob.objects.get(path=path).ref_count, 1)
+
+    def test_acquire_blob(self):
+        path = self.store()
+        self.assertTrue(acquire_blob(path))
+        self.assertEqual(ModelBlob.objects.get(path=path).ref_count, 2)
+        self.assertFalse(acquire_blob("model_types/tree.glb"))
+        self.assertFalse(acquire_blob(blob_relative_path("0" * 64, "missing.glb")))
+
+    def test_update_model_type_file_moves_reference(self):
+        old_path = self.store("old.glb")
+        model_type = LoaiMoHinh.objects.create(ten_loai_mo_hinh="Cây", loai_cap_nhat="tree", url_glb=old_path)
+        new_data = os.urandom(20_000)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/QLModel/api/model-types/{model_type.id}/update-with-file/",
+                {"loai_cap_nhat": "tree", "glb_file": SimpleUploadedFile("new.glb", new_data)},
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        model_type.refresh_from_db()
+        new_path = blob_relative_path(hashlib.sha256(new_data).hexdigest(), "new.glb")
+        self.assertEqual(model_type.url_glb, new_path)
+        self.assertEqual((self.media / new_path).read_bytes(), new_data)
+        self.assertEqual(ModelBlob.objects.get(path=new_path).ref_count, 1)
+        self.assertFalse(ModelBlob.objects.filter(path=old_path).exists())
+        self.assertFalse((self.media / old_path).exists())
+
+    def test_upload_glb_form_hashes_while_receiving_and_checks_csrf(self):
+        csrf_client = Client(enforce_csrf_checks=True)
+        response = csrf_client.post("/upload/", {"name": "Tree", "glb_file": SimpleUploadedFile("tree.glb", self.data)})
+        self.assertEqual(response.status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch("i3dm_app.blob_store.HashingUploadHandler.file_complete",
+                           autospec=True, side_effect=HashingUploadHandler.file_complete) as file_complete:
+            response = self.client.post("/upload/", {"name": "Tree", "glb_file": SimpleUploadedFile("tree.glb", self.data)})
+        self.assertEqual(response.status_code, 302)
+        file_complete.assert_called_once()
+        path = blob_relative_path(hashlib.sha256(self.data).hexdigest(), "tree.glb")
+        self.assertEqual(GlbModel.objects.get(name="Tree").glb_file.name, path)
+        self.assertEqual((self.media / path).read_bytes(), self.data)
+
+
+class JobQueueMixin:
+    """MEDIA_ROOT tạm + 1 GlbModel cho các test cần DB"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.media = Path(self.tmp.name)
+        override = override_settings(MEDIA_ROOT=str(self.media), I3DM_PRECOMPRESS=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        (self.media / "models").mkdir()
+        make_glb(self.media / "models")
+        self.model = GlbModel.objects.create(name="Tree", glb_file="models/model.glb")
+
+    def submit(self, count=30, **extra):
+        body = {"type": "points", "model_id": self.model.id, "instances": random_instances(count)}
+        body.update(extra)
+        return self.client.post("/api/i3dm/jobs/", json.dumps(body), content_type="application/json")
+
+
+class TilesetRecordTests(JobQueueMixin, TestCase):
+
+    def generate(self, columns):
+        generator = I3DMGenerator(self.model.glb_file.path, debug=False)
+        fields = dict(source_model=self.model, name="Tree", count=len(columns[0]),
+                      min_lon=0, max_lon=1, min_lat=0, max_lat=1)
+        return get_or_generate_tileset(generator, f"{self.model.id}_{len(columns[0])}", columns, fields)
+
+    def test_regenerated_tileset_reuses_record(self):
+        columns = I3DMGenerator.instances_to_arrays(random_instances(50))
+        record, reused = self.generate(columns)
+        self.assertFalse(reused)
+        self.assertEqual(self.generate(columns), (record, True))
+
+        # Worker khác đã lưu record nhưng file chưa có / bị xóa -> generate lại, dùng chung record
+        (self.media / "i3dm" / record.tileset_file).unlink()
+        self.assertEqual(self.generate(columns), (record, True))
+        self.assertTrue((self.media / "i3dm" / record.tileset_file).exists())
+        self.assertEqual(I3DMTileset.objects.count(), 1)
+
+    def test_tileset_file_is_unique(self):
+        fields = dict(name="a", count=1, min_lon=0, max_lon=1, min_lat=0, max_lat=1, i3dm_file="a.i3dm")
+        I3DMTileset.objects.create(tileset_file="tileset_a.json", **fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            I3DMTileset.objects.create(tileset_file="tileset_a.json", **fields)
+
+
+class JobQueueTests(JobQueueMixin, TestCase):
+
+    def test_submit_claim_run_and_status(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        self.assertEqual(I3DMJob.objects.get(id=job_id).status, I3DMJob.STATUS_PENDING)
+
+        job = claim_next_job()
+        self.assertEqual(job.id, job_id)
+        self.assertEqual(job.status, I3DMJob.STATUS_RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_next_job())
+
+        run_job(job)
+        data = self.client.get(f"/api/i3dm/jobs/{job_id}/").json()["job"]
+        self.assertEqual(data["status"], I3DMJob.STATUS_SUCCEEDED)
+        self.assertEqual(data["progress"], 1.0)
+        self.assertEqual(data["result"]["count"], 30)
+        self.assertEqual(set(data["stage_timings"]), {"prepare", "generate"})
+        self.assertTrue((self.media / "i3dm" / job.tileset.tileset_file).exists())
+
+    def test_submit_rejects_invalid_request(self):
+        self.assertEqual(self.submit(type="nope").status_code, 400)
+        self.assertEqual(self.submit(count=0).status_code, 400)
+        self.assertFalse(I3DMJob.objects.exists())
+
+    def test_cancel_pending_job(self):
+        job_id = self.submit().json()["job_id"]
+        data = self.client.post(f"/api/i3dm/jobs/{job_id}/cancel/").json()["job"]
+        self.assertEqual(data["status"], I3DMJob.STATUS_CANCELLED)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(self.client.post(f"/api/i3dm/jobs/{job_id}/cancel/").status_code, 409)
+
+    def test_cancel_during_generate_stage_stops_between_tiles(self):
+        job_id = self.submit(count=6000).json()["job_id"]
+        job = claim_next_job()
+        written = []
+        original = I3DMGenerator.generate_i3dm_arrays
+
+        def write_tile(generator, *args, **kwargs):
+            # Yêu cầu hủy tới ngay sau tile đầu tiên (giữa stage generate)
+            if not written:
+                self.client.post(f"/api/i3dm/jobs/{job_id}/cancel/")
+            written.append(args[3])
+            return original(generator, *args, **kwargs)
+
+        with mock.patch("i3dm_app.jobs.PROGRESS_INTERVAL", 0), \
+                mock.patch.object(I3DMGenerator, "generate_i3dm_arrays", write_tile):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, I3DMJob.STATUS_CANCELLED)
+        self.assertEqual(job.stage, "generate")
+        self.assertEqual(len(written), 1)
+        self.assertIsNone(job.tileset)
+        # Tile đã ghi dở của job bị hủy được dọn
+        self.assertEqual(list((self.media / "i3dm").iterdir()), [])
+
+    def test_failed_job_keeps_files_of_existing_tileset(self):
+        self.submit()
+        run_job(claim_next_job())
+        tileset = I3DMTileset.objects.get()
+        self.submit()
+        job = claim_next_job()
+        runner = JOB_RUNNERS[I3DMJob.TYPE_POINTS]
+
+        def fail_after_reuse(params, tracker):
+            # Cùng hash với tileset đã có -> dùng lại, rồi lỗi
+            runner(params, tracker)
+            raise RuntimeError("after generate")
+
+        with mock.patch.dict(JOB_RUNNERS, {I3DMJob.TYPE_POINTS: fail_after_reuse}):
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, I3DMJob.STATUS_FAILED)
+        self.assertTrue((self.media / "i3dm" / tileset.tileset_file).exists())
+        self.assertTrue((self.media / "i3dm" / tileset.i3dm_file).exists())
+
+    def test_failing_runner_marks_failed(self):
+        job_id = self.submit().json()["job_id"]
+
+        def boom(params, tracker):
+            with tracker.stage("prepare", 1.0):
+                raise RuntimeError("GLB is corrupt")
+
+        with mock.patch.dict(JOB_RUNNERS, {I3DMJob.TYPE_POINTS: boom}):
+            run_job(claim_next_job())
+        job = I3DMJob.objects.get(id=job_id)
+        self.assertEqual(job.status, I3DMJob.STATUS_FAILED)
+        self.assertEqual(job.error, "GLB is corrupt")
+        self.assertEqual(job.stage, "prepare")
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_job_is_requeued_then_failed(self):
+        job_id = self.submit().json()["job_id"]
+        old = timezone.now() - timedelta(hours=1)
+
+        job = claim_next_job()
+        I3DMJob.objects.filter(id=job_id).update(heartbeat_at=old)
+        # Worker mới nhận lại job của worker đã chết
+        job = claim_next_job()
+        self.assertEqual((job.id, job.attempts), (job_id, 2))
+
+        with override_settings(I3DM_JOB_MAX_ATTEMPTS=2):
+            I3DMJob.objects.filter(id=job_id).update(heartbeat_at=old)
+            self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, I3DMJob.STATUS_FAILED)
+        self.assertIn("stopped responding", job.error)
+
+        # Heartbeat còn mới -> không đụng tới
+        running = I3DMJob.objects.create(job_type=I3DMJob.TYPE_POINTS, params={},
+                                         status=I3DMJob.STATUS_RUNNING, heartbeat_at=timezone.now())
+        self.assertEqual(requeue_stale_jobs(), 0)
+        running.refresh_from_db()
+        self.assertEqual(running.status, I3DMJob.STATUS_RUNNING)
+
+
+class JobClaimLockTests(JobQueueMixin, TransactionTestCase):
+
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    def test_claim_skips_locked_job(self):
+        first = I3DMJob.objects.get(id=self.submit().json()["job_id"])
+        second = I3DMJob.objects.get(id=self.submit().json()["job_id"])
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            # Worker khác đang giữ row của job đầu tiên
+            with transaction.atomic():
+                I3DMJob.objects.select_for_update().get(id=first.id)
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            self.assertEqual(claim_next_job().id, second.id)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(claim_next_job().id, first.id)
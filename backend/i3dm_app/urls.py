@@ -12,6 +12,12 @@ urlpatterns = [
     # ✅ NEW: Generate I3DM từ danh sách điểm (point-based)
     path('generate-from-points/', views.generate_i3dm_from_points, name='generate_i3dm_from_points'),
     
+    # ✅ Tile I3DM tạo tức thì, stream thẳng về client (không lưu)
+    path('stream-from-points/', views.stream_i3dm_from_points, name='stream_i3dm_from_points'),
+    
+    # ✅ Generate I3DM cách đều dọc polyline (heading theo tiếp tuyến)
+    path('generate-from-lines/', views.generate_i3dm_from_lines, name='generate_i3dm_from_lines'),
+    
     # ✅ Generate I3DM tileset từ bbox (lưu vào DB)
     path('generate/', views.generate_i3dm_tileset, name='generate_i3dm'),
     
@@ -32,4 +38,27 @@ urlpatterns = [
 
      # ✅ NEW: Upload endpoint
     path('generate-from-upload/', views.generate_i3dm_from_upload, name='generate_from_upload'),
+
+    # ✅ Upload file lớn theo chunk (resume, song song, kiểm tra SHA-256)
+    path('uploads/', views.create_upload_session, name='create_upload'),
+    path('uploads/<str:upload_id>/', views.upload_session, name='upload_session'),
+    path('uploads/<str:upload_id>/complete/', views.complete_upload_session, name='complete_upload'),
+
+    # ✅ Trạng thái terrain server (circuit breaker)
+    path('terrain/status/', views.get_terrain_status, name='terrain_status'),
+
+    # ✅ Độ cao terrain theo batch (JSON hoặc float64 nhị phân)
+    path('terrain/heights/', views.query_terrain_heights, name='terrain_heights'),
+
+    # ✅ Terrain quantized-mesh từ DEM local (Canh.url_terrain = /api/i3dm/terrain/tiles/)
+    path('terrain/tiles/layer.json', views.get_terrain_layer, name='terrain_layer'),
+    path('terrain/tiles/<int:z>/<int:x>/<int:y>.terrain', views.get_terrain_tile, name='terrain_tile'),
+
+    # ✅ Job generate chạy nền (progress / cancel)
+    path('jobs/', views.submit_i3dm_job, name='submit_job'),
+    path('jobs/<int:job_id>/', views.get_i3dm_job, name='job_detail'),
+    path('jobs/<int:job_id>/cancel/', views.cancel_i3dm_job, name='cancel_job'),
+
+    # ✅ Thống kê GLB cache
+    path('glb-cache/', views.get_glb_cache_stats, name='glb_cache_stats'),
 ]
\ No newline at end of file
@@ -1,17 +1,87 @@
+import gzip
 import json
-import random
+import mimetypes
 import os
-from django.http import JsonResponse
+import shutil
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
+from django.utils import timezone
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.core.exceptions import SuspiciousFileOperation
 from pathlib import Path
-import hashlib
 import time
-from .i3dm_generator import I3DMGenerator
-from .models import I3DMTileset
-from glb_app.models import GlbModel
-from .terrain_helper import query_terrain_height_batch, get_terrain_samples_for_bbox
+import numpy as np
+from .i3dm_generator import I3DMGenerator, glb_cache
+from .terrain_cache import height_cache
+from .precompress import choose_variant, parse_accept_encoding, strip_variant_suffix
+from .file_serving import (
+    IMMUTABLE_MAX_AGE,
+    FileRange,
+    content_addressed_token,
+    etag_for,
+    etag_matches,
+    parse_range,
+)
+from .quantized_mesh import (
+    TERRAIN_TILE_MAX_ZOOM,
+    dem_version,
+    get_terrain_tile as quantized_mesh_tile,
+    layer_json,
+    terrain_tile_cache,
+    tile_exists,
+)
+from .terrain_helper import (
+    get_dem_store,
+    query_single_terrain_height,
+    query_terrain_height_array,
+    terrain_client,
+)
+from .models import I3DMTileset, I3DMJob
+from .point_columns import BINARY_POINT_BYTES, JSON_POINT_MAX_BYTES
+from .chunked_upload import UploadError, upload_store
+from .generation import (
+    MAX_INSTANCES,
+    GenerationRequestError,
+    get_or_generate_tileset,
+    get_source_model,
+    parse_bbox_request,
+    parse_instance_order,
+    parse_lines_request,
+    parse_points_binary,
+    parse_points_request,
+    parse_points_stream,
+    point_arrays,
+    precompress_enabled,
+    run_bbox_generation,
+    run_lines_generation,
+    run_points_generation,
+    serializable_params,
+    shared_glb_dir,
+)
+
+
+# Số điểm tối đa mỗi request của API độ cao
+MAX_HEIGHT_POINTS = 1000000
+
+# Content-Type theo đuôi file gốc (bản .br / .gz giữ Content-Type của file gốc),
+# đuôi khác đoán bằng mimetypes
+TILE_CONTENT_TYPES = {
+    '.json': 'application/json',
+    '.i3dm': 'application/octet-stream',
+    '.b3dm': 'application/octet-stream',
+    '.glb': 'model/gltf-binary',
+    '.gltf': 'model/gltf+json',
+}
 
 
 @csrf_exempt
@@ -31,161 +101,40 @@ def generate_i3dm_tileset(request):
         },
         "count": 100,
         "height": 0,  // Offset từ mặt đất (m)
-        "scale": 1.0
+        "scale": 1.0,
+        "compact": false,  // true = feature table nén (quantized + oct-encoded)
+        "external_glb": false,  // true = I3DM trỏ URI tới GLB dùng chung thay vì nhúng
+        "order": null,  // "morton" / "hilbert" = sắp xếp instance trong tile theo đường cong lấp đầy
+        "placement": "uniform",  // "poisson" = blue-noise, các instance cách nhau >= min_distance
+        "min_distance": 5,  // m, bắt buộc với placement = "poisson"
+        "seed": 42,  // Tùy chọn - cùng seed + cùng request -> cùng vị trí (tileset được dùng lại)
+        "polygon": {"type": "Polygon", "coordinates": [...]},  // Tùy chọn - GeoJSON Polygon /
+                                                              // MultiPolygon (có lỗ), bbox mặc định = bbox polygon
+        "constraints": {  // Tùy chọn - bộ lọc vị trí theo DEM local
+            "max_slope": 30,  // độ
+            "min_elevation": 1,  // m (loại sông / biển)
+            "max_elevation": 1500,
+            "exclude": [{"min_lon": .., "max_lon": .., "min_lat": .., "max_lat": ..}]
+        }
     }
+    
+    Với count lớn / terrain chậm nên dùng POST /api/i3dm/jobs/ (chạy nền).
     """
     try:
         data = json.loads(request.body)
         
-        model_id = data.get('model_id')
-        bbox = data.get('bbox')
-        count = int(data.get('count', 100))
-        height_offset = float(data.get('height', 0))  # Offset từ terrain
-        scale = float(data.get('scale', 1.0))
-        
         print(f"\n NEW REQUEST")
         print(f"={'='*60}")
-        print(f"Model ID: {model_id}")
-        print(f"Count: {count}")
-        print(f"Height offset: {height_offset}m")
-        print(f"Scale: {scale}x")
+        print(f"Model ID: {data.get('model_id')}")
+        print(f"Count: {data.get('count', 100)}")
         
-        # Validation
-        if not model_id:
-            return JsonResponse({
-                'success': False,
-                'error': 'model_id is required'
-            }, status=400)
-        
-        if not bbox:
-            return JsonResponse({
-                'success': False,
-                'error': 'bbox is required'
-            }, status=400)
-        
-        required_bbox_keys = ['min_lon', 'max_lon', 'min_lat', 'max_lat']
-        if not all(key in bbox for key in required_bbox_keys):
-            return JsonResponse({
-                'success': False,
-                'error': f'bbox must contain: {required_bbox_keys}'
-            }, status=400)
-        
-        if count < 1 or count > 10000:
-            return JsonResponse({
-                'success': False,
-                'error': 'count must be between 1 and 10000'
-            }, status=400)
-        
-        # Get model from database
-        try:
-            model = GlbModel.objects.get(id=model_id)
-            print(f"✅ Found model: {model.name}")
-        except GlbModel.DoesNotExist:
-            return JsonResponse({
-                'success': False,
-                'error': f'Model with id {model_id} not found'
-            }, status=404)
-        
-        # Extract bbox coordinates
-        min_lon = float(bbox['min_lon'])
-        max_lon = float(bbox['max_lon'])
-        min_lat = float(bbox['min_lat'])
-        max_lat = float(bbox['max_lat'])
-        
-        # Validate bbox
-        if min_lon >= max_lon or min_lat >= max_lat:
-            return JsonResponse({
-                'success': False,
-                'error': 'Invalid bbox: min values must be less than max values'
-            }, status=400)
-        
-        print(f"📍 BBox: [{min_lon}, {min_lat}] → [{max_lon}, {max_lat}]")
-        
-        # 🔥🔥🔥 BƯỚC QUAN TRỌNG: Generate positions + Query terrain
-        print(f"\n⏳ Generating {count} positions with terrain heights...")
-        
-        coordinates = []
-        for _ in range(count):
-            lon = random.uniform(min_lon, max_lon)
-            lat = random.uniform(min_lat, max_lat)
-            coordinates.append((lon, lat))
-        
-        # Query terrain heights
-        print(f"🌍 Querying terrain heights...")
-        terrain_heights = query_terrain_height_batch(coordinates)
-        
-        # Build instances với terrain heights - KHÔNG CÓ ROTATION
-        instances = []
-        for i, ((lon, lat), terrain_h) in enumerate(zip(coordinates, terrain_heights)):
-            final_height = terrain_h + height_offset
-            
-            instances.append({
-                'lon': lon,
-                'lat': lat,
-                'height': final_height,  # ✅ Absolute height
-                'scale': scale,
-                # ❌ KHÔNG CÓ rotation_z - model tự đứng thẳng
-            })
-            
-            if (i + 1) % 100 == 0:
-                print(f"  ✓ Processed {i + 1}/{count}")
-        
-        print(f"✅ Generated {len(instances)} instances (NO ROTATION)")
-        print(f"   Terrain heights: {min(terrain_heights):.2f}m → {max(terrain_heights):.2f}m")
-        
-        # Create unique filenames
-        import hashlib
-        import time
-        unique_id = hashlib.md5(
-            f"{model_id}_{count}_{time.time()}".encode()
-        ).hexdigest()[:8]
-        
-        i3dm_filename = f'instances_{model_id}_{count}_{unique_id}.i3dm'
-        tileset_filename = f'tileset_{model_id}_{count}_{unique_id}.json'
-        
-        # Paths
-        i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
-        i3dm_dir.mkdir(parents=True, exist_ok=True)
-        
-        i3dm_path = i3dm_dir / i3dm_filename
-        tileset_path = i3dm_dir / tileset_filename
-        
-        # Get GLB file path
-        glb_path = model.glb_file.path
-        print(f"📦 Using GLB: {glb_path}")
-        
-        # Generate I3DM
-        print(f"⚙️  Generating I3DM file...")
-        generator = I3DMGenerator(glb_path)
-        generator.generate_i3dm(instances, i3dm_path)
-        
-        # Generate tileset.json
-        print(f"⚙️  Generating tileset.json...")
-        I3DMGenerator.create_tileset_json(
-            instances,
-            i3dm_filename,
-            tileset_path
-        )
-        
-        # Save to database
-        tileset_record = I3DMTileset.objects.create(
-            source_model=model,
-            name=f"{model.name} - {count} instances",
-            count=count,
-            min_lon=min_lon,
-            max_lon=max_lon,
-            min_lat=min_lat,
-            max_lat=max_lat,
-            height=height_offset,
-            scale=scale,
-            tileset_file=tileset_filename,
-            i3dm_file=i3dm_filename
-        )
-        print(f"💾 Saved to database: ID={tileset_record.id}")
+        params = parse_bbox_request(data)
+        tileset_record, reused = run_bbox_generation(params)
+        count = params['count']
         
         # Return URLs
-        tileset_url = f'/media/i3dm/{tileset_filename}'
-        i3dm_url = f'/media/i3dm/{i3dm_filename}'
+        tileset_url = f'/media/i3dm/{tileset_record.tileset_file}'
+        i3dm_url = f'/media/i3dm/{tileset_record.i3dm_file}'
         
         print(f"\n✅ SUCCESS!")
         print(f"   Tileset URL: {tileset_url}")
@@ -198,7 +147,8 @@ def generate_i3dm_tileset(request):
             'count': count,
             'tileset_url': tileset_url,
             'i3dm_url': i3dm_url,
-            'model_name': model.name,
+            'reused': reused,
+            'model_name': tileset_record.source_model.name,
             'message': f'Successfully created {count} instances with terrain clamping (NO ROTATION)'
         })
         
@@ -208,6 +158,12 @@ def generate_i3dm_tileset(request):
             'error': 'Invalid JSON in request body'
         }, status=400)
     
+    except GenerationRequestError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -390,7 +346,7 @@ def get_tilesets_by_model(request, model_id):
 @require_http_methods(["POST"])
 def cleanup_orphan_files(request):
     """
-    Xóa các files i3dm không có trong database
+    Xóa các files i3dm không có trong database (+ session upload theo chunk đã hết hạn)
     POST: /api/i3dm/cleanup/
     """
     try:
@@ -403,19 +359,26 @@ def cleanup_orphan_files(request):
                 'deleted': 0
             })
         
-        all_i3dm_files = set(f.name for f in i3dm_dir.glob('instances_*.i3dm'))
-        all_tileset_files = set(f.name for f in i3dm_dir.glob('tileset_*.json'))
+        # File đơn (instances_*.i3dm) hoặc thư mục quadtree (instances_*/)
+        # Bản nén sẵn (.br / .gz) đi theo file gốc
+        all_i3dm_files = set(f.name for f in i3dm_dir.glob('instances_*'))
+        all_tileset_files = set(f.name for f in i3dm_dir.glob('tileset_*.json*'))
         
-        db_i3dm_files = set(I3DMTileset.objects.values_list('i3dm_file', flat=True))
+        db_i3dm_files = set(
+            Path(f).parts[0] for f in I3DMTileset.objects.values_list('i3dm_file', flat=True)
+        )
         db_tileset_files = set(I3DMTileset.objects.values_list('tileset_file', flat=True))
         
-        orphan_i3dm = all_i3dm_files - db_i3dm_files
-        orphan_tileset = all_tileset_files - db_tileset_files
+        orphan_i3dm = {f for f in all_i3dm_files if strip_variant_suffix(f) not in db_i3dm_files}
+        orphan_tileset = {f for f in all_tileset_files if strip_variant_suffix(f) not in db_tileset_files}
         
         deleted_count = 0
         for filename in orphan_i3dm:
             file_path = i3dm_dir / filename
-            file_path.unlink()
+            if file_path.is_dir():
+                shutil.rmtree(file_path)
+            else:
+                file_path.unlink()
             deleted_count += 1
             print(f"🗑️ Deleted orphan: {filename}")
         
@@ -430,7 +393,8 @@ def cleanup_orphan_files(request):
             'message': f'Cleaned up {deleted_count} orphan files',
             'deleted': deleted_count,
             'orphan_i3dm': list(orphan_i3dm),
-            'orphan_tileset': list(orphan_tileset)
+            'orphan_tileset': list(orphan_tileset),
+            'stale_uploads': upload_store.cleanup_stale()
         })
         
     except Exception as e:
@@ -442,6 +406,20 @@ def cleanup_orphan_files(request):
         }, status=500)
 
 
+def read_points_params(request):
+    """
+    Params point-based từ body: application/octet-stream = cột float64 nhị phân
+    (tham số trong query string), còn lại parse JSON dần từ request
+    """
+    if request.content_type == 'application/octet-stream':
+        if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_INSTANCES * BINARY_POINT_BYTES:
+            raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed', status=413)
+        return parse_points_binary(request.read(), request.GET)
+    if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_INSTANCES * JSON_POINT_MAX_BYTES:
+        raise GenerationRequestError(f'Maximum {MAX_INSTANCES:,} instances allowed', status=413)
+    return parse_points_stream(request)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def generate_i3dm_from_points(request):
@@ -460,152 +438,173 @@ def generate_i3dm_from_points(request):
                 // ❌ KHÔNG CÓ rotation_z - model tự đứng thẳng
             },
             ...
-        ]
+        ],
+        "compact": false,  // true = feature table nén (quantized + oct-encoded)
+        "external_glb": false,  // true = I3DM trỏ URI tới GLB dùng chung thay vì nhúng
+        "order": null  // "morton" / "hilbert" = sắp xếp instance trong tile theo đường cong lấp đầy
     }
+    
+    Hoặc Content-Type: application/octet-stream - body là float64 little-endian dạng cột
+    (N lon, N lat, N height, N scale, N heading; 40 bytes / điểm), các field còn lại
+    trong query string: ?model_id=1&compact=1&external_glb=0&order=morton
     """
     try:
-        data = json.loads(request.body)
-        
-        model_id = data.get('model_id')
-        instances = data.get('instances', [])
+        params = read_points_params(request)
         
         print(f"\n🔥 NEW REQUEST - POINT-BASED I3DM (NO ROTATION)")
         print(f"={'='*60}")
-        print(f"Model ID: {model_id}")
-        print(f"Points count: {len(instances)}")
+        print(f"Model ID: {params['model_id']}")
+        print(f"Points count: {len(params['points']['lon'])}")
         
-        # Validation
-        if not model_id:
-            return JsonResponse({
-                'success': False,
-                'error': 'model_id is required'
-            }, status=400)
+        tileset_record, reused = run_points_generation(params)
+        count = tileset_record.count
         
-        if not instances or len(instances) == 0:
-            return JsonResponse({
-                'success': False,
-                'error': 'instances list is empty'
-            }, status=400)
-        
-        if len(instances) > 10000:
-            return JsonResponse({
-                'success': False,
-                'error': 'Maximum 10,000 instances allowed'
-            }, status=400)
-        
-        # Get model from database
-        try:
-            model = GlbModel.objects.get(id=model_id)
-            print(f"✅ Found model: {model.name}")
-        except GlbModel.DoesNotExist:
-            return JsonResponse({
-                'success': False,
-                'error': f'Model with id {model_id} not found'
-            }, status=404)
-        
-        # Validate each instance - CHỈ CẦN 3 KEY, KHÔNG CẦN rotation_z
-        for i, inst in enumerate(instances):
-            required_keys = ['lon', 'lat', 'height']
-            if not all(key in inst for key in required_keys):
-                return JsonResponse({
-                    'success': False,
-                    'error': f'Instance {i} missing required keys: {required_keys}'
-                }, status=400)
-        
-        # Calculate bbox from points
-        lons = [inst['lon'] for inst in instances]
-        lats = [inst['lat'] for inst in instances]
-        heights = [inst['height'] for inst in instances]
-        
-        min_lon = min(lons)
-        max_lon = max(lons)
-        min_lat = min(lats)
-        max_lat = max(lats)
+        # Return URLs
+        tileset_url = f'/media/i3dm/{tileset_record.tileset_file}'
+        i3dm_url = f'/media/i3dm/{tileset_record.i3dm_file}'
         
-        avg_height = sum(heights) / len(heights)
-        avg_scale = sum(inst.get('scale', 1.0) for inst in instances) / len(instances)
+        print(f"\n✅ SUCCESS!")
+        print(f"   Tileset URL: {tileset_url}")
+        print(f"   I3DM URL: {i3dm_url}")
+        print(f"   Total instances: {count} (NO ROTATION)")
+        print(f"={'='*60}\n")
         
-        print(f"📍 BBox: [{min_lon:.6f}, {min_lat:.6f}] → [{max_lon:.6f}, {max_lat:.6f}]")
-        print(f"📊 Heights: {min(heights):.2f}m → {max(heights):.2f}m (avg: {avg_height:.2f}m)")
-        print(f"📏 Scales: {avg_scale:.2f}x average")
+        return JsonResponse({
+            'success': True,
+            'id': tileset_record.id,
+            'count': count,
+            'tileset_url': tileset_url,
+            'i3dm_url': i3dm_url,
+            'reused': reused,
+            'model_name': tileset_record.source_model.name,
+            'message': f'Successfully created {count} instances with real terrain heights (NO ROTATION)'
+        })
         
-        # Log first 3 instances - KHÔNG LOG rotation_z
-        for i, inst in enumerate(instances[:3]):
-            print(f"\n📍 Instance {i+1}:")
-            print(f"   Position: {inst['lon']:.6f}, {inst['lat']:.6f}")
-            print(f"   Height: {inst['height']:.2f}m (REAL HEIGHT from pickPosition)")
-            print(f"   Scale: {inst.get('scale', 1.0):.2f}x")
-            print(f"   ✅ NO ROTATION - Model tự đứng thẳng")
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    
+    except GenerationRequestError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def stream_i3dm_from_points(request):
+    """
+    Tạo 1 tile I3DM tức thì và stream thẳng về client (không lưu file / DB) - dùng để xem trước
+    POST: /api/i3dm/stream-from-points/
+    
+    Request body: giống /generate-from-points/ (JSON hoặc nhị phân; model_id, instances, compact, order),
+    GLB luôn được nhúng (external_glb bị bỏ qua).
+    
+    Response: application/octet-stream, nội dung file .i3dm; header ghi từng phần,
+    GLB đọc từ file theo chunk nên không giữ cả tile trong memory.
+    """
+    try:
+        params = read_points_params(request)
+        model = get_source_model(params['model_id'])
         
-        if len(instances) > 3:
-            print(f"\n... and {len(instances) - 3} more instances")
+        generator = I3DMGenerator(
+            model.glb_file.path, debug=False, compact=params['compact'], order=params.get('order')
+        )
+        lon, lat, height, heading, scale = point_arrays(params)
+        writer = generator.i3dm_writer_arrays(lon, lat, height, heading=heading, scale=scale)
+        print(f"📤 Streaming I3DM: {len(lon)} instances, {writer.byte_length:,} bytes")
         
-        # Create unique filenames
-        unique_id = hashlib.md5(
-            f"{model_id}_{len(instances)}_{time.time()}".encode()
-        ).hexdigest()[:8]
+        response = StreamingHttpResponse(writer.iter_chunks(), content_type='application/octet-stream')
+        response['Content-Length'] = writer.byte_length
+        response['Content-Disposition'] = f'inline; filename="preview_{params["model_id"]}_{len(lon)}.i3dm"'
+        response['Cache-Control'] = 'no-store'
+        return response
         
-        i3dm_filename = f'instances_{model_id}_{len(instances)}_{unique_id}.i3dm'
-        tileset_filename = f'tileset_{model_id}_{len(instances)}_{unique_id}.json'
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    
+    except GenerationRequestError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def generate_i3dm_from_lines(request):
+    """
+    Tạo I3DM với instance cách đều dọc polyline (cây đường phố, cột đèn, hàng rào)
+    - heading theo hướng tiếp tuyến của line, độ cao clamp theo terrain
+    
+    Request body:
+    {
+        "model_id": 1,
+        "lines": {"type": "MultiLineString", "coordinates": [[[105.80, 21.02], [105.81, 21.03]], ...]},
+                 // GeoJSON LineString / MultiLineString / Feature(Collection) hoặc [[[lon, lat], ...], ...]
+        "spacing": 10,  // m giữa 2 instance liên tiếp (đo trên ellipsoid WGS84)
+        "offset": 0,  // m từ đầu mỗi line tới instance đầu tiên
+        "heading_offset": 0,  // ° cộng thêm vào heading theo tiếp tuyến
+        "height": 0,  // Offset từ mặt đất (m)
+        "scale": 1.0,
+        "compact": false,
+        "external_glb": false,
+        "order": null  // "morton" / "hilbert"
+    }
+    
+    Cả mạng đường lớn nên dùng POST /api/i3dm/jobs/ với "type": "lines".
+    """
+    try:
+        data = json.loads(request.body)
         
-        # Paths
-        i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
-        i3dm_dir.mkdir(parents=True, exist_ok=True)
-        
-        i3dm_path = i3dm_dir / i3dm_filename
-        tileset_path = i3dm_dir / tileset_filename
-        
-        # Get GLB file path
-        glb_path = model.glb_file.path
-        print(f"📦 Using GLB: {glb_path}")
-        
-        # Generate I3DM
-        print(f"⚙️  Generating I3DM file (NO ROTATION)...")
-        generator = I3DMGenerator(glb_path, debug=True)
-        generator.generate_i3dm(instances, i3dm_path)
-        
-        # Generate tileset.json
-        print(f"⚙️  Generating tileset.json...")
-        I3DMGenerator.create_tileset_json(
-            instances,
-            i3dm_filename,
-            tileset_path
-        )
+        print(f"\n🛣️  NEW REQUEST - LINE-BASED I3DM")
+        print(f"={'='*60}")
+        print(f"Model ID: {data.get('model_id')}")
+        print(f"Spacing: {data.get('spacing')}m")
         
-        # Save to database
-        tileset_record = I3DMTileset.objects.create(
-            source_model=model,
-            name=f"{model.name} - {len(instances)} instances (point-based, NO ROTATION)",
-            count=len(instances),
-            min_lon=min_lon,
-            max_lon=max_lon,
-            min_lat=min_lat,
-            max_lat=max_lat,
-            height=avg_height,
-            scale=avg_scale,
-            tileset_file=tileset_filename,
-            i3dm_file=i3dm_filename
-        )
-        print(f"💾 Saved to database: ID={tileset_record.id}")
+        params = parse_lines_request(data)
+        tileset_record, reused = run_lines_generation(params)
+        count = tileset_record.count
         
-        # Return URLs
-        tileset_url = f'/media/i3dm/{tileset_filename}'
-        i3dm_url = f'/media/i3dm/{i3dm_filename}'
+        tileset_url = f'/media/i3dm/{tileset_record.tileset_file}'
+        i3dm_url = f'/media/i3dm/{tileset_record.i3dm_file}'
         
         print(f"\n✅ SUCCESS!")
         print(f"   Tileset URL: {tileset_url}")
-        print(f"   I3DM URL: {i3dm_url}")
-        print(f"   Total instances: {len(instances)} (NO ROTATION)")
+        print(f"   Total instances: {count}")
         print(f"={'='*60}\n")
         
         return JsonResponse({
             'success': True,
             'id': tileset_record.id,
-            'count': len(instances),
+            'count': count,
             'tileset_url': tileset_url,
             'i3dm_url': i3dm_url,
-            'model_name': model.name,
-            'message': f'Successfully created {len(instances)} instances with real terrain heights (NO ROTATION)'
+            'reused': reused,
+            'model_name': tileset_record.source_model.name,
+            'message': f'Successfully created {count} instances along {len(params["lines"])} lines'
         })
         
     except json.JSONDecodeError:
@@ -614,6 +613,12 @@ def generate_i3dm_from_points(request):
             'error': 'Invalid JSON in request body'
         }, status=400)
     
+    except GenerationRequestError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -631,20 +636,35 @@ def generate_i3dm_from_upload(request):
     
     Request:
     - FormData với:
-      - glb_file: File GLB
+      - glb_file: File GLB, hoặc upload_id: session upload theo chunk đã complete (/uploads/)
       - instances: JSON string của array điểm
+      - compact: "true" = feature table nén (tùy chọn)
+      - external_glb: "true" = trỏ URI tới GLB dùng chung (tùy chọn)
+      - order: "morton" / "hilbert" = sắp xếp instance trong tile (tùy chọn)
     """
     try:
-        # Get uploaded file
+        # Get uploaded file (multipart hoặc session upload theo chunk)
         glb_file = request.FILES.get('glb_file')
-        if not glb_file:
+        upload_id = request.POST.get('upload_id')
+        if glb_file:
+            glb_name, glb_size = glb_file.name, glb_file.size
+        elif upload_id:
+            try:
+                upload = upload_store.completed(upload_id)
+            except UploadError as e:
+                return JsonResponse({
+                    'success': False,
+                    'error': str(e)
+                }, status=e.status)
+            glb_name, glb_size = upload['filename'], upload['size']
+        else:
             return JsonResponse({
                 'success': False,
                 'error': 'No GLB file uploaded'
             }, status=400)
         
         # Validate file extension
-        if not glb_file.name.lower().endswith('.glb'):
+        if not glb_name.lower().endswith('.glb'):
             return JsonResponse({
                 'success': False,
                 'error': 'Only .glb files are allowed'
@@ -672,16 +692,24 @@ def generate_i3dm_from_upload(request):
                 'error': 'instances list is empty'
             }, status=400)
         
-        if len(instances) > 10000:
+        if len(instances) > MAX_INSTANCES:
             return JsonResponse({
                 'success': False,
-                'error': 'Maximum 10,000 instances allowed'
+                'error': f'Maximum {MAX_INSTANCES:,} instances allowed'
             }, status=400)
         
+        try:
+            order = parse_instance_order(request.POST.get('order'))
+        except GenerationRequestError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=e.status)
+        
         print(f"\n🔥 NEW REQUEST - UPLOAD-BASED I3DM (NO ROTATION)")
         print(f"={'='*60}")
-        print(f"File: {glb_file.name}")
-        print(f"File size: {glb_file.size:,} bytes")
+        print(f"File: {glb_name}")
+        print(f"File size: {glb_size:,} bytes")
         print(f"Points count: {len(instances)}")
         
         # Validate each instance - CHỈ CẦN 3 KEY, KHÔNG CẦN rotation
@@ -710,75 +738,62 @@ def generate_i3dm_from_upload(request):
         print(f"📊 Heights: {min(heights):.2f}m → {max(heights):.2f}m (avg: {avg_height:.2f}m)")
         print(f"📏 Average scale: {avg_scale:.2f}x")
         
-        # Save uploaded GLB to temporary location
+        # File upload đã nằm trên disk (upload handler / session chunk) thì đọc tại chỗ,
+        # chỉ upload nhỏ (trong memory) mới phải ghi ra temp_uploads
         temp_dir = Path(settings.MEDIA_ROOT) / 'temp_uploads'
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        temp_glb_filename = f'temp_{int(time.time())}_{glb_file.name}'
-        temp_glb_path = temp_dir / temp_glb_filename
-        
-        # Write uploaded file
-        with open(temp_glb_path, 'wb+') as destination:
-            for chunk in glb_file.chunks():
-                destination.write(chunk)
-        
-        print(f"💾 Saved temp GLB: {temp_glb_path}")
-        
-        # Create unique filenames for I3DM
-        unique_id = hashlib.md5(
-            f"{glb_file.name}_{len(instances)}_{time.time()}".encode()
-        ).hexdigest()[:8]
-        
-        i3dm_filename = f'instances_upload_{len(instances)}_{unique_id}.i3dm'
-        tileset_filename = f'tileset_upload_{len(instances)}_{unique_id}.json'
-        
-        # Paths
-        i3dm_dir = Path(settings.MEDIA_ROOT) / 'i3dm'
-        i3dm_dir.mkdir(parents=True, exist_ok=True)
-        
-        i3dm_path = i3dm_dir / i3dm_filename
-        tileset_path = i3dm_dir / tileset_filename
-        
-        # Generate I3DM
-        print(f"⚙️  Generating I3DM file from uploaded GLB (NO ROTATION)...")
-        generator = I3DMGenerator(str(temp_glb_path), debug=True)
-        generator.generate_i3dm(instances, i3dm_path)
-        
-        # Generate tileset.json
-        print(f"⚙️  Generating tileset.json...")
-        I3DMGenerator.create_tileset_json(
-            instances,
-            i3dm_filename,
-            tileset_path
+        temp_glb_path = temp_dir / f'temp_{int(time.time())}_{os.path.basename(glb_name)}'
+        if upload_id and not glb_file:
+            glb_path = upload_store.claim(upload_id, temp_glb_path)
+        elif hasattr(glb_file, 'temporary_file_path'):
+            glb_path = Path(glb_file.temporary_file_path())
+            temp_glb_path = None
+        else:
+            temp_dir.mkdir(parents=True, exist_ok=True)
+            with open(temp_glb_path, 'wb+') as destination:
+                for chunk in glb_file.chunks():
+                    destination.write(chunk)
+            glb_path = temp_glb_path
+        
+        print(f"💾 GLB: {glb_path}")
+        
+        # Generate I3DM tiles + tileset.json (quadtree nếu nhiều instances)
+        print(f"⚙️  Generating I3DM tileset from uploaded GLB (NO ROTATION)...")
+        compact = request.POST.get('compact', '').lower() in ('1', 'true')
+        external_glb = request.POST.get('external_glb', '').lower() in ('1', 'true')
+        generator = I3DMGenerator(
+            str(glb_path), debug=True, compact=compact,
+            external_glb_dir=shared_glb_dir(external_glb), cache=False,
+            order=order, precompress=precompress_enabled()
         )
-        
-        # Create a temporary GlbModel record (optional - for tracking)
-        # Or save as I3DMTileset without source_model
-        tileset_record = I3DMTileset.objects.create(
-            source_model=None,  # No source model for uploads
-            name=f"{glb_file.name} - {len(instances)} instances (uploaded, NO ROTATION)",
-            count=len(instances),
-            min_lon=min_lon,
-            max_lon=max_lon,
-            min_lat=min_lat,
-            max_lat=max_lat,
-            height=avg_height,
-            scale=avg_scale,
-            tileset_file=tileset_filename,
-            i3dm_file=i3dm_filename
+        # Save as I3DMTileset without source_model
+        tileset_record, reused = get_or_generate_tileset(
+            generator,
+            f'upload_{len(instances)}',
+            generator.instances_to_arrays(instances),
+            dict(
+                source_model=None,  # No source model for uploads
+                name=f"{glb_name} - {len(instances)} instances (uploaded, NO ROTATION)",
+                count=len(instances),
+                min_lon=min_lon,
+                max_lon=max_lon,
+                min_lat=min_lat,
+                max_lat=max_lat,
+                height=avg_height,
+                scale=avg_scale,
+            )
         )
-        print(f"💾 Saved to database: ID={tileset_record.id}")
         
-        # Clean up temp file
-        try:
-            temp_glb_path.unlink()
-            print(f"🗑️ Cleaned up temp GLB file")
-        except Exception as e:
-            print(f"⚠️ Could not delete temp file: {e}")
+        # Clean up temp file (file tạm của upload handler do Django tự xóa)
+        if temp_glb_path is not None:
+            try:
+                temp_glb_path.unlink()
+                print(f"🗑️ Cleaned up temp GLB file")
+            except Exception as e:
+                print(f"⚠️ Could not delete temp file: {e}")
         
         # Return URLs
-        tileset_url = f'/media/i3dm/{tileset_filename}'
-        i3dm_url = f'/media/i3dm/{i3dm_filename}'
+        tileset_url = f'/media/i3dm/{tileset_record.tileset_file}'
+        i3dm_url = f'/media/i3dm/{tileset_record.i3dm_file}'
         
         print(f"\n✅ SUCCESS!")
         print(f"   Tileset URL: {tileset_url}")
@@ -792,7 +807,8 @@ def generate_i3dm_from_upload(request):
             'count': len(instances),
             'tileset_url': tileset_url,
             'i3dm_url': i3dm_url,
-            'model_name': glb_file.name,
+            'reused': reused,
+            'model_name': glb_name,
             'message': f'Successfully created {len(instances)} instances from uploaded file (NO ROTATION)'
         })
         
@@ -802,4 +818,477 @@ def generate_i3dm_from_upload(request):
         return JsonResponse({
             'success': False,
             'error': str(e)
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def create_upload_session(request):
+    """
+    Bắt đầu upload theo chunk (GLB / B3DM lớn, resume được)
+    POST: /api/i3dm/uploads/
+    
+    Request body:
+    {
+        "filename": "city.glb",
+        "size": 209715200,  // bytes
+        "sha256": "..."  // hex, kiểm tra khi complete
+    }
+    
+    Sau đó:
+    - PUT /api/i3dm/uploads/<upload_id>/ body = bytes của chunk, header Upload-Offset: <offset>
+      (các chunk gửi song song được, thứ tự tùy ý)
+    - GET /api/i3dm/uploads/<upload_id>/ = offset / các đoạn còn thiếu để resume
+    - POST /api/i3dm/uploads/<upload_id>/complete/ = kiểm tra SHA-256
+    - Dùng upload_id thay cho file ở /api/upload-glb/, /generate-from-upload/,
+      /QLModel/api/model-types/upload/ (glb_upload_id / b3dm_upload_id)
+    """
+    try:
+        data = json.loads(request.body)
+        session = upload_store.create(data.get('filename'), data.get('size'), data.get('sha256'))
+        return JsonResponse({'success': True, **session}, status=201)
+    
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    
+    except UploadError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT", "DELETE"])
+def upload_session(request, upload_id):
+    """
+    GET: trạng thái session (offset, received, missing)
+    PUT: ghi 1 chunk tại Upload-Offset (header) hoặc ?offset=, body = bytes của chunk
+    DELETE: hủy upload
+    /api/i3dm/uploads/<upload_id>/
+    """
+    try:
+        if request.method == 'GET':
+            return JsonResponse({'success': True, **upload_store.status(upload_id)})
+        
+        if request.method == 'DELETE':
+            upload_store.abort(upload_id)
+            return JsonResponse({'success': True, 'upload_id': upload_id})
+        
+        offset = request.headers.get('Upload-Offset', request.GET.get('offset'))
+        session = upload_store.write_chunk(upload_id, offset, request, request.META.get('CONTENT_LENGTH'))
+        return JsonResponse({'success': True, **session})
+
+    except UploadError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def complete_upload_session(request, upload_id):
+    """
+    Kết thúc upload: kiểm tra đủ byte + SHA-256
+    POST: /api/i3dm/uploads/<upload_id>/complete/
+    """
+    try:
+        return JsonResponse({'success': True, **upload_store.complete(upload_id)})
+    
+    except UploadError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+
+
+@require_http_methods(["GET"])
+def get_glb_cache_stats(request):
+    """
+    Thống kê GLB cache (hits / misses / bytes)
+    GET: /api/i3dm/glb-cache/
+    """
+    return JsonResponse({
+        'success': True,
+        'cache': glb_cache.stats()
+    })
+
+
+
+@require_http_methods(["GET"])
+def get_terrain_status(request):
+    """
+    Trạng thái terrain server (circuit breaker) + cache độ cao
+    GET: /api/i3dm/terrain/status/
+    """
+    return JsonResponse({
+        'success': True,
+        'url': terrain_client.url,
+        'breaker': terrain_client.breaker.stats(),
+        'cache': height_cache.stats(),
+        'tile_cache': terrain_tile_cache.stats()
+    })
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def query_terrain_heights(request):
+    """
+    Độ cao terrain cho nhiều điểm trong 1 request (DEM local, vectorized)
+    
+    GET:  /api/i3dm/terrain/heights/?lon=105.8&lat=21.0
+          -> {"height": 12.3}  (giống /api/height của terrain server cũ)
+    
+    POST JSON:
+    {
+        "coordinates": [[lon, lat], ...]   // hoặc "lon": [...], "lat": [...]
+    }
+    -> {"success": true, "count": N, "heights": [...]}
+    
+    POST Content-Type: application/octet-stream
+          body = float64 little-endian lon,lat xen kẽ (16 bytes / điểm)
+          -> float64 little-endian heights (8 bytes / điểm)
+    """
+    try:
+        if request.method == 'GET':
+            lon = float(request.GET['lon'])
+            lat = float(request.GET['lat'])
+            return JsonResponse({'height': query_single_terrain_height(lon, lat)})
+        
+        binary = request.content_type == 'application/octet-stream'
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        max_bytes = MAX_HEIGHT_POINTS * (16 if binary else 64)
+        if content_length > max_bytes:
+            return JsonResponse({
+                'success': False,
+                'error': f'Maximum {MAX_HEIGHT_POINTS:,} points per request'
+            }, status=413)
+        
+        # Đọc stream trực tiếp (request.body bị giới hạn DATA_UPLOAD_MAX_MEMORY_SIZE)
+        body = request.read()
+        
+        if binary:
+            if len(body) % 16:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Binary body must be float64 lon,lat pairs (16 bytes per point)'
+                }, status=400)
+            coords = np.frombuffer(body, dtype='<f8').reshape(-1, 2)
+            lon, lat = coords[:, 0], coords[:, 1]
+        else:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Request body must be a JSON object'
+                }, status=400)
+            if 'coordinates' in data:
+                coords = np.asarray(data['coordinates'], dtype=np.float64)
+                if coords.size and (coords.ndim != 2 or coords.shape[1] != 2):
+                    raise ValueError('coordinates must be a list of [lon, lat]')
+                coords = coords.reshape(-1, 2)
+                lon, lat = coords[:, 0], coords[:, 1]
+            else:
+                lon = np.asarray(data.get('lon', []), dtype=np.float64).ravel()
+                lat = np.asarray(data.get('lat', []), dtype=np.float64).ravel()
+                if lon.shape != lat.shape:
+                    raise ValueError('lon and lat must have the same length')
+        
+        if lon.size > MAX_HEIGHT_POINTS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Maximum {MAX_HEIGHT_POINTS:,} points per request'
+            }, status=413)
+        if not (np.all(np.abs(lon) <= 180) and np.all(np.abs(lat) <= 90)):
+            raise ValueError('Coordinates out of range')
+        
+        heights = query_terrain_height_array(lon, lat)
+        
+        if binary:
+            return HttpResponse(heights.astype('<f8').tobytes(), content_type='application/octet-stream')
+        return JsonResponse({
+            'success': True,
+            'count': int(heights.size),
+            'heights': heights.tolist()
+        })
+    
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Invalid coordinates: {e}'
+        }, status=400)
+
+
+@require_http_methods(["GET"])
+def get_terrain_layer(request):
+    """
+    layer.json của terrain quantized-mesh (dùng làm Canh.url_terrain)
+    GET: /api/i3dm/terrain/tiles/layer.json
+    """
+    max_zoom = getattr(settings, 'TERRAIN_TILE_MAX_ZOOM', TERRAIN_TILE_MAX_ZOOM)
+    response = JsonResponse(layer_json(max_zoom, dem_version(get_dem_store())))
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_http_methods(["GET"])
+def get_terrain_tile(request, z, x, y):
+    """
+    Terrain tile quantized-mesh (gzip)
+    GET: /api/i3dm/terrain/tiles/<z>/<x>/<y>.terrain
+    """
+    max_zoom = getattr(settings, 'TERRAIN_TILE_MAX_ZOOM', TERRAIN_TILE_MAX_ZOOM)
+    if not tile_exists(z, x, y, max_zoom):
+        return JsonResponse({
+            'success': False,
+            'error': f'Tile {z}/{x}/{y} not found'
+        }, status=404)
+    
+    data, _ = quantized_mesh_tile(get_dem_store(), z, x, y)
+    
+    # Theo q-value như serve_media_file: 'gzip;q=0' là từ chối, '*' áp dụng cho gzip
+    accepted = parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if accepted.get('gzip', accepted.get('*', 0.0)) > 0:
+        response = HttpResponse(data, content_type='application/vnd.quantized-mesh')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(data), content_type='application/vnd.quantized-mesh')
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_media_file(request, path):
+    """
+    Serve file media (tile I3DM, tileset.json, GLB, B3DM...) thay cho static() của Django
+    GET/HEAD: /media/<path>
+    
+    - Bản nén sẵn .br / .gz theo Accept-Encoding (nếu có)
+    - ETag mạnh theo hash nội dung, If-None-Match / If-Modified-Since -> 304
+    - Range 1 đoạn (206 / 416), If-Range
+    - File có hash trong tên (content-addressed) -> Cache-Control immutable 1 năm,
+      còn lại phải revalidate (trả 304 rất rẻ)
+    - FileResponse: cả file gửi bằng sendfile qua wsgi.file_wrapper (nếu server có), Range đọc từng block
+    """
+    try:
+        file_path = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404('File not found')
+    if not file_path.is_file():
+        raise Http404('File not found')
+    
+    content_type = TILE_CONTENT_TYPES.get(file_path.suffix.lower())
+    if content_type is None:
+        content_type = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+    
+    variant, encoding = choose_variant(file_path, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    stat = variant.stat()
+    etag = etag_for(file_path, path, file_path.stat(), encoding)
+    
+    if content_addressed_token(path):
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = 'public, max-age=0, must-revalidate'
+    
+    def with_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        response['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
+    
+    # ========== Conditional GET ==========
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = etag_matches(if_none_match, etag)
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = since is not None and int(stat.st_mtime) <= since
+    if not_modified:
+        return with_headers(HttpResponseNotModified())
+    
+    # ========== Range ==========
+    size = stat.st_size
+    byte_range = None
+    if request.method == 'GET':
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is None or if_range.strip() == etag:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    
+    if byte_range is False:
+        response = with_headers(HttpResponse(status=416, content_type=content_type))
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    elif byte_range:
+        response = FileResponse(FileRange(open(variant, 'rb'), start, length),
+                                content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = FileResponse(open(variant, 'rb'), content_type=content_type)
+    response['Content-Length'] = length
+    return with_headers(response)
+
+def serialize_job(job):
+    """JSON trạng thái job (kèm URL tileset khi xong)"""
+    data = {
+        'id': job.id,
+        'type': job.job_type,
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'stage_timings': job.stage_timings,
+        'error': job.error,
+        'cancel_requested': job.cancel_requested,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.tileset:
+        data['result'] = {
+            'id': job.tileset.id,
+            'count': job.tileset.count,
+            'tileset_url': f'/media/i3dm/{job.tileset.tileset_file}',
+            'i3dm_url': f'/media/i3dm/{job.tileset.i3dm_file}',
+            'reused': job.reused,
+        }
+    return data
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def submit_i3dm_job(request):
+    """
+    Tạo job generate chạy nền, trả về job id ngay
+    POST: /api/i3dm/jobs/
+    
+    Request body: giống /generate/ (type = "bbox"),
+    /generate-from-points/ (type = "points") hoặc
+    /generate-from-lines/ (type = "lines"), thêm field "type".
+    """
+    try:
+        data = json.loads(request.body)
+        job_type = data.get('type', I3DMJob.TYPE_BBOX)
+        
+        if job_type == I3DMJob.TYPE_BBOX:
+            params = parse_bbox_request(data)
+        elif job_type == I3DMJob.TYPE_POINTS:
+            params = parse_points_request(data)
+        elif job_type == I3DMJob.TYPE_LINES:
+            params = parse_lines_request(data)
+        else:
+            return JsonResponse({
+                'success': False,
+                'error': f'Unknown job type: {job_type}'
+            }, status=400)
+        
+        job = I3DMJob.objects.create(job_type=job_type, params=serializable_params(params))
+        print(f"📥 Queued job #{job.id} ({job_type})")
+        
+        return JsonResponse({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/i3dm/jobs/{job.id}/'
+        }, status=202)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON in request body'
+        }, status=400)
+    
+    except GenerationRequestError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def get_i3dm_job(request, job_id):
+    """
+    Trạng thái / progress / timings / kết quả của job
+    GET: /api/i3dm/jobs/<id>/
+    """
+    try:
+        job = I3DMJob.objects.select_related('tileset').get(id=job_id)
+        return JsonResponse({
+            'success': True,
+            'job': serialize_job(job)
+        })
+    except I3DMJob.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'error': 'Job not found'
+        }, status=404)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def cancel_i3dm_job(request, job_id):
+    """
+    Hủy job: pending -> hủy ngay, running -> worker dừng ở lần kiểm tra kế tiếp
+    POST: /api/i3dm/jobs/<id>/cancel/
+    """
+    try:
+        job = I3DMJob.objects.get(id=job_id)
+    except I3DMJob.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'error': 'Job not found'
+        }, status=404)
+    
+    if job.is_finished:
+        return JsonResponse({
+            'success': False,
+            'error': f'Job already {job.status}'
+        }, status=409)
+    
+    I3DMJob.objects.filter(id=job_id).update(cancel_requested=True)
+    # Job chưa được worker nhận thì hủy luôn
+    I3DMJob.objects.filter(id=job_id, status=I3DMJob.STATUS_PENDING).update(
+        status=I3DMJob.STATUS_CANCELLED,
+        finished_at=timezone.now()
+    )
+    job.refresh_from_db()
+    
+    return JsonResponse({
+        'success': True,
+        'job': serialize_job(job)
+    })